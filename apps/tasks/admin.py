@@ -1,5 +1,9 @@
 from django.contrib import admin
-from .models import Task, DailySession
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
+from .models import Task, DailySession, DecompositionCacheEntry, RequestProfile
 
 @admin.register(Task)
 class TaskAdmin(admin.ModelAdmin):
@@ -11,4 +15,52 @@ class TaskAdmin(admin.ModelAdmin):
 class DailySessionAdmin(admin.ModelAdmin):
     list_display = ('user', 'date', 'palace_theme', 'is_completed')
     list_filter = ('is_completed', 'palace_theme')
-    search_fields = ('user__username',) 
\ No newline at end of file
+    search_fields = ('user__username',)
+
+@admin.register(DecompositionCacheEntry)
+class DecompositionCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ('normalized_description', 'model', 'prompt_version', 'hits', 'expires_at')
+    list_filter = ('model', 'prompt_version')
+    search_fields = ('normalized_description',)
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'method', 'path', 'status_code', 'duration_ms', 'query_count', 'query_ms', 'user', 'downloads')
+    list_filter = ('view_name', 'status_code')
+    search_fields = ('path',)
+    exclude = ('stats',)
+    readonly_fields = ('downloads',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description='Download')
+    def downloads(self, obj):
+        return format_html(
+            '<a href="{}">report</a> | <a href="{}">pstats</a>',
+            reverse('admin:tasks_requestprofile_download', args=[obj.id, 'txt']),
+            reverse('admin:tasks_requestprofile_download', args=[obj.id, 'prof']),
+        )
+
+    def get_urls(self):
+        return [
+            path('<int:profile_id>/download/<str:kind>/', self.admin_site.admin_view(self.download), name='tasks_requestprofile_download'),
+        ] + super().get_urls()
+
+    def download(self, request, profile_id, kind):
+        profile = get_object_or_404(RequestProfile, id=profile_id)
+        if kind == 'prof':
+            extension = 'prof'
+            response = HttpResponse(bytes(profile.stats), content_type='application/octet-stream')
+        else:
+            extension = 'txt'
+            queries = '\n\n'.join(
+                f"{query['ms']} ms  {' <- '.join(reversed(query['origin']))}\n{query['sql']}" for query in profile.queries
+            )
+            body = f"{profile}\n\n{profile.report}\n{profile.query_count} queries, {profile.query_ms} ms\n\n{queries}\n"
+            response = HttpResponse(body, content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="request-profile-{profile.id}.{extension}"'
+        return response
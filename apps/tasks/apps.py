@@ -0,0 +1,18 @@
+from django.apps import AppConfig
+
+
+class TasksConfig(AppConfig):
+    name = 'apps.tasks'
+    label = 'tasks'
+
+    def ready(self):
+        from django.db import connections
+        from django.db.backends.signals import connection_created
+
+        from .middleware import install_query_recorder
+
+        # Before any connection is opened by a request, and for those opened
+        # already (e.g. by checks or the test runner)
+        connection_created.connect(install_query_recorder)
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(sender=type(connection), connection=connection)
@@ -0,0 +1,32 @@
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from services.notifications import palace_group_name
+
+
+class PalaceConsumer(AsyncJsonWebsocketConsumer):
+    """Pushes palace-ready and new sub-task events for the connected user's tasks to the dashboard"""
+
+    async def connect(self):
+        user = self.scope.get('user')
+        user_id = user.id if user is not None and user.is_authenticated else None
+        self.group_name = palace_group_name(user_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def palace_ready(self, event):
+        await self.send_json({
+            'type': 'palace.ready',
+            'task_id': event['task_id'],
+            'palace_image_url': event['palace_image_url'],
+            'palace_image_srcset': event.get('palace_image_srcset'),
+        })
+
+    async def sub_task_created(self, event):
+        await self.send_json({
+            'type': 'sub_task.created',
+            'task_id': event['task_id'],
+            'sub_task': event['sub_task'],
+        })
@@ -0,0 +1,52 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks import palace_pipeline
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the palace image pipeline stages (wall time, peak memory, bytes "
+        "written) and compare them with the stored baselines"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stages', nargs='+', choices=palace_pipeline.STAGES, default=palace_pipeline.STAGES)
+        parser.add_argument('--sizes', nargs='+', type=int, default=palace_pipeline.SIZES)
+        parser.add_argument('--layers', nargs='+', type=int, default=palace_pipeline.LAYER_COUNTS)
+        parser.add_argument('--repeat', type=int, default=5, help="Timed runs per stage; the best one is reported")
+        parser.add_argument('--baseline', default=palace_pipeline.BASELINE_PATH, help="Baseline JSON file")
+        parser.add_argument('--threshold', type=float, default=0.5,
+                            help="Fail when a stage is this much slower / bigger than its baseline (0.5 = 50%%)")
+        parser.add_argument('--save-baseline', action='store_true', help="Store these results as the new baselines")
+
+    def handle(self, *args, **options):
+        # Keep the pipeline's logging out of the report
+        logging.disable(logging.WARNING)
+        try:
+            results = palace_pipeline.run(options['stages'], options['sizes'], options['layers'], options['repeat'])
+        finally:
+            logging.disable(logging.NOTSET)
+        baselines = palace_pipeline.load_baselines(options['baseline'])
+
+        self.stdout.write(f"{'stage':<12} {'size':>5} {'layers':>6} {'wall ms':>9} {'baseline':>9} {'peak KB':>9} {'bytes':>9}")
+        for key, result in results.items():
+            stage, px, total_count = key.split('/')
+            baseline = baselines.get(key, {}).get('wall_ms')
+            self.stdout.write(
+                f"{stage:<12} {px:>5} {total_count:>6} {result['wall_ms']:>9.2f} "
+                f"{baseline if baseline is not None else '-':>9} {result['peak_kb']:>9.1f} {result['bytes']:>9}"
+            )
+
+        if options['save_baseline']:
+            palace_pipeline.save_baselines(results, options['baseline'])
+            self.stdout.write(self.style.SUCCESS(f"Saved {len(results)} baselines to {options['baseline']}"))
+            return
+
+        regressions = palace_pipeline.regressions(results, baselines, options['threshold'])
+        for key, metric, baseline, current in regressions:
+            self.stderr.write(f"{key}: {metric} {current} vs baseline {baseline}")
+        if regressions:
+            raise CommandError(f"{len(regressions)} benchmark regression(s) above {options['threshold']:.0%}")
+        self.stdout.write(self.style.SUCCESS("No regressions"))
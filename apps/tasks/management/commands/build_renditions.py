@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from apps.tasks.models import Task
+from services.palace_renditions import create_renditions, has_renditions
+
+
+class Command(BaseCommand):
+    help = "Write the WebP/JPEG renditions of palaces stored before renditions existed"
+
+    def handle(self, *args, **options):
+        names = set()
+        for palace_image, complete_palace_image in Task.objects.filter(parent__isnull=True).values_list(
+            'palace_image', 'complete_palace_image'
+        ):
+            names.update(name for name in (palace_image, complete_palace_image) if name)
+        created = 0
+        for name in sorted(names):
+            if has_renditions(name):
+                continue
+            try:
+                create_renditions(name)
+            except (OSError, ValueError) as e:
+                self.stderr.write(f"Skipped {name}: {e}")
+                continue
+            created += 1
+        self.stdout.write(f"Created renditions for {created} of {len(names)} palace images")
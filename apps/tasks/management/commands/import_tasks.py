@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.tasks.models import DailySession, Task
+from apps.tasks.tasks import decompose_batch, generate_palace_batch, process_imported_tasks
+from services.task_pipeline import create_pending_tasks, parse_task_lines
+
+
+class Command(BaseCommand):
+    help = "Import tasks from a text (one per line) or JSONL file, decomposed in batched LLM calls"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File with one task per line")
+        parser.add_argument('--user', help="Username to import the tasks for (default: no user)")
+        parser.add_argument('--sync', action='store_true', help="Run decomposition and palace generation in this process instead of on the workers")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"No user named {options['user']!r}")
+        try:
+            with open(options['path'], encoding='utf-8') as f:
+                descriptions = parse_task_lines(f.read())
+        except OSError as e:
+            raise CommandError(str(e))
+        if not descriptions:
+            raise CommandError("No tasks found")
+
+        today = timezone.now().date()
+        session, _ = DailySession.objects.get_or_create(user=user, date=today, defaults={"palace_theme": "Default"})
+        main_tasks = create_pending_tasks(session, descriptions)
+        self.stdout.write(f"Created {len(main_tasks)} pending tasks")
+
+        if not options['sync']:
+            process_imported_tasks(main_tasks)
+            self.stdout.write("Queued decomposition and palace generation")
+            return
+        task_ids = [main_task.id for main_task in main_tasks]
+        for start in range(0, len(task_ids), settings.DECOMPOSITION_BATCH_SIZE):
+            batch = task_ids[start:start + settings.DECOMPOSITION_BATCH_SIZE]
+            decompose_batch(batch)
+            generate_palace_batch(batch)
+            self.stdout.write(f"Processed {start + len(batch)}/{len(task_ids)} tasks")
+        failed = Task.objects.filter(id__in=task_ids, status=Task.Status.FAILED).count()
+        self.stdout.write(self.style.SUCCESS(f"Imported {len(task_ids)} tasks ({failed} failed)"))
@@ -0,0 +1,65 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from benchmarks import load_test
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive concurrent user sessions against add/, status, toggle_complete/, tasks/ and / "
+        "with the local AI backend, and report latency percentiles, DB queries and render backlog"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help="Concurrent virtual users")
+        parser.add_argument('--iterations', type=int, default=3, help="Tasks created per user")
+        parser.add_argument('--toggles', type=int, default=3, help="Sub-tasks toggled per task")
+        parser.add_argument('--status-timeout', type=float, default=60.0, help="Seconds to poll a task before moving on")
+        parser.add_argument('--chat-latency', type=float, default=settings.LOCAL_AI_CHAT_LATENCY_SECONDS,
+                            help="Artificial seconds per decomposition call")
+        parser.add_argument('--image-latency', type=float, default=settings.LOCAL_AI_IMAGE_LATENCY_SECONDS,
+                            help="Artificial seconds per image call")
+        parser.add_argument('--failure-rate', type=float, default=settings.LOCAL_AI_FAILURE_RATE,
+                            help="Share of provider calls that fail (0-1)")
+        parser.add_argument('--keep-data', action='store_true', help="Keep the load-test users and their tasks")
+
+    def handle(self, *args, **options):
+        overrides = override_settings(
+            AI_BACKEND='local',
+            LOCAL_AI_CHAT_LATENCY_SECONDS=options['chat_latency'],
+            LOCAL_AI_IMAGE_LATENCY_SECONDS=options['image_latency'],
+            LOCAL_AI_FAILURE_RATE=options['failure_rate'],
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+        )
+        mode = "eager (jobs run inside requests)" if settings.CELERY_TASK_ALWAYS_EAGER else "queued (needs running workers)"
+        self.stdout.write(f"{options['users']} users x {options['iterations']} tasks, Celery {mode}")
+        # Keep the pipeline's logging (including injected failures) out of the report
+        logging.disable(logging.WARNING)
+        try:
+            with overrides:
+                summary, backlog, elapsed, accounts = load_test.run(
+                    options['users'], options['iterations'], options['toggles'], options['status_timeout'],
+                )
+        finally:
+            logging.disable(logging.NOTSET)
+
+        self.stdout.write(f"{'endpoint':<22} {'requests':>8} {'errors':>6} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'queries':>8}")
+        for endpoint, row in summary.items():
+            self.stdout.write(
+                f"{endpoint:<22} {row['requests']:>8} {row['errors']:>6} {row['p50_ms']:>9.1f} "
+                f"{row['p99_ms']:>9.1f} {row['max_ms']:>9.1f} {row['queries']:>8.1f}"
+            )
+        total = sum(row['requests'] for row in summary.values())
+        self.stdout.write(f"{total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s)")
+        processing, behind = backlog[-1]
+        self.stdout.write(
+            f"Render backlog: {processing} tasks processing, {behind} palaces behind at the end "
+            f"(peak {max(sample[0] for sample in backlog)} / {max(sample[1] for sample in backlog)})"
+        )
+
+        if not options['keep_data']:
+            for account in accounts:
+                account.delete()
@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.tasks.middleware import make_profile_token
+
+
+class Command(BaseCommand):
+    help = "Print a signed token that has requests profiled (?profile=<token> or an X-Profile header)"
+
+    def handle(self, *args, **options):
+        self.stdout.write(make_profile_token())
+        self.stderr.write(f"Valid for {settings.PROFILE_TOKEN_MAX_AGE} seconds")
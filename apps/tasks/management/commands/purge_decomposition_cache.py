@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from services import decomposition_cache
+
+
+class Command(BaseCommand):
+    help = "Delete expired LLM decomposition cache entries"
+
+    def handle(self, *args, **options):
+        deleted = decomposition_cache.purge_expired()
+        self.stdout.write(f"Deleted {deleted} expired decomposition cache entries")
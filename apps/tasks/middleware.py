@@ -0,0 +1,260 @@
+"""
+Per-request timing and database query metrics, and on-demand profiling.
+
+Every database connection gets an execute wrapper (installed by the app
+config, apps.tasks.apps, when the connection is opened) that adds each query's duration to the statistics of
+the request being served. The statistics live in a context variable, so
+queries run by async views through sync_to_async are counted too.
+"""
+
+import contextvars
+import cProfile
+import io
+import logging
+import marshal
+import pstats
+import threading
+import time
+import traceback
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import signing
+
+from services import metrics
+
+
+logger = logging.getLogger('palace_builder.requests')
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def record(self, sql, seconds):
+        self.count += 1
+        self.seconds += seconds
+
+
+class QueryLog(QueryStats):
+    """QueryStats that also keeps every query and the project code that ran it"""
+    def __init__(self, parent=None):
+        super().__init__()
+        self.parent = parent
+        self.queries = []
+
+    def record(self, sql, seconds):
+        super().record(sql, seconds)
+        if self.parent is not None:
+            self.parent.record(sql, seconds)
+        self.queries.append({'sql': sql, 'ms': round(seconds * 1000, 3), 'origin': query_origin()})
+
+
+def query_origin(depth=3):
+    """The innermost project frames (outside site-packages) of the current stack"""
+    base_dir = str(settings.BASE_DIR)
+    frames = [
+        frame for frame in traceback.extract_stack()[:-1]
+        if frame.filename.startswith(base_dir) and 'site-packages' not in frame.filename
+        and frame.filename != __file__
+    ]
+    return [f"{frame.filename[len(base_dir) + 1:]}:{frame.lineno} in {frame.name}" for frame in frames[-depth:]]
+
+
+# QueryStats of the current request (or of whatever else sets it)
+current_query_stats = contextvars.ContextVar('current_query_stats', default=None)
+
+
+def record_queries(execute, sql, params, many, context):
+    stats = current_query_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.record(sql, time.perf_counter() - start)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
+
+
+class RequestMetricsMiddleware:
+    """
+    http_request_duration_seconds, db_queries_per_request and
+    db_query_duration_seconds summaries per view, method and status, plus one
+    structured log line per request
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        stats, token, start = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_query_stats.reset(token)
+        self._finish(request, response, stats, start)
+        return response
+
+    async def _acall(self, request):
+        stats, token, start = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_query_stats.reset(token)
+        self._finish(request, response, stats, start)
+        return response
+
+    def _start(self):
+        stats = QueryStats()
+        return stats, current_query_stats.set(stats), time.perf_counter()
+
+    def _finish(self, request, response, stats, start):
+        elapsed = time.perf_counter() - start
+        match = request.resolver_match
+        labels = {
+            'view': match.view_name if match else 'unmatched',
+            'method': request.method,
+            'status': response.status_code,
+        }
+        metrics.observe('http_request_duration_seconds', elapsed, **labels)
+        metrics.observe('db_queries_per_request', stats.count, **labels)
+        metrics.observe('db_query_duration_seconds', stats.seconds, **labels)
+        logger.info("%s %s %s", request.method, request.path, response.status_code, extra={
+            'view': labels['view'],
+            'duration_ms': round(elapsed * 1000, 2),
+            'db_queries': stats.count,
+            'db_ms': round(stats.seconds * 1000, 2),
+        })
+
+
+PROFILE_TOKEN_SALT = 'palace_builder.request_profile'
+# Slowest functions kept in RequestProfile.report
+PROFILE_REPORT_LINES = 60
+# cProfile hooks the interpreter: one profiled request per process at a time
+_profiling = threading.Lock()
+
+
+def make_profile_token():
+    return signing.TimestampSigner(salt=PROFILE_TOKEN_SALT).sign('profile')
+
+
+def _valid_profile_token(value):
+    try:
+        signing.TimestampSigner(salt=PROFILE_TOKEN_SALT).unsign(value, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+class RequestProfilingMiddleware:
+    """
+    Profile a single request on demand and save the report as a RequestProfile
+    (listed, with downloads, in the admin). A request is profiled when it has
+    ?profile=1 (or an X-Profile: 1 header) and comes from a staff user, or
+    carries a token from `manage.py profile_token` in either place. Other
+    requests only pay for the lookup of the parameter.
+
+    Async views are profiled on the event loop thread: work they hand to
+    sync_to_async shows up as time waiting, and its queries are listed
+    without the code that ran them (it is not on the worker thread's stack).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        if not self._requested(request) or not self._authorized(request) or not _profiling.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            profiler, queries, token, start = self._start()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+                current_query_stats.reset(token)
+        finally:
+            _profiling.release()
+        self._save(request, response, profiler, queries, start)
+        return response
+
+    async def _acall(self, request):
+        if not self._requested(request) or not await sync_to_async(self._authorized)(request):
+            return await self.get_response(request)
+        if not _profiling.acquire(blocking=False):
+            return await self.get_response(request)
+        try:
+            profiler, queries, token, start = self._start()
+            try:
+                response = await self.get_response(request)
+            finally:
+                profiler.disable()
+                current_query_stats.reset(token)
+        finally:
+            _profiling.release()
+        await sync_to_async(self._save)(request, response, profiler, queries, start)
+        return response
+
+    def _requested(self, request):
+        return settings.REQUEST_PROFILING_ENABLED and bool(request.GET.get('profile') or request.headers.get('X-Profile'))
+
+    def _authorized(self, request):
+        value = request.GET.get('profile') or request.headers.get('X-Profile')
+        if value == '1':
+            return request.user.is_staff
+        return _valid_profile_token(value)
+
+    def _start(self):
+        queries = QueryLog(parent=current_query_stats.get())
+        token = current_query_stats.set(queries)
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        return profiler, queries, token, start
+
+    def _path(self, request):
+        # Without the profile parameter, which may be a still valid token
+        query = request.GET.copy()
+        query.pop('profile', None)
+        return f"{request.path}?{query.urlencode()}" if query else request.path
+
+    def _save(self, request, response, profiler, queries, start):
+        from .models import RequestProfile
+
+        elapsed = time.perf_counter() - start
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(PROFILE_REPORT_LINES)
+        profiler.create_stats()
+        match = request.resolver_match
+        profile = RequestProfile.objects.create(
+            user=request.user if request.user.is_authenticated else None,
+            method=request.method,
+            path=self._path(request)[:500],
+            view_name=match.view_name if match else '',
+            status_code=response.status_code,
+            duration_ms=round(elapsed * 1000, 2),
+            query_count=queries.count,
+            query_ms=round(queries.seconds * 1000, 2),
+            report=report.getvalue(),
+            queries=queries.queries,
+            stats=marshal.dumps(profiler.stats),
+        )
+        response['X-Profile-Id'] = str(profile.id)
+        logger.info("Request profiled", extra={'profile_id': profile.id, 'path': request.path})
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 14:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0010_alter_dailysession_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('decomposing', 'Breaking down'), ('rendering', 'Building palace'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', help_text='Background processing stage, only for main tasks', max_length=16),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 14:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0011_task_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='palace_background_image',
+            field=models.ImageField(blank=True, help_text='Blurred and darkened complete palace shown behind unrevealed layers', null=True, upload_to='complete_palaces/backgrounds/'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2 on 2026-10-18 14:29
+
+import math
+import random
+
+from django.db import migrations, models
+
+
+def generate_reveal_geometry(apps, schema_editor):
+    """Store a wave for existing sub-tasks, seeded from the task id like new ones."""
+    Task = apps.get_model('tasks', 'Task')
+    sub_tasks = list(Task.objects.filter(parent__isnull=False, wave_amplitude__isnull=True))
+    for sub_task in sub_tasks:
+        rng = random.Random(sub_task.id)
+        sub_task.wave_amplitude = rng.randint(10, 25)
+        sub_task.wave_frequency = rng.uniform(1.5, 2.5)
+        sub_task.wave_phase = rng.uniform(0, 2 * math.pi)
+    Task.objects.bulk_update(sub_tasks, ['wave_amplitude', 'wave_frequency', 'wave_phase'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0012_task_palace_background_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='wave_amplitude',
+            field=models.IntegerField(blank=True, help_text='Reveal wave amplitude in px at 512px, only for sub-tasks', null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='wave_frequency',
+            field=models.FloatField(blank=True, help_text='Reveal wave periods across the image width, only for sub-tasks', null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='wave_phase',
+            field=models.FloatField(blank=True, help_text='Reveal wave phase in radians, only for sub-tasks', null=True),
+        ),
+        migrations.RunPython(generate_reveal_geometry, migrations.RunPython.noop),
+    ]
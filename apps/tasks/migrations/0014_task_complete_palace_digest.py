@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 14:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0013_task_reveal_geometry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='complete_palace_digest',
+            field=models.CharField(blank=True, default='', help_text='SHA-256 of the complete palace image, keys rendered palaces', max_length=64),
+        ),
+    ]
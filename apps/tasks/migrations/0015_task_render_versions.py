@@ -0,0 +1,28 @@
+# Generated by Django 4.2 on 2026-10-18 14:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0014_task_complete_palace_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='render_completed',
+            field=models.PositiveIntegerField(default=0, help_text='Version of the render currently in palace_image'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='render_lock_until',
+            field=models.DateTimeField(blank=True, help_text='Set while a palace render is in flight', null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='render_requested',
+            field=models.PositiveIntegerField(default=0, help_text='Version of the latest requested palace render'),
+        ),
+    ]
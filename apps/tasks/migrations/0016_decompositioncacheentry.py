@@ -0,0 +1,27 @@
+# Generated by Django 4.2 on 2026-10-18 14:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0015_task_render_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DecompositionCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('normalized_description', models.TextField()),
+                ('model', models.CharField(max_length=100)),
+                ('prompt_version', models.CharField(max_length=16)),
+                ('result', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('hits', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+def backfill_progress_counters(apps, schema_editor):
+    Task = apps.get_model('tasks', 'Task')
+    counters = {}
+    for parent_id, order, is_completed in Task.objects.filter(parent__isnull=False).values_list('parent_id', 'order', 'is_completed'):
+        total, completed, mask = counters.get(parent_id, (0, 0, 0))
+        if is_completed:
+            completed += 1
+            if order is not None and 0 < order <= 63:
+                mask |= 1 << (order - 1)
+        counters[parent_id] = (total + 1, completed, mask)
+    parents = list(Task.objects.filter(id__in=counters))
+    for parent in parents:
+        parent.sub_tasks_total, parent.sub_tasks_completed, parent.completion_mask = counters[parent.id]
+    Task.objects.bulk_update(parents, ['sub_tasks_total', 'sub_tasks_completed', 'completion_mask'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0016_decompositioncacheentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='completion_mask',
+            field=models.BigIntegerField(default=0, help_text='Bit (order - 1) set per completed sub-task, only for main tasks'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='sub_tasks_completed',
+            field=models.PositiveIntegerField(default=0, help_text='Number of completed sub-tasks, only for main tasks'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='sub_tasks_total',
+            field=models.PositiveIntegerField(default=0, help_text='Number of sub-tasks, only for main tasks'),
+        ),
+        migrations.RunPython(backfill_progress_counters, migrations.RunPython.noop),
+    ]
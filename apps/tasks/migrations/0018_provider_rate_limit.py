@@ -0,0 +1,36 @@
+# Generated by Django 4.2 on 2026-10-18 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0017_task_progress_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProviderRateBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint', models.CharField(max_length=32, unique=True)),
+                ('tokens', models.FloatField()),
+                ('refilled_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProviderTicket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint', models.CharField(max_length=32)),
+                ('priority', models.PositiveSmallIntegerField(help_text='0 is served first')),
+                ('active', models.BooleanField(default=False, help_text='Admitted and in flight')),
+                ('expires_at', models.DateTimeField(db_index=True, help_text='Waiting tickets are renewed while their caller polls')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='providerticket',
+            index=models.Index(fields=['endpoint', 'active', 'priority', 'id'], name='tasks_provi_endpoin_e9aead_idx'),
+        ),
+    ]
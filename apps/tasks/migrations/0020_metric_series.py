@@ -0,0 +1,25 @@
+# Generated by Django 4.2 on 2026-10-18 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0019_request_profile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricSeries',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=200)),
+                ('family', models.CharField(help_text='Metric the sample belongs to; a summary has _count and _sum samples', max_length=200)),
+                ('kind', models.CharField(help_text='counter or summary', max_length=16)),
+                ('labels', models.JSONField(default=list, help_text='[[label, value], ...], sorted by label')),
+                ('value', models.FloatField(default=0)),
+            ],
+        ),
+    ]
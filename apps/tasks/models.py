@@ -12,6 +12,13 @@ class DailySession(models.Model):
         return f"{self.user} - {self.date}"
 
 class Task(models.Model):
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        DECOMPOSING = 'decomposing', 'Breaking down'
+        RENDERING = 'rendering', 'Building palace'
+        READY = 'ready', 'Ready'
+        FAILED = 'failed', 'Failed'
+
     session = models.ForeignKey(DailySession, on_delete=models.CASCADE, related_name='tasks')
     title = models.CharField(max_length=255)
     category = models.CharField(max_length=32)  # creative/analytical/physical/admin
@@ -23,10 +30,91 @@ class Task(models.Model):
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, related_name='sub_tasks')
     palace_image = models.ImageField(upload_to='palaces/', blank=True, null=True)
     complete_palace_image = models.ImageField(upload_to='complete_palaces/', blank=True, null=True)
+    complete_palace_digest = models.CharField(max_length=64, blank=True, default='', help_text='SHA-256 of the complete palace image, keys rendered palaces')
+    palace_background_image = models.ImageField(upload_to='complete_palaces/backgrounds/', blank=True, null=True, help_text='Blurred and darkened complete palace shown behind unrevealed layers')
     time_estimate = models.IntegerField(null=True, blank=True, help_text='Estimated time to complete in minutes')
+    wave_amplitude = models.IntegerField(null=True, blank=True, help_text='Reveal wave amplitude in px at 512px, only for sub-tasks')
+    wave_frequency = models.FloatField(null=True, blank=True, help_text='Reveal wave periods across the image width, only for sub-tasks')
+    wave_phase = models.FloatField(null=True, blank=True, help_text='Reveal wave phase in radians, only for sub-tasks')
+    render_requested = models.PositiveIntegerField(default=0, help_text='Version of the latest requested palace render')
+    render_completed = models.PositiveIntegerField(default=0, help_text='Version of the render currently in palace_image')
+    render_lock_until = models.DateTimeField(null=True, blank=True, help_text='Set while a palace render is in flight')
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.READY, help_text='Background processing stage, only for main tasks')
+    sub_tasks_total = models.PositiveIntegerField(default=0, help_text='Number of sub-tasks, only for main tasks')
+    sub_tasks_completed = models.PositiveIntegerField(default=0, help_text='Number of completed sub-tasks, only for main tasks')
+    completion_mask = models.BigIntegerField(default=0, help_text='Bit (order - 1) set per completed sub-task, only for main tasks')
 
     def __str__(self):
         base = str(self.title)
         if self.time_estimate is not None:
             base += f" ({self.time_estimate} min)"
-        return base 
\ No newline at end of file
+        return base
+
+class DecompositionCacheEntry(models.Model):
+    """LLM task decomposition keyed by normalized description, model and prompt version"""
+    key = models.CharField(max_length=64, unique=True)
+    normalized_description = models.TextField()
+    model = models.CharField(max_length=100)
+    prompt_version = models.CharField(max_length=16)
+    result = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    hits = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.normalized_description[:60]} ({self.model})"
+
+class ProviderRateBucket(models.Model):
+    """Token bucket shared by all processes for one AI provider endpoint (services.rate_limit)"""
+    endpoint = models.CharField(max_length=32, unique=True)
+    tokens = models.FloatField()
+    refilled_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.endpoint}: {self.tokens:.1f} tokens"
+
+class ProviderTicket(models.Model):
+    """An AI provider call waiting for, or holding, a slot of its endpoint (services.rate_limit)"""
+    endpoint = models.CharField(max_length=32)
+    priority = models.PositiveSmallIntegerField(help_text='0 is served first')
+    active = models.BooleanField(default=False, help_text='Admitted and in flight')
+    expires_at = models.DateTimeField(db_index=True, help_text='Waiting tickets are renewed while their caller polls')
+
+    class Meta:
+        indexes = [models.Index(fields=['endpoint', 'active', 'priority', 'id'])]
+
+    def __str__(self):
+        return f"{self.endpoint} p{self.priority} ({'active' if self.active else 'waiting'})"
+
+class RequestProfile(models.Model):
+    """cProfile and SQL report of one request profiled on demand (apps.tasks.middleware.RequestProfilingMiddleware)"""
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    view_name = models.CharField(max_length=200, blank=True)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    query_count = models.PositiveIntegerField()
+    query_ms = models.FloatField()
+    report = models.TextField(help_text='Slowest functions by cumulative time')
+    queries = models.JSONField(default=list, help_text='SQL, duration in ms and the code that ran it, per query')
+    stats = models.BinaryField(help_text='pstats data, for snakeviz / pstats.Stats')
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
+
+class MetricSeries(models.Model):
+    """A counter or summary sample summed over every web and worker process (services.metrics)"""
+    key = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=200)
+    family = models.CharField(max_length=200, help_text='Metric the sample belongs to; a summary has _count and _sum samples')
+    kind = models.CharField(max_length=16, help_text='counter or summary')
+    labels = models.JSONField(default=list, help_text='[[label, value], ...], sorted by label')
+    value = models.FloatField(default=0)
+
+    def __str__(self):
+        return f"{self.name} {self.labels}: {self.value}"
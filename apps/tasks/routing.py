@@ -0,0 +1,7 @@
+from django.urls import path
+
+from .consumers import PalaceConsumer
+
+websocket_urlpatterns = [
+    path('ws/palaces/', PalaceConsumer.as_asgi()),
+]
@@ -0,0 +1,175 @@
+"""
+Celery tasks for task processing and palace rendering.
+
+A new task goes through decompose_task -> generate_complete_palace ->
+composite_palace, with Task.status tracking the current stage. Network calls
+(LLM and image provider) are retried with exponential backoff; compositing the
+revealed layers is pure CPU work on an image that already exists. Re-renders
+after toggles go through render_palace, which services.render_coordinator
+debounces and keeps single-flight per palace.
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from celery import Task as CeleryTask, chain, shared_task
+from django.conf import settings
+from django.db import connection
+from services.ai_backends import ProviderError
+
+from services.palace_generator import PalaceGenerationError, generate_complete_palace_once
+from services import rate_limit, render_coordinator, task_pipeline
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+
+class TaskStageJob(CeleryTask):
+    """Marks the main task as failed once a pipeline stage gives up retrying."""
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        task_ids = args[0] if isinstance(args[0], list) else [args[0]]
+        # A batch job failing part way leaves the tasks it finished alone
+        Task.objects.filter(id__in=task_ids).exclude(status=Task.Status.READY).update(status=Task.Status.FAILED)
+
+
+def process_new_task(main_task):
+    """Queue the background stages for a freshly created (pending) main task"""
+    chain(
+        decompose_task.si(main_task.id),
+        generate_complete_palace.si(main_task.id),
+        composite_palace.si(main_task.id),
+    ).delay()
+
+
+def process_imported_tasks(main_tasks):
+    """
+    Queue batched decomposition + palace generation for bulk-imported tasks,
+    one chain per DECOMPOSITION_BATCH_SIZE tasks
+    """
+    task_ids = [main_task.id for main_task in main_tasks]
+    batch_size = settings.DECOMPOSITION_BATCH_SIZE
+    for start in range(0, len(task_ids), batch_size):
+        batch = task_ids[start:start + batch_size]
+        chain(decompose_batch.si(batch), generate_palace_batch.si(batch)).delay()
+
+
+@shared_task(
+    base=TaskStageJob,
+    autoretry_for=(ProviderError,),
+    retry_backoff=5,
+    retry_backoff_max=120,
+    retry_jitter=True,
+    max_retries=3,
+)
+def decompose_task(task_id):
+    main_task = Task.objects.filter(id=task_id).first()
+    if main_task is None:
+        return
+    Task.objects.filter(id=task_id).update(status=Task.Status.DECOMPOSING)
+    task_pipeline.decompose_task(main_task)
+    Task.objects.filter(id=task_id).update(status=Task.Status.RENDERING)
+
+
+@shared_task(
+    base=TaskStageJob,
+    autoretry_for=(ProviderError,),
+    retry_backoff=5,
+    retry_backoff_max=120,
+    retry_jitter=True,
+    max_retries=3,
+)
+def decompose_batch(task_ids):
+    main_tasks = list(Task.objects.filter(id__in=task_ids).order_by('id'))
+    if not main_tasks:
+        return
+    Task.objects.filter(id__in=task_ids).update(status=Task.Status.DECOMPOSING)
+    # Imports queue behind decompositions users are waiting for
+    with rate_limit.priority('bulk'):
+        task_pipeline.decompose_tasks_batch(main_tasks)
+    Task.objects.filter(id__in=task_ids).update(status=Task.Status.RENDERING)
+
+
+@shared_task(base=TaskStageJob)
+def generate_palace_batch(task_ids):
+    """
+    Generate the palaces of a batch of imported tasks, at most
+    BULK_IMPORT_PARALLELISM image calls at a time. Palaces that fail go
+    through the regular, retried per-task path.
+    """
+    main_tasks = list(Task.objects.filter(id__in=task_ids))
+
+    def generate(main_task):
+        try:
+            with rate_limit.priority('bulk'):
+                return main_task, bool(generate_complete_palace_once(main_task))
+        except PalaceGenerationError as e:
+            logger.warning("Palace generation failed, queueing a retry", extra={'task_id': main_task.id, 'error': str(e)})
+            return main_task, False
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=settings.BULK_IMPORT_PARALLELISM) as pool:
+        outcomes = list(pool.map(generate, main_tasks))
+    for main_task, generated in outcomes:
+        if generated:
+            # A job per task, so a composite that fails only fails its own task
+            composite_palace.delay(main_task.id)
+        else:
+            chain(generate_complete_palace.si(main_task.id), composite_palace.si(main_task.id)).delay()
+
+
+@shared_task(
+    base=TaskStageJob,
+    autoretry_for=(PalaceGenerationError,),
+    retry_backoff=5,
+    retry_backoff_max=300,
+    retry_jitter=True,
+    max_retries=5,
+)
+def generate_complete_palace(task_id):
+    main_task = Task.objects.filter(id=task_id).first()
+    if main_task is None:
+        # Task was deleted while the job was queued
+        return
+    if not generate_complete_palace_once(main_task):
+        raise PalaceGenerationError(f"No complete palace generated for task {task_id}")
+
+
+@shared_task(base=TaskStageJob)
+def composite_palace(task_id):
+    main_task = Task.objects.filter(id=task_id).first()
+    if main_task is None:
+        return
+    # Render right away, under the same single-flight rules as toggles; the
+    # task becomes READY once a render of it has completed
+    render_palace(task_id, render_coordinator.bump_render_version(main_task), pipeline=True)
+
+
+@shared_task
+def render_palace(task_id, version, pipeline=False):
+    """
+    Render `version` of a palace. pipeline: this is the new task's own first
+    render, whose failure fails the task; a toggle's render never does (the
+    pipeline may still be generating the complete palace, 'not_ready').
+    """
+    outcome = render_coordinator.render_version(task_id, version)
+    if outcome == 'busy' and settings.CELERY_TASK_ALWAYS_EAGER:
+        # Eager mode ignores countdowns, so rescheduling would recurse right
+        # away: wait here for the render in flight, at most for its lock
+        deadline = time.monotonic() + settings.PALACE_RENDER_LOCK_SECONDS
+        while outcome == 'busy' and time.monotonic() < deadline:
+            time.sleep(settings.PALACE_RENDER_DEBOUNCE_SECONDS)
+            outcome = render_coordinator.render_version(task_id, version)
+    if outcome == 'busy' and not settings.CELERY_TASK_ALWAYS_EAGER:
+        # Another render of this palace is in flight; try again once it is done
+        render_palace.apply_async(
+            (task_id, version), {'pipeline': pipeline}, countdown=settings.PALACE_RENDER_DEBOUNCE_SECONDS,
+        )
+    elif outcome == 'rendered':
+        # The first render of a new task ends its pipeline
+        Task.objects.filter(id=task_id, status=Task.Status.RENDERING).update(status=Task.Status.READY)
+    elif outcome in ('failed', 'not_ready') and pipeline:
+        Task.objects.filter(id=task_id, status=Task.Status.RENDERING).update(status=Task.Status.FAILED)
+    return outcome
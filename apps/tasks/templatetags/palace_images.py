@@ -0,0 +1,34 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from services.palace_renditions import srcsets
+
+register = template.Library()
+
+
+@register.simple_tag
+def palace_picture(image, alt='', sizes='100vw', css_class='', img_id='', style='', data_atlas_url=''):
+    """
+    <picture> for a palace ImageField: WebP and JPEG renditions through
+    srcset/sizes, with the original PNG as the <img> fallback.
+
+        {% palace_picture task.palace_image alt="Palace" sizes="60px" %}
+
+    With `data_atlas_url` (client render mode) the image is swapped for a
+    canvas composed by static/js/palace_canvas.js.
+    """
+    sources = srcsets(image.name) or {}
+    return format_html(
+        '<picture>{}<img src="{}" alt="{}" sizes="{}" class="{}"{}{}{} loading="lazy" /></picture>',
+        format_html_join(
+            '', '<source type="{}" srcset="{}" sizes="{}">',
+            ((mime, srcset, sizes) for mime, srcset in sources.items()),
+        ),
+        image.url,
+        alt,
+        sizes,
+        css_class,
+        format_html(' id="{}"', img_id) if img_id else '',
+        format_html(' style="{}"', style) if style else '',
+        format_html(' data-palace-atlas-url="{}"', data_atlas_url) if data_atlas_url else '',
+    )
@@ -0,0 +1,695 @@
+import hashlib
+import io
+import json
+import math
+import random
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
+
+import httpx
+import numpy as np
+from PIL import Image
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from benchmarks.mask_benchmark import polygon_mask
+from services import decomposition_cache, metrics, nebius_client, rate_limit, render_coordinator
+from services.ai_backends import AIBackend, ProviderError, ProviderUnavailable
+from services.json_stream import DecompositionStreamParser
+from services.openai_service import analyze_task
+from services.palace_generator import (
+    create_layer_specific_mask,
+    ensure_reveal_geometry,
+    generate_complete_palace_once,
+    render_palace_state,
+)
+from services.palace_layers import get_layer_masks, has_layer_mask, layer_cache, layer_union_mask
+from services.palace_masks import build_layer_mask, wave_geometry
+from services.palace_plates import build_background_plate, get_palace_plates, plate_cache
+from services.palace_atlas import atlas_name
+from services.palace_store import complete_palace_digest, completion_bitmask, rendered_palace_name
+from services.task_progress import sub_task_deleted, toggle_completed
+
+from .middleware import QueryStats, current_query_stats, record_queries
+from .models import DailySession, MetricSeries, ProviderRateBucket, ProviderTicket, Task
+from .tasks import composite_palace, generate_palace_batch, render_palace
+
+
+def create_main_task(session, title='Write a novel', sub_tasks=3, completed=()):
+    """A main task with `sub_tasks` sub-tasks (orders 1..n) and its counters set"""
+    main_task = Task.objects.create(session=session, title=title, category='creative', complexity=3)
+    Task.objects.bulk_create([
+        Task(session=session, parent=main_task, title=f'Step {order}', category='creative', complexity=2,
+             order=order, is_completed=order in completed)
+        for order in range(1, sub_tasks + 1)
+    ])
+    Task.objects.filter(id=main_task.id).update(
+        sub_tasks_total=sub_tasks,
+        sub_tasks_completed=len(completed),
+        completion_mask=completion_bitmask(completed),
+    )
+    main_task.refresh_from_db()
+    return main_task
+
+
+class ScriptedBackend(AIBackend):
+    """AI backend answering every chat with `reply` (set per test)"""
+    name = 'scripted'
+    chat_model = 'test/scripted'
+    reply = ''
+
+    def chat(self, messages, max_tokens, temperature=0.1, stream=False):
+        return iter([self.reply]) if stream else self.reply
+
+    def generate_image(self, prompt, width, height):
+        raise NotImplementedError
+
+
+class FakeStream:
+    """Stands in for an openai Stream: the given chunks, and close()"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.closed = False
+
+    def __iter__(self):
+        return self.chunks
+
+    def close(self):
+        self.closed = True
+
+
+class PageQueryCountTests(TestCase):
+    """The index and dashboard use a fixed number of queries however many tasks there are"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('palace', password='x')
+        self.client.force_login(self.user)
+        self.session = DailySession.objects.create(user=self.user, date=timezone.now().date(), palace_theme='Default')
+
+    def query_count(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assert_constant_queries(self, url):
+        for i in range(2):
+            create_main_task(self.session, title=f'Task {i}', completed=(1,))
+        few = self.query_count(url)
+        for i in range(2, 12):
+            create_main_task(self.session, title=f'Task {i}', completed=(1, 2))
+        self.assertEqual(self.query_count(url), few)
+
+    def test_index(self):
+        self.assert_constant_queries(reverse('index'))
+
+    def test_dashboard(self):
+        self.assert_constant_queries(reverse('dashboard'))
+
+
+class DecompositionStreamParserTests(TestCase):
+    def feed(self, chunks):
+        parser = DecompositionStreamParser()
+        sub_tasks = []
+        for chunk in chunks:
+            sub_tasks.extend(parser.feed(chunk))
+        return sub_tasks, parser.close()
+
+    def test_sub_tasks_are_emitted_as_they_complete(self):
+        parser = DecompositionStreamParser()
+        self.assertEqual(parser.feed('{"category": "creative", "sub_tasks": [{"title": "a", "order": 1}, {"ti'), [
+            {'title': 'a', 'order': 1},
+        ])
+        self.assertEqual(parser.feed('tle": "b", "order": 2}]}'), [{'title': 'b', 'order': 2}])
+        self.assertEqual(parser.close()['category'], 'creative')
+
+    def test_think_blocks_and_comments_are_skipped(self):
+        text = '<think>{"sub_tasks": [{"title": "no"}]}</think>{"sub_tasks": [{"title": "yes", "time_estimate": 5 // minutes\n}]}'
+        # Split in every possible place, tags included
+        for split in range(len(text)):
+            sub_tasks, result = self.feed([text[:split], text[split:]])
+            self.assertEqual(sub_tasks, [{'title': 'yes', 'time_estimate': 5}])
+            self.assertEqual(result, {'sub_tasks': [{'title': 'yes', 'time_estimate': 5}]})
+
+    def test_nested_arrays_with_the_same_key_are_not_sub_tasks(self):
+        sub_tasks, result = self.feed(['{"meta": {"sub_tasks": [{"title": "no"}]}, "sub_tasks": [{"title": "yes"}]}'])
+        self.assertEqual(sub_tasks, [{'title': 'yes'}])
+
+    def test_malformed_strings_do_not_raise(self):
+        text = '{"category": "bad \\q escape", "note": "raw\tcontrol", "sub_tasks": [{"title": "a"}, {"title": "\\q"}]}'
+        sub_tasks, result = self.feed(text)
+        self.assertEqual(sub_tasks, [{'title': 'a'}])
+        self.assertIsNone(result)
+
+
+class ProgressCounterTests(TestCase):
+    def setUp(self):
+        self.session = DailySession.objects.create(date=timezone.now().date(), palace_theme='Default')
+        self.main_task = create_main_task(self.session, sub_tasks=4)
+
+    def sub_task(self, order):
+        return self.main_task.sub_tasks.get(order=order)
+
+    def assert_counters(self, total, completed_orders):
+        self.main_task.refresh_from_db()
+        self.assertEqual(self.main_task.sub_tasks_total, total)
+        self.assertEqual(self.main_task.sub_tasks_completed, len(completed_orders))
+        self.assertEqual(self.main_task.completion_mask, completion_bitmask(completed_orders))
+
+    def test_toggle_updates_the_parent(self):
+        parent = toggle_completed(self.sub_task(2))
+        self.assertEqual(parent.id, self.main_task.id)
+        self.assertEqual(parent.completion_mask, 0b10)
+        toggle_completed(self.sub_task(4))
+        self.assert_counters(4, [2, 4])
+        toggle_completed(self.sub_task(2))
+        self.assert_counters(4, [4])
+
+    def test_toggle_with_a_stale_instance_flips_the_current_state(self):
+        stale = self.sub_task(1)
+        toggle_completed(self.sub_task(1))
+        # `stale` still says not completed: the toggle re-reads and un-completes it
+        toggle_completed(stale)
+        self.assertFalse(stale.is_completed)
+        self.assert_counters(4, [])
+
+    def test_toggle_of_a_main_task_returns_none(self):
+        self.assertIsNone(toggle_completed(self.main_task))
+        self.main_task.refresh_from_db()
+        self.assertTrue(self.main_task.is_completed)
+
+    def test_deleting_sub_tasks(self):
+        toggle_completed(self.sub_task(3))
+        sub_task_deleted(self.sub_task(3))
+        self.sub_task(3).delete()
+        self.assert_counters(3, [])
+        sub_task_deleted(self.sub_task(1))
+        self.assert_counters(2, [])
+
+
+@override_settings(AI_BACKEND='apps.tasks.tests.ScriptedBackend', DECOMPOSITION_CACHE_TTL_SECONDS=60)
+class DecompositionCacheTests(TestCase):
+    result = {'category': 'creative', 'sub_tasks': [{'title': 'Outline', 'order': 1}]}
+
+    def setUp(self):
+        decomposition_cache.memory_cache.clear()
+
+    def test_normalization(self):
+        self.assertEqual(
+            decomposition_cache.normalize_description('  Write   a NOVEL!! '),
+            decomposition_cache.normalize_description('write a novel'),
+        )
+        self.assertEqual(decomposition_cache.normalize_description('Ｃafé—plan'), 'café plan')
+
+    def test_lookup_by_normalized_description_model_and_prompt_version(self):
+        decomposition_cache.put('Write a novel', 'model-a', '1', self.result)
+        decomposition_cache.memory_cache.clear()
+        self.assertEqual(decomposition_cache.get('write a  novel.', 'model-a', '1'), self.result)
+        self.assertIsNone(decomposition_cache.get('Write a novel', 'model-b', '1'))
+        self.assertIsNone(decomposition_cache.get('Write a novel', 'model-a', '2'))
+
+    def test_returns_copies(self):
+        decomposition_cache.put('Write a novel', 'model-a', '1', self.result)
+        decomposition_cache.get('Write a novel', 'model-a', '1')['sub_tasks'].clear()
+        self.assertEqual(decomposition_cache.get('Write a novel', 'model-a', '1'), self.result)
+
+    def test_expired_entries_are_not_served_and_are_purged(self):
+        decomposition_cache.put('Write a novel', 'model-a', '1', self.result)
+        later = timezone.now() + timedelta(seconds=61)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.assertIsNone(decomposition_cache.get('Write a novel', 'model-a', '1'))
+            self.assertEqual(decomposition_cache.purge_expired(), 1)
+
+    def test_only_valid_decompositions_are_cached(self):
+        for reply in ('{"category": "creative", "sub_tasks": "write it"}', '{"sub_tasks": []}', 'not json'):
+            with self.subTest(reply=reply), mock.patch.object(ScriptedBackend, 'reply', reply):
+                self.assertEqual(len(analyze_task('Write a novel')['sub_tasks']), 4)  # default_decomposition
+                self.assertIsNone(decomposition_cache.get('Write a novel', ScriptedBackend.chat_model, '1'))
+        with mock.patch.object(ScriptedBackend, 'reply', '{"category": "creative", "sub_tasks": [{"title": "Outline"}]}'):
+            analyze_task('Write a novel')
+        self.assertEqual(
+            decomposition_cache.get('Write a novel', ScriptedBackend.chat_model, '1')['sub_tasks'], [{'title': 'Outline'}],
+        )
+
+
+@override_settings(NEBIUS_RATE_LIMITS={'chat': {'rate': 1.0, 'burst': 2, 'concurrency': 1}})
+class RateLimitSchedulingTests(TestCase):
+    limits = {'rate': 1.0, 'burst': 2, 'concurrency': 1}
+
+    def setUp(self):
+        ProviderRateBucket.objects.create(endpoint='chat', tokens=2, refilled_at=timezone.now())
+
+    def ticket(self, priority, **fields):
+        return ProviderTicket.objects.create(
+            endpoint='chat', priority=rate_limit.PRIORITIES[priority],
+            expires_at=timezone.now() + timedelta(seconds=rate_limit.WAITING_TICKET_SECONDS), **fields,
+        )
+
+    def tokens(self):
+        return ProviderRateBucket.objects.get(endpoint='chat').tokens
+
+    def test_interactive_goes_before_older_bulk_tickets(self):
+        bulk = self.ticket('bulk')
+        interactive = self.ticket('interactive')
+        self.assertFalse(rate_limit._try_admit(bulk, self.limits)[0])
+        self.assertTrue(rate_limit._try_admit(interactive, self.limits)[0])
+
+    def test_same_priority_is_served_oldest_first(self):
+        first, second = self.ticket('bulk'), self.ticket('bulk')
+        self.assertFalse(rate_limit._try_admit(second, self.limits)[0])
+        self.assertTrue(rate_limit._try_admit(first, self.limits)[0])
+
+    def test_concurrency_cap(self):
+        self.ticket('interactive', active=True)
+        admitted, wait = rate_limit._try_admit(self.ticket('interactive'), self.limits)
+        self.assertFalse(admitted)
+        self.assertEqual(wait, rate_limit.POLL_SECONDS)
+
+    def test_admission_spends_one_token(self):
+        self.assertTrue(rate_limit._try_admit(self.ticket('interactive'), self.limits)[0])
+        self.assertAlmostEqual(self.tokens(), 1, places=1)
+
+    def test_expired_ticket_is_requeued_without_spending_a_token(self):
+        late = self.ticket('interactive')
+        ProviderTicket.objects.filter(id=late.id).delete()  # expired and cleaned up meanwhile
+        self.assertEqual(rate_limit._try_admit(late, self.limits), (False, 0))
+        self.assertAlmostEqual(self.tokens(), 2, places=1)
+        self.assertTrue(ProviderTicket.objects.filter(id=late.id, active=False).exists())
+
+    def test_streamed_calls_hold_their_slot_until_the_stream_is_done(self):
+        stream = nebius_client.call('chat', lambda timeout: FakeStream(['a', 'b']), 10, stream=True)
+        self.assertEqual(next(stream), 'a')
+        self.assertTrue(ProviderTicket.objects.filter(endpoint='chat', active=True).exists())
+        self.assertEqual(list(stream), ['b'])
+        self.assertFalse(ProviderTicket.objects.exists())
+
+    def test_closing_a_stream_gives_its_slot_back(self):
+        chunks = FakeStream(['a', 'b'])
+        stream = nebius_client.call('chat', lambda timeout: chunks, 10, stream=True)
+        next(stream)
+        stream.close()
+        self.assertTrue(chunks.closed)
+        self.assertFalse(ProviderTicket.objects.exists())
+
+
+class PrometheusRenderingTests(TestCase):
+    def setUp(self):
+        # Samples other tests (and requests) recorded in this process
+        metrics.flush()
+        MetricSeries.objects.all().delete()
+
+    def register_gauge(self, name, callback):
+        metrics.register_gauge(name, callback)
+        self.addCleanup(metrics._gauges.pop, name, None)
+
+    def test_counters_summaries_and_gauges(self):
+        metrics.increment('test_jobs_total', kind='decompose')
+        metrics.increment('test_jobs_total', 2, kind='decompose')
+        metrics.observe('test_latency_seconds', 0.5, stage='mask')
+        metrics.observe('test_latency_seconds', 0.25, stage='mask')
+        self.register_gauge('test_queue_depth', lambda: [((('queue', 'say "hi"'),), 7)])
+        lines = metrics.render_prometheus().splitlines()
+        for line in (
+            '# TYPE test_jobs_total counter',
+            'test_jobs_total{kind="decompose"} 3',
+            '# TYPE test_latency_seconds summary',
+            'test_latency_seconds_count{stage="mask"} 2',
+            'test_latency_seconds_sum{stage="mask"} 0.75',
+            '# TYPE test_queue_depth gauge',
+            'test_queue_depth{queue="say \\"hi\\""} 7',
+        ):
+            self.assertIn(line, lines)
+
+    def test_totals_include_other_processes(self):
+        # As flushed by a Celery worker
+        labels = [['outcome', 'rendered']]
+        MetricSeries.objects.create(
+            key=hashlib.sha256(json.dumps(['test_renders_total', labels]).encode()).hexdigest(),
+            name='test_renders_total', family='test_renders_total', kind='counter', labels=labels, value=5,
+        )
+        metrics.increment('test_renders_total', outcome='rendered')
+        self.assertIn('test_renders_total{outcome="rendered"} 6', metrics.render_prometheus().splitlines())
+
+    def test_failing_gauge_is_skipped(self):
+        self.register_gauge('test_broken', lambda: 1 / 0)
+        with self.assertLogs('services.metrics', 'ERROR'):
+            self.assertNotIn('test_broken', metrics.render_prometheus())
+
+
+@mock.patch('services.render_coordinator.srcsets', return_value={})
+@mock.patch('services.render_coordinator.notify_palace_ready')
+@mock.patch('services.render_coordinator.render_palace_state', return_value='palaces/rendered/palace.png')
+class RenderVersionTests(TestCase):
+    def setUp(self):
+        session = DailySession.objects.create(date=timezone.now().date(), palace_theme='Default')
+        self.main_task = create_main_task(session)
+        Task.objects.filter(id=self.main_task.id).update(complete_palace_image='complete_palaces/palace.png')
+
+    def set_status(self, status):
+        Task.objects.filter(id=self.main_task.id).update(status=status)
+
+    def status(self):
+        return Task.objects.values_list('status', flat=True).get(id=self.main_task.id)
+
+    def test_latest_version_wins(self, render_palace_state, *mocks):
+        first = render_coordinator.bump_render_version(self.main_task)
+        second = render_coordinator.bump_render_version(self.main_task)
+        self.assertEqual(render_coordinator.render_version(self.main_task.id, first), 'superseded')
+        self.assertEqual(render_coordinator.render_version(self.main_task.id, second), 'rendered')
+        self.assertEqual(render_palace_state.call_count, 1)
+        # Already rendered: a late duplicate job does nothing
+        self.assertEqual(render_coordinator.render_version(self.main_task.id, second), 'superseded')
+        self.main_task.refresh_from_db()
+        self.assertEqual(self.main_task.render_completed, second)
+        self.assertEqual(self.main_task.palace_image.name, 'palaces/rendered/palace.png')
+        self.assertIsNone(self.main_task.render_lock_until)
+
+    def test_busy_while_another_render_is_in_flight(self, render_palace_state, *mocks):
+        version = render_coordinator.bump_render_version(self.main_task)
+        Task.objects.filter(id=self.main_task.id).update(render_lock_until=timezone.now() + timedelta(seconds=30))
+        self.assertEqual(render_coordinator.render_version(self.main_task.id, version), 'busy')
+        render_palace_state.assert_not_called()
+
+    def test_failed_render(self, render_palace_state, *mocks):
+        render_palace_state.return_value = None
+        version = render_coordinator.bump_render_version(self.main_task)
+        self.assertEqual(render_coordinator.render_version(self.main_task.id, version), 'failed')
+        self.main_task.refresh_from_db()
+        self.assertEqual(self.main_task.render_completed, 0)
+
+    def test_not_ready_before_the_complete_palace_exists(self, render_palace_state, *mocks):
+        Task.objects.filter(id=self.main_task.id).update(complete_palace_image='')
+        version = render_coordinator.bump_render_version(self.main_task)
+        self.assertEqual(render_coordinator.render_version(self.main_task.id, version), 'not_ready')
+        render_palace_state.assert_not_called()
+
+    def test_toggle_while_the_palace_is_generated_does_not_fail_the_task(self, render_palace_state, *mocks):
+        Task.objects.filter(id=self.main_task.id).update(complete_palace_image='')
+        self.set_status(Task.Status.RENDERING)
+        version = render_coordinator.bump_render_version(self.main_task)
+        self.assertEqual(render_palace(self.main_task.id, version), 'not_ready')
+        self.assertEqual(self.status(), Task.Status.RENDERING)
+        # The pipeline's own render, once the complete palace is generated
+        Task.objects.filter(id=self.main_task.id).update(complete_palace_image='complete_palaces/palace.png')
+        version = render_coordinator.bump_render_version(self.main_task)
+        self.assertEqual(render_palace(self.main_task.id, version, pipeline=True), 'rendered')
+        self.assertEqual(self.status(), Task.Status.READY)
+
+    def test_only_the_pipeline_render_fails_the_task(self, render_palace_state, *mocks):
+        render_palace_state.return_value = None
+        self.set_status(Task.Status.RENDERING)
+        render_palace(self.main_task.id, render_coordinator.bump_render_version(self.main_task))
+        self.assertEqual(self.status(), Task.Status.RENDERING)
+        render_palace(self.main_task.id, render_coordinator.bump_render_version(self.main_task), pipeline=True)
+        self.assertEqual(self.status(), Task.Status.FAILED)
+
+
+class PalaceAtlasTests(TestCase):
+    def test_tasks_with_the_same_complete_image_get_their_own_atlas(self):
+        session = DailySession.objects.create(date=timezone.now().date(), palace_theme='Default')
+        first, second = create_main_task(session), create_main_task(session)
+        Task.objects.filter(id__in=[first.id, second.id]).update(complete_palace_digest='0' * 64)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertNotEqual(atlas_name(first, 3), atlas_name(second, 3))
+        self.assertEqual(atlas_name(first, 3), atlas_name(first, 3))
+
+
+class NebiusStreamTests(TestCase):
+    endpoint = 'test_stream'  # not rate limited
+
+    def setUp(self):
+        self.breaker = nebius_client.get_breaker(self.endpoint)
+        self.addCleanup(nebius_client._breakers.pop, self.endpoint)
+
+    def stream(self, chunks, deadline=10):
+        return nebius_client.call(self.endpoint, lambda timeout: FakeStream(chunks), deadline, stream=True)
+
+    def test_breaking_off_counts_against_the_breaker(self):
+        def chunks():
+            yield 'a'
+            raise httpx.ReadTimeout('stalled')
+
+        for _ in range(settings.NEBIUS_BREAKER_THRESHOLD):
+            with self.assertRaises(ProviderError):
+                list(self.stream(chunks()))
+        self.assertEqual(self.breaker.state, 'open')
+        with self.assertRaises(ProviderUnavailable):
+            self.stream(['a'])
+
+    def test_reading_past_the_deadline_fails(self):
+        stream = self.stream(['a', 'b'], deadline=0.05)
+        self.assertEqual(next(stream), 'a')
+        time.sleep(0.1)
+        with self.assertRaises(ProviderError):
+            next(stream)
+        self.assertEqual(self.breaker.failures, 1)
+
+    def test_a_completed_stream_closes_the_breaker(self):
+        self.breaker.failures = 2
+        self.assertEqual(list(self.stream(['a', 'b'])), ['a', 'b'])
+        self.assertEqual(self.breaker.failures, 0)
+
+
+class QueryRecorderTests(TestCase):
+    def test_queries_are_counted_per_request(self):
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+        try:
+            Task.objects.count()
+        finally:
+            current_query_stats.reset(token)
+        self.assertEqual(stats.count, 1)
+
+    def test_connections_opened_before_the_app_is_ready_are_recorded(self):
+        connection.execute_wrappers.remove(record_queries)
+        apps.get_app_config('tasks').ready()
+        self.assertIn(record_queries, connection.execute_wrappers)
+
+
+class BulkImportFailureTests(TestCase):
+    def setUp(self):
+        session = DailySession.objects.create(date=timezone.now().date(), palace_theme='Default')
+        self.main_tasks = [create_main_task(session, title=f'Task {i}') for i in range(2)]
+        Task.objects.update(status=Task.Status.RENDERING)
+
+    def statuses(self):
+        return set(Task.objects.filter(parent__isnull=True).values_list('status', flat=True))
+
+    @mock.patch('apps.tasks.tasks.generate_complete_palace_once', side_effect=RuntimeError('boom'))
+    def test_unexpected_errors_fail_the_batch(self, generate):
+        result = generate_palace_batch.apply(([main_task.id for main_task in self.main_tasks],), throw=False)
+        self.assertTrue(result.failed())
+        self.assertEqual(self.statuses(), {Task.Status.FAILED})
+
+    @mock.patch('services.render_coordinator.render_palace_state', side_effect=RuntimeError('boom'))
+    def test_unexpected_composite_errors_fail_the_task(self, render_palace_state):
+        Task.objects.update(complete_palace_image='complete_palaces/palace.png')
+        self.assertTrue(composite_palace.apply((self.main_tasks[0].id,), throw=False).failed())
+        self.main_tasks[0].refresh_from_db()
+        self.assertEqual(self.main_tasks[0].status, Task.Status.FAILED)
+
+
+class RevealMaskTests(SimpleTestCase):
+    def layers(self, total_count, seed=1):
+        rng = random.Random(seed)
+        return [
+            (order, rng.randint(10, 25), rng.uniform(1.5, 2.5), rng.uniform(0, 2 * math.pi))
+            for order in range(1, total_count + 1, 2)
+        ]
+
+    def test_matches_the_polygon_masks_it_replaced(self):
+        for total_count in (1, 4, 10, 30):
+            with self.subTest(layers=total_count):
+                layers = self.layers(total_count)
+                polygon = np.asarray(polygon_mask(layers, total_count, (512, 512)), dtype=int)
+                vectorized = np.asarray(build_layer_mask(layers, total_count, (512, 512)), dtype=int)
+                # Rasterization differs from the polygon fill only along the edges
+                self.assertLess(np.abs(polygon - vectorized).max(), 64)
+                self.assertLess(np.abs(polygon - vectorized).mean(), 8)
+
+    def test_built_at_the_palace_resolution(self):
+        layers = self.layers(4)
+        small = build_layer_mask(layers, 4, (512, 512), blur=False)
+        large = build_layer_mask(layers, 4, (1024, 1024), blur=False)
+        self.assertEqual(large.size, (1024, 1024))
+        # Same shape, scaled: the revealed share of the image is unchanged
+        self.assertAlmostEqual(np.asarray(small).mean(), np.asarray(large).mean(), delta=1)
+
+    def test_no_layers_reveal_nothing(self):
+        self.assertFalse(np.asarray(build_layer_mask([], 4)).any())
+        self.assertFalse(np.asarray(build_layer_mask([(5, 10, 2.0, 0.0)], 4)).any())
+
+
+def palace_png(size=(128, 128)):
+    """PNG bytes of a gradient standing in for a generated palace"""
+    gradient = np.linspace(0, 255, size[0] * size[1] * 3).astype(np.uint8).reshape(size[1], size[0], 3)
+    buf = io.BytesIO()
+    Image.fromarray(gradient, mode="RGB").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+class PalaceTestCase(TestCase):
+    """Main tasks whose complete palace is generated into a temporary MEDIA_ROOT"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        plate_cache.clear()
+        layer_cache.clear()
+        self.session = DailySession.objects.create(date=timezone.now().date(), palace_theme='Default')
+
+    def create_palace(self, sub_tasks=4):
+        main_task = create_main_task(self.session, sub_tasks=sub_tasks)
+        with mock.patch('services.palace_generator.call_nebius_api', return_value=palace_png()):
+            generate_complete_palace_once(main_task)
+        main_task.refresh_from_db()
+        return main_task
+
+
+class PalacePlateTests(PalaceTestCase):
+    def test_background_plate_is_persisted_with_the_palace(self):
+        main_task = self.create_palace()
+        self.assertTrue(main_task.palace_background_image)
+        self.assertTrue(default_storage.exists(main_task.palace_background_image.name))
+
+    def test_plates_are_decoded_once(self):
+        main_task = self.create_palace()
+        plate_cache.clear()
+        with mock.patch('services.palace_plates.build_background_plate') as build:
+            plates = get_palace_plates(main_task)
+            build.assert_not_called()  # read back, not blurred again
+        with mock.patch('services.palace_plates._open_rgb') as open_rgb:
+            self.assertIs(get_palace_plates(main_task), plates)
+            open_rgb.assert_not_called()
+
+    def test_palaces_without_a_stored_plate_get_one(self):
+        main_task = self.create_palace()
+        Task.objects.filter(id=main_task.id).update(palace_background_image='')
+        main_task.refresh_from_db()
+        plate_cache.clear()
+        complete, background = get_palace_plates(main_task)
+        main_task.refresh_from_db()
+        self.assertTrue(main_task.palace_background_image)
+        self.assertTrue(np.array_equal(np.asarray(background), np.asarray(build_background_plate(complete))))
+
+
+class RevealGeometryTests(PalaceTestCase):
+    def test_every_layer_gets_its_seeded_wave_when_the_palace_is_generated(self):
+        main_task = self.create_palace()
+        for sub in main_task.sub_tasks.all():
+            self.assertEqual((sub.wave_amplitude, sub.wave_frequency, sub.wave_phase), wave_geometry(sub.id))
+
+    def test_stored_waves_are_kept(self):
+        main_task = create_main_task(self.session)
+        Task.objects.filter(parent=main_task).update(wave_amplitude=12, wave_frequency=2.0, wave_phase=1.0)
+        ensure_reveal_geometry(list(main_task.sub_tasks.all()))
+        self.assertEqual(
+            set(main_task.sub_tasks.values_list('wave_amplitude', 'wave_frequency', 'wave_phase')), {(12, 2.0, 1.0)},
+        )
+
+    def test_the_same_state_renders_the_same_mask(self):
+        main_task = self.create_palace()
+        first = create_layer_specific_mask(main_task.sub_tasks.filter(order__in=[1, 3]), 4, (128, 128))
+        again = create_layer_specific_mask(main_task.sub_tasks.filter(order__in=[1, 3]), 4, (128, 128))
+        self.assertTrue(np.array_equal(np.asarray(first), np.asarray(again)))
+
+
+class RenderedPalaceStoreTests(PalaceTestCase):
+    def complete(self, main_task, *orders):
+        for sub in main_task.sub_tasks.filter(order__in=orders):
+            toggle_completed(sub)
+        main_task.refresh_from_db()
+        return main_task
+
+    def test_names_depend_on_every_input(self):
+        name = rendered_palace_name('ab' * 32, 1, 4, 0b101)
+        self.assertTrue(name.startswith('palaces/rendered/'))
+        self.assertEqual(name, rendered_palace_name('ab' * 32, 1, 4, 0b101))
+        others = [('cd' * 32, 1, 4, 0b101), ('ab' * 32, 2, 4, 0b101), ('ab' * 32, 1, 5, 0b101), ('ab' * 32, 1, 4, 0b100)]
+        for other in others:
+            self.assertNotEqual(rendered_palace_name(*other), name)
+
+    def test_a_state_rendered_before_is_reused(self):
+        main_task = self.complete(self.create_palace(), 1, 3)
+        name = render_palace_state(main_task)
+        self.assertTrue(default_storage.exists(name))
+        main_task = self.complete(main_task, 3)
+        self.assertNotEqual(render_palace_state(main_task), name)
+        # Toggled back on: found from the task's counters, nothing is composited
+        main_task = self.complete(main_task, 3)
+        with mock.patch('services.palace_generator.composite_plates') as composite:
+            self.assertEqual(render_palace_state(main_task), name)
+            composite.assert_not_called()
+
+    def test_single_layer_states_are_stored_with_the_palace(self):
+        main_task = self.complete(self.create_palace(), 2)
+        sub = main_task.sub_tasks.get(order=2)
+        self.assertEqual(render_palace_state(main_task), sub.layer_revealed_image.name)
+
+    def test_all_layers_completed_is_the_complete_palace(self):
+        main_task = self.complete(self.create_palace(), 1, 2, 3, 4)
+        self.assertEqual(render_palace_state(main_task), main_task.complete_palace_image.name)
+
+    def test_tasks_with_the_same_complete_image_do_not_share_renders(self):
+        first = self.complete(self.create_palace(), 1, 3)
+        second = self.complete(self.create_palace(), 1, 3)
+        self.assertEqual(complete_palace_digest(first), complete_palace_digest(second))
+        self.assertNotEqual(render_palace_state(first), render_palace_state(second))
+
+
+class LayerRevealTests(PalaceTestCase):
+    def test_bands_are_stored_unblurred_with_the_palace(self):
+        main_task = self.create_palace()
+        for sub in main_task.sub_tasks.all():
+            self.assertTrue(has_layer_mask(sub, 4))
+            with sub.layer_image.open('rb') as f:
+                self.assertEqual(set(np.unique(np.asarray(Image.open(f)))), {0, 255})
+
+    def test_union_of_bands_is_the_mask_built_from_scratch(self):
+        main_task = self.create_palace()
+        sub_tasks = list(main_task.sub_tasks.all())
+        complete, background = get_palace_plates(main_task)
+        for orders in ([1], [1, 2], [2, 4], [1, 2, 3]):
+            with self.subTest(orders=orders):
+                completed = [sub for sub in sub_tasks if sub.order in orders]
+                union = layer_union_mask(main_task, sub_tasks, completed, complete, background)
+                built = create_layer_specific_mask(completed, len(sub_tasks), complete.size)
+                self.assertTrue(np.array_equal(np.asarray(union), np.asarray(built)))
+
+    def test_bands_are_read_back_from_storage(self):
+        main_task = self.create_palace()
+        sub_tasks = list(main_task.sub_tasks.all())
+        complete, background = get_palace_plates(main_task)
+        stored = get_layer_masks(main_task, sub_tasks, complete, background)
+        layer_cache.clear()
+        with mock.patch('services.palace_layers.precompute_layer_reveals') as precompute:
+            masks = get_layer_masks(main_task, sub_tasks, complete, background)
+            precompute.assert_not_called()
+        for sub in sub_tasks:
+            self.assertTrue(np.array_equal(masks[sub.id], stored[sub.id]))
+
+    def test_a_changed_layer_count_recomputes_the_bands(self):
+        main_task = self.create_palace()
+        Task.objects.create(
+            session=self.session, parent=main_task, title='Step 5', category='creative', complexity=2, order=5,
+        )
+        sub_tasks = list(main_task.sub_tasks.all())
+        complete, background = get_palace_plates(main_task)
+        get_layer_masks(main_task, sub_tasks, complete, background)
+        for sub in main_task.sub_tasks.all():
+            self.assertTrue(has_layer_mask(sub, 5))
@@ -1,15 +1,28 @@
+import logging
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, get_object_or_404, redirect
 from django.views import View
 from .models import Task, DailySession
-from services.openai_service import analyze_task
+from .tasks import process_imported_tasks, process_new_task
+from services.palace_atlas import get_palace_atlas
+from services.palace_renditions import srcsets
+from services.task_pipeline import create_pending_tasks, parse_task_lines
+from services.task_progress import progress_percentage, sub_task_deleted, toggle_completed
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 from django.contrib.auth.models import User
 from django.views.generic.edit import DeleteView
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth import login as auth_login, authenticate
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, HttpResponseForbidden
 from django.http import JsonResponse
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Prefetch, Q
+
+logger = logging.getLogger(__name__)
 
 class IndexView(View):
     def get(self, request):
@@ -19,28 +32,25 @@ class IndexView(View):
         
         if session:
             tasks = session.tasks.filter(parent__isnull=True)
-            total_tasks = tasks.count()
-            completed_tasks = tasks.filter(is_completed=True).count()
+            stats = tasks.aggregate(
+                total_tasks=Count('id'),
+                completed_tasks=Count('id', filter=Q(is_completed=True)),
+                total_palaces=Count('id', filter=Q(palace_image__isnull=False)),
+            )
+            total_tasks = stats['total_tasks']
+            completed_tasks = stats['completed_tasks']
             in_progress_tasks = total_tasks - completed_tasks
-            total_palaces = tasks.filter(palace_image__isnull=False).count()
+            total_palaces = stats['total_palaces']
+            # Progress comes from the counters kept on each main task
             recent_tasks = tasks.order_by('-id')[:5]
-            
-            # Calculate progress for each task
             for task in recent_tasks:
-                subtasks = task.sub_tasks.all()
-                total_subtasks = subtasks.count()
-                completed_subtasks = subtasks.filter(is_completed=True).count()
-                if total_subtasks > 0:
-                    task.progress_percentage = (completed_subtasks / total_subtasks) * 100
-                else:
-                    task.progress_percentage = 0
-                task.total_subtasks = total_subtasks
-                task.completed_subtasks = completed_subtasks
+                task.progress_percentage = progress_percentage(task)
         else:
             total_tasks = completed_tasks = in_progress_tasks = total_palaces = 0
             recent_tasks = []
         
         context = {
+            'client_palace_rendering': settings.PALACE_RENDER_MODE == 'client',
             'total_tasks': total_tasks,
             'completed_tasks': completed_tasks,
             'in_progress_tasks': in_progress_tasks,
@@ -54,48 +64,116 @@ class TasksView(View):
         user = request.user if request.user.is_authenticated else None
         today = timezone.now().date()
         session = DailySession.objects.filter(user=user, date=today).first()
-        tasks = session.tasks.filter(parent__isnull=True) if session else []
-        return render(request, 'tasks/dashboard.html', {'tasks': tasks})
+        if session:
+            tasks = session.tasks.filter(parent__isnull=True).prefetch_related(
+                Prefetch('sub_tasks', queryset=Task.objects.order_by('order'), to_attr='ordered_sub_tasks')
+            )
+        else:
+            tasks = []
+        return render(request, 'tasks/dashboard.html', {
+            'tasks': tasks,
+            'client_palace_rendering': settings.PALACE_RENDER_MODE == 'client',
+        })
+
+async def request_user(request):
+    """request.user for async views (resolving it queries the session and user tables)"""
+    def resolve():
+        return request.user if request.user.is_authenticated else None
+    return await sync_to_async(resolve)()
 
 class TaskCreateView(View):
-    def post(self, request):
-        user = request.user if request.user.is_authenticated else None
+    """Async: only stores a pending task and queues the Celery pipeline"""
+    async def post(self, request):
+        user = await request_user(request)
         today = timezone.now().date()
-        session, _ = DailySession.objects.get_or_create(user=user, date=today, defaults={"palace_theme": "Default"})
+        session, _ = await DailySession.objects.aget_or_create(user=user, date=today, defaults={"palace_theme": "Default"})
         # Get task description from form
         task_description = request.POST.get('task_description', '').strip()
         if not task_description:
             return redirect('dashboard')
-        # Analyze with OpenAI
-        ai_result = analyze_task(task_description)
-        print('AI Result:', ai_result)
-        # Create main Task with AI results
-        main_task = Task.objects.create(
+        # Persist a pending task right away; decomposition and palace
+        # generation run on the Celery workers.
+        main_task = await Task.objects.acreate(
             session=session,
             title=task_description,
-            category=ai_result.get('category', ''),
-            complexity=ai_result.get('complexity', 1),
-            is_completed=False
+            category='',
+            complexity=1,
+            is_completed=False,
+            status=Task.Status.PENDING,
         )
-        # Generate the base image for the palace
-        from services.palace_generator import generate_palace_image
-        generate_palace_image(main_task)
-        print(f"Created main task: {main_task.title} (category: {main_task.category}, complexity: {main_task.complexity})")
-        # Create sub-tasks if present
-        for sub in ai_result.get('sub_tasks', []):
-            sub_task = Task.objects.create(
-                session=session,
-                title=sub.get('title', ''),
-                category=sub.get('category', ''),
-                complexity=sub.get('complexity', 1),
-                is_completed=False,
-                order=sub.get('order', 0),  # Add order from LLM
-                parent=main_task,
-                time_estimate=sub.get('time_estimate')  # Save time_estimate if present
-            )
-            print(f"Created sub-task: {sub_task.title} (order: {sub_task.order}, category: {sub_task.category}, complexity: {sub_task.complexity}, time_estimate: {sub_task.time_estimate})")
+        # Async views run in autocommit mode: the task is already committed
+        await sync_to_async(process_new_task)(main_task)
+        logger.info("Queued main task", extra={'task_id': main_task.id})
+        if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+            return JsonResponse({
+                'success': True,
+                'task_id': main_task.id,
+                'status': main_task.status,
+                'status_url': reverse('task_status', args=[main_task.id]),
+            }, status=202)
+        return redirect('dashboard')
+
+class TaskImportView(View):
+    def post(self, request):
+        user = request.user if request.user.is_authenticated else None
+        today = timezone.now().date()
+        session, _ = DailySession.objects.get_or_create(user=user, date=today, defaults={"palace_theme": "Default"})
+        upload = request.FILES.get('tasks_file')
+        if not upload:
+            return redirect('dashboard')
+        descriptions = parse_task_lines(upload.read().decode('utf-8', errors='replace'))
+        descriptions = descriptions[:settings.BULK_IMPORT_MAX_TASKS]
+        main_tasks = create_pending_tasks(session, descriptions)
+        transaction.on_commit(lambda: process_imported_tasks(main_tasks))
+        logger.info("Queued imported tasks", extra={'tasks': len(main_tasks)})
+        if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+            return JsonResponse({
+                'success': True,
+                'task_ids': [main_task.id for main_task in main_tasks],
+            }, status=202)
         return redirect('dashboard')
 
+class TaskStatusView(View):
+    """Async: polled by pages while a task is processed in the background"""
+    async def get(self, request, task_id):
+        try:
+            task = await Task.objects.aget(id=task_id)
+        except Task.DoesNotExist:
+            raise Http404("No Task matches the given query.")
+        sub_tasks = [sub async for sub in task.sub_tasks.order_by('order')]
+        palace_image_srcset = await sync_to_async(srcsets)(task.palace_image.name) if task.palace_image else None
+        return JsonResponse({
+            'task_id': task.id,
+            'status': task.status,
+            'status_display': task.get_status_display(),
+            'category': task.category,
+            'complexity': task.complexity,
+            'palace_image_url': task.palace_image.url if task.palace_image else None,
+            'palace_image_srcset': palace_image_srcset,
+            'complete_palace_image_url': task.complete_palace_image.url if task.complete_palace_image else None,
+            # From the counters on the task row, like the index page
+            'progress': int(progress_percentage(task)),
+            'sub_tasks': [
+                {
+                    'id': sub.id,
+                    'title': sub.title,
+                    'order': sub.order,
+                    'is_completed': sub.is_completed,
+                    'time_estimate': sub.time_estimate,
+                }
+                for sub in sub_tasks
+            ],
+        })
+
+class TaskPalaceView(View):
+    """Complete palace, background plate and layer atlas for client-side compositing"""
+    def get(self, request, task_id):
+        task = get_object_or_404(Task, id=task_id, parent__isnull=True)
+        if not task.complete_palace_image:
+            return JsonResponse({'error': 'Palace not generated yet', 'status': task.status}, status=409)
+        sub_tasks = list(task.sub_tasks.all())
+        return JsonResponse(get_palace_atlas(task, sub_tasks))
+
 class TaskCompleteView(View):
     def post(self, request, task_id):
         # Placeholder: mark task as complete
@@ -104,27 +182,27 @@ class TaskCompleteView(View):
 class TaskToggleCompleteView(View):
     def post(self, request, task_id):
         task = get_object_or_404(Task, id=task_id)
-        task.is_completed = not task.is_completed
-        task.save()
-        # If this is a sub-task and is now completed, trigger palace image generation
-        if task.parent and task.is_completed:
-            from services.palace_generator import trigger_palace_generation_async
-            trigger_palace_generation_async(task.parent)
+        parent = toggle_completed(task)
+        # If this is a sub-task, re-render the palace for the new completion state
+        # (states rendered before are reused from the palace store). In client
+        # render mode the browser composes it from the layer atlas instead.
+        if parent and settings.PALACE_RENDER_MODE != 'client':
+            from services.render_coordinator import request_palace_render
+            request_palace_render(parent)
         # AJAX support
         if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-            parent = task.parent
             palace_image_url = parent.palace_image.url if parent and parent.palace_image else None
             complete_palace_image_url = parent.complete_palace_image.url if parent and parent.complete_palace_image else None
-            # Calculate progress
+            # Progress from the parent's counters
             if parent:
-                total = parent.sub_tasks.count()
-                completed = parent.sub_tasks.filter(is_completed=True).count()
-                progress = int((completed / total) * 100) if total > 0 else 0
+                total = parent.sub_tasks_total
+                completed = parent.sub_tasks_completed
+                progress = int(progress_percentage(parent))
                 all_completed = (completed == total and total > 0)
             else:
                 progress = 0
                 all_completed = False
-            return JsonResponse({
+            response = {
                 'success': True,
                 'is_completed': task.is_completed,
                 'palace_image_url': palace_image_url,
@@ -133,14 +211,23 @@ class TaskToggleCompleteView(View):
                 'all_completed': all_completed,
                 'subtask_id': task.id,
                 'parent_id': parent.id if parent else None,
-            })
+            }
+            if parent and settings.PALACE_RENDER_MODE == 'client':
+                # The browser composes the palace from the completed sub-task ids
+                response['completed_sub_task_ids'] = list(
+                    parent.sub_tasks.filter(is_completed=True).values_list('id', flat=True)
+                )
+            return JsonResponse(response)
         return redirect('dashboard') 
 
 class TaskDeleteView(View):
     def post(self, request, task_id):
         task = get_object_or_404(Task, id=task_id)
         # Optionally: delete all sub-tasks as well
-        task.delete()
+        with transaction.atomic():
+            if task.parent_id:
+                sub_task_deleted(task)
+            task.delete()
         return redirect('dashboard')
 
 class SubTaskEditView(View):
@@ -150,9 +237,28 @@ class SubTaskEditView(View):
         subtask.complexity = request.POST.get('complexity', subtask.complexity)
         time_estimate = request.POST.get('time_estimate')
         subtask.time_estimate = int(time_estimate) if time_estimate else None
-        subtask.save()
+        # Leave is_completed alone, it may have been toggled meanwhile
+        subtask.save(update_fields=['title', 'complexity', 'time_estimate'])
         return redirect('dashboard') 
 
+class MetricsView(View):
+    """Prometheus scrape endpoint"""
+    def get(self, request):
+        # Importing them registers their gauges (render backlog, Nebius queue)
+        from services import metrics, rate_limit, render_coordinator
+        if not self.authorized(request):
+            return HttpResponseForbidden()
+        return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    def authorized(self, request):
+        expected = f'Bearer {settings.METRICS_TOKEN}'
+        if settings.METRICS_TOKEN and constant_time_compare(request.headers.get('Authorization', ''), expected):
+            return True
+        if request.user.is_staff:
+            return True
+        # Open for local development only
+        return settings.DEBUG and not settings.METRICS_TOKEN
+
 class RegistrationView(View):
     def get(self, request):
         form = UserCreationForm()
@@ -0,0 +1,180 @@
+"""
+Endpoint load test, run by `python manage.py load_test`.
+
+Concurrent virtual users drive the app in-process through Django's test
+client, against the local AI backend (with its artificial latency and
+failure rate), each repeating a realistic session:
+
+    GET  /                        home page
+    POST add/                     create a task (AJAX)
+    GET  tasks/<id>/status/       poll until decomposed and rendered
+    POST toggle_complete/<id>/    tick off some sub-tasks (AJAX)
+    GET  tasks/                   dashboard
+
+Reported per endpoint: request count, errors, p50/p99/max latency and mean
+DB queries per request, plus the background render backlog (main tasks
+still processing, and palaces whose latest requested render has not
+completed) sampled every second.
+
+With CELERY_TASK_ALWAYS_EAGER the background jobs run inside the add/ and
+toggle requests, so their latency includes decomposition and rendering.
+Otherwise run Celery workers next to it (with the same AI_BACKEND and
+LOCAL_AI_* settings) to measure the web tier and the queue separately.
+"""
+
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from django.db import close_old_connections, connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from services.render_coordinator import render_backlog
+
+
+logger = logging.getLogger(__name__)
+
+
+ENDPOINTS = ('index', 'add_task', 'task_status', 'toggle_task_complete', 'dashboard')
+AJAX = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+TASK_DESCRIPTIONS = [
+    "Write the quarterly report",
+    "Plan a birthday party",
+    "Clean out the garage",
+    "Learn the basics of Rust",
+    "Train for a 10k run",
+    "Reorganize the team wiki",
+]
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+class Recorder:
+    """Thread-safe per-endpoint latency, query count and error samples"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def request(self, endpoint, send):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            try:
+                response = send()
+            except Exception as e:
+                response = None
+                logger.error("Load test request raised", extra={'endpoint': endpoint, 'error': repr(e)})
+            elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies[endpoint].append(elapsed)
+            self.queries[endpoint].append(len(captured))
+            if response is None or response.status_code >= 400:
+                self.errors[endpoint] += 1
+        return response
+
+    def summary(self):
+        rows = {}
+        for endpoint in ENDPOINTS:
+            latencies = self.latencies.get(endpoint)
+            if not latencies:
+                continue
+            rows[endpoint] = {
+                'requests': len(latencies),
+                'errors': self.errors[endpoint],
+                'p50_ms': percentile(latencies, 0.5) * 1000,
+                'p99_ms': percentile(latencies, 0.99) * 1000,
+                'max_ms': max(latencies) * 1000,
+                'queries': sum(self.queries[endpoint]) / len(latencies),
+            }
+        return rows
+
+
+class BacklogMonitor(threading.Thread):
+    def __init__(self, interval=1.0):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                self.samples.append(render_backlog())
+                self.stopped.wait(self.interval)
+        finally:
+            connection.close()
+
+
+def user_session(user, recorder, iterations, toggles, status_timeout, rng):
+    """One virtual user: `iterations` create/poll/toggle/browse rounds"""
+    client = Client()
+    client.force_login(user)
+    try:
+        for _ in range(iterations):
+            recorder.request('index', lambda: client.get(reverse('index')))
+            description = f"{rng.choice(TASK_DESCRIPTIONS)} #{uuid.uuid4().hex[:6]}"
+            response = recorder.request('add_task', lambda: client.post(reverse('add_task'), {'task_description': description}, **AJAX))
+            if response is None or response.status_code != 202:
+                continue
+            status_url = response.json()['status_url']
+
+            status = {}
+            deadline = time.monotonic() + status_timeout
+            while time.monotonic() < deadline:
+                response = recorder.request('task_status', lambda: client.get(status_url))
+                status = response.json() if response is not None and response.status_code == 200 else {}
+                if status.get('status') in ('ready', 'failed'):
+                    break
+                time.sleep(0.5)
+
+            sub_tasks = status.get('sub_tasks', [])
+            for sub in rng.sample(sub_tasks, min(toggles, len(sub_tasks))):
+                url = reverse('toggle_task_complete', args=[sub['id']])
+                recorder.request('toggle_task_complete', lambda: client.post(url, **AJAX))
+            recorder.request('dashboard', lambda: client.get(reverse('dashboard')))
+    finally:
+        close_old_connections()
+        connection.close()
+
+
+def run(users=10, iterations=3, toggles=3, status_timeout=60.0, seed=0):
+    """
+    Run the sessions concurrently, one new user each. Returns the endpoint
+    summary, the backlog samples, the elapsed seconds and the created users.
+    """
+    from django.contrib.auth.models import User
+
+    run_id = uuid.uuid4().hex[:8]
+    accounts = [User.objects.create_user(f'loadtest-{run_id}-{i}') for i in range(users)]
+    recorder = Recorder()
+    monitor = BacklogMonitor()
+    threads = [
+        threading.Thread(
+            target=user_session,
+            args=(account, recorder, iterations, toggles, status_timeout, random.Random(seed + i)),
+        )
+        for i, account in enumerate(accounts)
+    ]
+    start = time.perf_counter()
+    monitor.start()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        elapsed = time.perf_counter() - start
+        monitor.stopped.set()
+        monitor.join()
+    return recorder.summary(), monitor.samples + [render_backlog()], elapsed, accounts
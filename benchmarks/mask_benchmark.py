@@ -0,0 +1,67 @@
+"""
+Micro-benchmark: per-mask time of the reveal mask engine.
+
+Compares the vectorized services.palace_masks.build_layer_mask against the
+previous per-layer polygon implementation for 4, 10 and 30 layers at 512 and
+1024 px, with every other layer completed.
+
+    python -m benchmarks.mask_benchmark
+"""
+
+import math
+import random
+import timeit
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+from services.palace_masks import build_layer_mask
+
+
+LAYER_COUNTS = (4, 10, 30)
+SIZES = (512, 1024)
+
+
+def polygon_mask(layers, total_count, size):
+    """The previous implementation: one polygon + full-frame round trip per layer."""
+    w, h = size
+    mask_arr = np.zeros((h, w), dtype=np.uint8)
+    layer_height = h // total_count
+    for order, amplitude, frequency, phase in layers:
+        layer_start = max(0, h - (order * layer_height))
+        layer_end = min(h, h - ((order - 1) * layer_height))
+        top_wave = [
+            (x, layer_start + amplitude * math.sin(frequency * x / w * 2 * math.pi + phase))
+            for x in range(w)
+        ]
+        bottom_wave = [
+            (x, layer_end + amplitude * math.sin(frequency * x / w * 2 * math.pi + phase + math.pi))
+            for x in reversed(range(w))
+        ]
+        img = Image.fromarray(mask_arr, mode="L")
+        ImageDraw.Draw(img).polygon(top_wave + bottom_wave, fill=255)
+        mask_arr = np.maximum(mask_arr, np.array(img))
+    return Image.fromarray(mask_arr, mode="L").filter(ImageFilter.GaussianBlur(3))
+
+
+def per_mask_ms(func, *args, number=5):
+    return min(timeit.repeat(lambda: func(*args), number=number, repeat=3)) / number * 1000
+
+
+def main():
+    rng = random.Random(0)
+    print(f"{'size':>6} {'layers':>6} {'polygon ms':>11} {'vectorized ms':>14} {'(no blur)':>10} {'speedup':>8}")
+    for px in SIZES:
+        for total_count in LAYER_COUNTS:
+            layers = [
+                (order, rng.randint(10, 25), rng.uniform(1.5, 2.5), rng.uniform(0, 2 * math.pi))
+                for order in range(1, total_count + 1, 2)
+            ]
+            legacy = per_mask_ms(polygon_mask, layers, total_count, (px, px))
+            vectorized = per_mask_ms(build_layer_mask, layers, total_count, (px, px))
+            raster = per_mask_ms(build_layer_mask, layers, total_count, (px, px), False)
+            print(f"{px:>6} {total_count:>6} {legacy:>11.2f} {vectorized:>14.2f} {raster:>10.2f} {legacy / vectorized:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""
+Stage benchmarks for the palace image pipeline, run by
+`python manage.py benchmark_palace`.
+
+Every stage runs on synthetic palaces (drawn by the local AI backend, so no
+network is needed) at each size and layer count, with every other layer
+completed:
+
+    mask        create_layer_specific_mask (mask build + blur)
+    layer_union blurred union of the completed layers' precomputed bands,
+                which is what a toggle does since layers are precomputed
+    plate       build_background_plate (blur + darken, once per palace)
+    composite   Image.composite of palace, plate and mask
+    encode      PNG encoding of the composited palace
+    apply_mask  apply_mask_to_image: decode + plate + composite + encode
+    end_to_end  generate_palace_image for a fresh task: image generation,
+                plate, mask, composite and storage. The app always generates
+                512x512 palaces, so this stage only runs at that size.
+
+Each result holds the best wall time of `repeat` runs, the peak memory of
+one extra run under tracemalloc (numpy buffers are traced, Pillow's image
+memory is not) and the bytes the stage wrote (encoded output or stored files).
+"""
+
+import io
+import json
+import math
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from django.db import transaction
+from django.test import override_settings
+from django.utils import timezone
+
+
+STAGES = ('mask', 'layer_union', 'plate', 'composite', 'encode', 'apply_mask', 'end_to_end')
+SIZES = (512, 1024)
+LAYER_COUNTS = (4, 10, 30)
+END_TO_END_SIZE = 512
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+# Differences smaller than this are noise, whatever the relative change
+MIN_REGRESSION = {'wall_ms': 2.0, 'peak_kb': 64}
+
+
+def synthetic_palace(px):
+    from PIL import Image
+    from services.ai_backends import LocalBackend
+
+    png = LocalBackend().generate_image(f"benchmark palace {px}", px, px)
+    return png, Image.open(io.BytesIO(png)).convert("RGB")
+
+
+def synthetic_sub_tasks(total_count):
+    """Completed sub-tasks (every other layer) with a stored, seeded reveal wave"""
+    rng = random.Random(total_count)
+    return [
+        SimpleNamespace(
+            order=order,
+            wave_amplitude=rng.randint(10, 25),
+            wave_frequency=rng.uniform(1.5, 2.5),
+            wave_phase=rng.uniform(0, 2 * math.pi),
+        )
+        for order in range(1, total_count + 1, 2)
+    ]
+
+
+def discard_output(func, *args):
+    """Runner for an in-memory stage: nothing is written"""
+    def runner():
+        func(*args)
+        return 0
+    return runner
+
+
+def stage_runners(px, total_count):
+    """{stage: callable returning bytes written} for one size and layer count"""
+    from PIL import Image
+    import numpy as np
+    from services.palace_generator import apply_mask_to_image, create_layer_specific_mask
+    from services.palace_layers import union_layer_masks
+    from services.palace_masks import build_layer_mask
+    from services.palace_plates import build_background_plate
+
+    png, complete = synthetic_palace(px)
+    sub_tasks = synthetic_sub_tasks(total_count)
+    background = build_background_plate(complete)
+    mask = create_layer_specific_mask(sub_tasks, total_count, complete.size)
+    final = Image.composite(complete, background, mask)
+    layer_masks = [
+        np.asarray(build_layer_mask([(sub.order, sub.wave_amplitude, sub.wave_frequency, sub.wave_phase)], total_count, complete.size, blur=False))
+        for sub in sub_tasks
+    ]
+
+    def encode():
+        buf = io.BytesIO()
+        final.save(buf, format="PNG")
+        return buf.tell()
+
+    def apply_mask():
+        return len(apply_mask_to_image(png, mask))
+
+    runners = {
+        'mask': discard_output(create_layer_specific_mask, sub_tasks, total_count, complete.size),
+        'layer_union': discard_output(union_layer_masks, layer_masks, complete.size),
+        'plate': discard_output(build_background_plate, complete),
+        'composite': discard_output(Image.composite, complete, background, mask),
+        'encode': encode,
+        'apply_mask': apply_mask,
+    }
+    if px == END_TO_END_SIZE:
+        runners['end_to_end'] = lambda: end_to_end(total_count)
+    return runners
+
+
+def end_to_end(total_count):
+    """generate_palace_image for a new task, rolled back; returns bytes stored"""
+    from apps.tasks.models import DailySession, Task
+    from services.palace_generator import generate_palace_image
+    from services.palace_plates import plate_cache
+    from services.palace_store import completion_bitmask
+
+    with tempfile.TemporaryDirectory() as media_root:
+        with override_settings(AI_BACKEND='local', MEDIA_ROOT=media_root), transaction.atomic():
+            session = DailySession.objects.create(date=timezone.now().date(), palace_theme='benchmark')
+            sub_tasks = [
+                Task(session=session, title=f'Step {order}', category='creative',
+                     complexity=1, order=order, is_completed=order % 2 == 1)
+                for order in range(1, total_count + 1)
+            ]
+            main_task = Task.objects.create(
+                session=session, title=f'Benchmark palace {total_count}', category='creative', complexity=3,
+                sub_tasks_total=total_count,
+                sub_tasks_completed=sum(sub.is_completed for sub in sub_tasks),
+                completion_mask=completion_bitmask(sub.order for sub in sub_tasks if sub.is_completed),
+            )
+            for sub in sub_tasks:
+                sub.parent = main_task
+            Task.objects.bulk_create(sub_tasks)
+            generate_palace_image(main_task)
+            plate_cache.clear()
+            transaction.set_rollback(True)
+            return sum(
+                os.path.getsize(os.path.join(folder, name))
+                for folder, _, names in os.walk(media_root)
+                for name in names
+            )
+
+
+def measure(runner, repeat):
+    bytes_written = runner()  # warm-up (imports, lazy caches)
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        runner()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        runner()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'wall_ms': round(best * 1000, 3), 'peak_kb': round(peak / 1024, 1), 'bytes': bytes_written}
+
+
+def run(stages=STAGES, sizes=SIZES, layer_counts=LAYER_COUNTS, repeat=5):
+    """{'stage/size/layers': result} for every requested combination"""
+    results = {}
+    for px in sizes:
+        for total_count in layer_counts:
+            runners = stage_runners(px, total_count)
+            for stage in stages:
+                if stage in runners:
+                    results[f'{stage}/{px}/{total_count}'] = measure(runners[stage], repeat)
+    return results
+
+
+def load_baselines(path=BASELINE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baselines(results, path=BASELINE_PATH):
+    baselines = load_baselines(path)
+    baselines.update(results)
+    with open(path, 'w') as f:
+        json.dump(dict(sorted(baselines.items())), f, indent=2)
+        f.write('\n')
+
+
+def regressions(results, baselines, threshold):
+    """
+    (key, metric, baseline, current) for every wall time or peak memory more
+    than `threshold` (0.5 = 50%) and MIN_REGRESSION above its baseline
+    """
+    found = []
+    for key, result in results.items():
+        baseline = baselines.get(key)
+        if not baseline:
+            continue
+        for metric in ('wall_ms', 'peak_kb'):
+            limit = max(baseline[metric] * (1 + threshold), baseline[metric] + MIN_REGRESSION[metric])
+            if result[metric] > limit:
+                found.append((key, metric, baseline[metric], result[metric]))
+    return found
@@ -2,6 +2,8 @@
 ASGI config for palace_builder project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests go to Django; WebSocket connections (palace-ready events) go to
+the Channels consumers in apps.tasks.routing.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
@@ -15,4 +17,22 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'palace_builder.settings')
 
-application = get_asgi_application()
+# Initialize Django before importing code that uses the ORM
+django_asgi_app = get_asgi_application()
+
+from services import metrics
+
+metrics.start_flusher()
+
+from channels.auth import AuthMiddlewareStack
+from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.security.websocket import AllowedHostsOriginValidator
+
+from apps.tasks.routing import websocket_urlpatterns
+
+application = ProtocolTypeRouter({
+    'http': django_asgi_app,
+    'websocket': AllowedHostsOriginValidator(
+        AuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+    ),
+})
@@ -0,0 +1,43 @@
+"""
+Celery application for palace_builder.
+
+Background work (palace image generation and layer compositing) runs on
+Celery workers instead of threads inside the web process. Start a worker with:
+
+    celery -A palace_builder worker --loglevel=info
+"""
+
+import os
+
+from celery import Celery
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown
+
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'palace_builder.settings')
+
+app = Celery('palace_builder')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
+
+
+@app.on_after_configure.connect
+def create_filesystem_broker_folders(sender, **kwargs):
+    # Development broker (no CELERY_BROKER_URL): the transport expects them to exist
+    if sender.conf.broker_url == 'filesystem://':
+        options = sender.conf.broker_transport_options
+        for key in ('data_folder_out', 'processed_folder'):
+            os.makedirs(options[key], exist_ok=True)
+
+
+@worker_init.connect
+@worker_process_init.connect
+def start_metrics_flusher(**kwargs):
+    # Per process: the worker itself (solo/threads pools) and every prefork child
+    from services import metrics
+    metrics.start_flusher()
+
+
+@worker_process_shutdown.connect
+def flush_metrics(**kwargs):
+    from services import metrics
+    metrics.flush()
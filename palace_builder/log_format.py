@@ -0,0 +1,39 @@
+"""
+Log formatters. Extra fields passed with `extra={...}` are kept as fields:
+
+    logger.info("Palace rendered", extra={'task_id': 12, 'duration_ms': 84.1})
+
+JSONFormatter writes one JSON object per line (LOG_FORMAT=json);
+KeyValueFormatter appends them as key=value pairs for reading in a terminal.
+"""
+
+import json
+import logging
+
+
+# Attributes every LogRecord has; everything else came in through `extra`
+STANDARD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+def extra_fields(record):
+    return {key: value for key, value in vars(record).items() if key not in STANDARD_ATTRIBUTES}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            **extra_fields(record),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class KeyValueFormatter(logging.Formatter):
+    def formatMessage(self, record):
+        fields = ''.join(f' {key}={value}' for key, value in extra_fields(record).items())
+        return super().formatMessage(record) + fields
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 from pathlib import Path
 import os
 import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -35,6 +36,7 @@ ALLOWED_HOSTS = os.environ.get('ALLOWED_HOSTS', '127.0.0.1,localhost').split(','
 INSTALLED_APPS = [
     'apps.tasks',
     'apps.palaces',
+    'channels',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -44,11 +46,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'apps.tasks.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # After authentication, it lets staff users profile requests
+    'apps.tasks.middleware.RequestProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -73,6 +79,26 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'palace_builder.wsgi.application'
+ASGI_APPLICATION = 'palace_builder.asgi.application'
+
+# Channels
+# https://channels.readthedocs.io/en/stable/topics/channel_layers.html
+#
+# The in-memory layer only delivers events sent from the same process (local
+# development, eager Celery). With separate Celery workers set REDIS_URL so the
+# workers can reach the web processes' WebSockets.
+
+if os.environ.get('REDIS_URL'):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [os.environ['REDIS_URL']]},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'},
+    }
 
 
 # Database
@@ -132,22 +158,175 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 import sys
+# LOG_FORMAT=json writes one JSON object per line (for log collectors), text
+# a readable line with the extra fields as key=value pairs
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'palace_builder.log_format.JSONFormatter'},
+        'text': {
+            '()': 'palace_builder.log_format.KeyValueFormatter',
+            'format': '%(asctime)s %(levelname)s %(name)s: %(message)s',
+        },
+    },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
             'stream': sys.stdout,
+            'formatter': LOG_FORMAT,
         },
     },
     'root': {
         'handlers': ['console'],
-        'level': 'INFO',
+        'level': LOG_LEVEL,
     },
 }
 
+# Prometheus metrics at /metrics, summed over all web and worker processes.
+# Scrapes must send "Authorization: Bearer <METRICS_TOKEN>" or come from a
+# staff user; with DEBUG on and no token set, the endpoint is open.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# How often every process adds its samples to the shared totals (0: never)
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', '10'))
+
+# On-demand profiling of single requests: ?profile=1 (or "X-Profile: 1") from
+# a staff user, or a token from `manage.py profile_token` valid for
+# PROFILE_TOKEN_MAX_AGE seconds. Reports are saved as RequestProfiles.
+REQUEST_PROFILING_ENABLED = os.environ.get('REQUEST_PROFILING_ENABLED', 'True') == 'True'
+PROFILE_TOKEN_MAX_AGE = int(os.environ.get('PROFILE_TOKEN_MAX_AGE', 3600))
+
 CSRF_TRUSTED_ORIGINS = [
     "https://palacebuilder-production.up.railway.app",
     "https://*.railway.app",  # (optional, for all Railway subdomains)
 ]
+
+# Celery
+# https://docs.celeryq.dev/en/stable/django/first-steps-with-django.html
+#
+# CELERY_BROKER_URL must be a broker the web and worker services share (e.g.
+# Redis) when DEBUG is off. In development it defaults to a local filesystem
+# queue, so a worker can run next to `runserver` without Redis (its folders are
+# created by palace_builder.celery). CELERY_TASK_ALWAYS_EAGER=True runs tasks
+# in-process (tests / single-process debugging) and needs no broker.
+
+CELERY_TASK_ALWAYS_EAGER = os.environ.get('CELERY_TASK_ALWAYS_EAGER', 'False') == 'True'
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL')
+if not CELERY_BROKER_URL:
+    if not DEBUG and not CELERY_TASK_ALWAYS_EAGER:
+        raise ImproperlyConfigured(
+            "Set CELERY_BROKER_URL to a broker shared with the Celery worker service; "
+            "a filesystem queue in the web container is never consumed"
+        )
+    CELERY_BROKER_URL = 'filesystem://'
+if CELERY_BROKER_URL == 'filesystem://':
+    CELERY_FILESYSTEM_BROKER_DIR = BASE_DIR / '.celery'
+    CELERY_BROKER_TRANSPORT_OPTIONS = {
+        'data_folder_in': str(CELERY_FILESYSTEM_BROKER_DIR / 'out'),
+        'data_folder_out': str(CELERY_FILESYSTEM_BROKER_DIR / 'out'),
+        'processed_folder': str(CELERY_FILESYSTEM_BROKER_DIR / 'processed'),
+        'control_folder': str(CELERY_FILESYSTEM_BROKER_DIR / 'control'),
+        'store_processed': False,
+    }
+
+CELERY_TASK_EAGER_PROPAGATES = True
+CELERY_TASK_IGNORE_RESULT = True
+
+# A task is only acknowledged once it finished, so a recycled worker hands its
+# job back to the queue instead of losing it.
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# Bounded concurrency: each worker renders at most this many palaces at once.
+# Scale throughput by adding workers, not threads in the web process.
+CELERY_WORKER_CONCURRENCY = int(os.environ.get('CELERY_WORKER_CONCURRENCY', '2'))
+CELERY_TASK_SOFT_TIME_LIMIT = 240
+CELERY_TASK_TIME_LIMIT = 300
+# Workers log through LOGGING (structured) instead of Celery's own format
+CELERY_WORKER_HIJACK_ROOT_LOGGER = False
+
+# Palace rendering
+# Number of palaces whose decoded complete image + background plate are kept
+# in memory per process (roughly 1.5 MB each at 512x512).
+PALACE_PLATE_CACHE_SIZE = int(os.environ.get('PALACE_PLATE_CACHE_SIZE', '32'))
+
+# 'server': every toggle re-renders the palace image on the workers.
+# 'client': browsers get the complete palace, background plate and a layer-mask
+# atlas once per palace and compose each completion state on a canvas, so
+# toggles cost no rendering at all.
+PALACE_RENDER_MODE = os.environ.get('PALACE_RENDER_MODE', 'server')
+
+# Widths of the WebP/JPEG renditions written next to every stored palace and
+# offered to the browser through srcset
+PALACE_RENDITION_WIDTHS = (128, 256, 512)
+
+# Toggles arriving within this window are collapsed into one render of the
+# latest state; a render holds its per-palace lock for at most this long.
+PALACE_RENDER_DEBOUNCE_SECONDS = float(os.environ.get('PALACE_RENDER_DEBOUNCE_SECONDS', '0.75'))
+PALACE_RENDER_LOCK_SECONDS = 60
+
+# LLM task decompositions are cached by normalized description, model and
+# prompt version: in the DecompositionCacheEntry table for this long, and in a
+# per-process LRU of this many entries.
+DECOMPOSITION_CACHE_TTL_SECONDS = int(os.environ.get('DECOMPOSITION_CACHE_TTL_SECONDS', str(30 * 24 * 3600)))
+DECOMPOSITION_CACHE_SIZE = int(os.environ.get('DECOMPOSITION_CACHE_SIZE', '256'))
+
+# Bulk task import: descriptions per batched LLM request, palaces generated at
+# once per batch (an import runs one batch per DECOMPOSITION_BATCH_SIZE tasks;
+# NEBIUS_RATE_LIMITS bounds them all together), and the most tasks accepted
+# per upload.
+DECOMPOSITION_BATCH_SIZE = int(os.environ.get('DECOMPOSITION_BATCH_SIZE', '5'))
+BULK_IMPORT_PARALLELISM = int(os.environ.get('BULK_IMPORT_PARALLELISM', '3'))
+BULK_IMPORT_MAX_TASKS = 500
+
+# Stream the decomposition and store each sub-task as soon as it is complete
+DECOMPOSITION_STREAMING = os.environ.get('DECOMPOSITION_STREAMING', 'True') == 'True'
+
+# AI provider for decompositions and palace images: 'nebius', 'local' (offline,
+# deterministic: canned decompositions and procedurally drawn palaces) or the
+# dotted path of a services.ai_backends.AIBackend subclass.
+AI_BACKEND = os.environ.get('AI_BACKEND', 'nebius')
+# Local backend only: artificial provider latency and failure share (load tests)
+LOCAL_AI_CHAT_LATENCY_SECONDS = float(os.environ.get('LOCAL_AI_CHAT_LATENCY_SECONDS', '0'))
+LOCAL_AI_IMAGE_LATENCY_SECONDS = float(os.environ.get('LOCAL_AI_IMAGE_LATENCY_SECONDS', '0'))
+LOCAL_AI_FAILURE_RATE = float(os.environ.get('LOCAL_AI_FAILURE_RATE', '0'))
+
+# Nebius (OpenAI-compatible) provider. One pooled client per process; every
+# call gets connect/read timeouts, an overall deadline with jittered retries,
+# and a per-endpoint circuit breaker that fails fast while Nebius is degraded.
+NEBIUS_BASE_URL = os.environ.get('NEBIUS_BASE_URL', 'https://api.studio.nebius.ai/v1/')
+NEBIUS_CONNECT_TIMEOUT_SECONDS = float(os.environ.get('NEBIUS_CONNECT_TIMEOUT_SECONDS', '5'))
+NEBIUS_READ_TIMEOUT_SECONDS = float(os.environ.get('NEBIUS_READ_TIMEOUT_SECONDS', '60'))
+NEBIUS_MAX_CONNECTIONS = int(os.environ.get('NEBIUS_MAX_CONNECTIONS', '20'))
+NEBIUS_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('NEBIUS_MAX_KEEPALIVE_CONNECTIONS', '10'))
+NEBIUS_CHAT_DEADLINE_SECONDS = float(os.environ.get('NEBIUS_CHAT_DEADLINE_SECONDS', '90'))
+NEBIUS_IMAGE_DEADLINE_SECONDS = float(os.environ.get('NEBIUS_IMAGE_DEADLINE_SECONDS', '150'))
+NEBIUS_MAX_ATTEMPTS = int(os.environ.get('NEBIUS_MAX_ATTEMPTS', '3'))
+NEBIUS_RETRY_BASE_DELAY_SECONDS = 0.5
+NEBIUS_RETRY_MAX_DELAY_SECONDS = 8
+NEBIUS_BREAKER_THRESHOLD = int(os.environ.get('NEBIUS_BREAKER_THRESHOLD', '5'))
+NEBIUS_BREAKER_RESET_SECONDS = float(os.environ.get('NEBIUS_BREAKER_RESET_SECONDS', '30'))
+
+# Nebius limits shared by all processes (through the database): per endpoint,
+# `rate` calls per second with bursts of up to `burst`, and at most
+# `concurrency` calls in flight. Waiting calls are served interactive first,
+# then bulk imports.
+NEBIUS_RATE_LIMIT_ENABLED = os.environ.get('NEBIUS_RATE_LIMIT_ENABLED', 'True') == 'True'
+NEBIUS_RATE_LIMITS = {
+    'chat': {
+        'rate': float(os.environ.get('NEBIUS_CHAT_RATE_PER_SECOND', '4')),
+        'burst': int(os.environ.get('NEBIUS_CHAT_BURST', '8')),
+        'concurrency': int(os.environ.get('NEBIUS_CHAT_MAX_CONCURRENCY', '16')),
+    },
+    'images': {
+        'rate': float(os.environ.get('NEBIUS_IMAGE_RATE_PER_SECOND', '1')),
+        'burst': int(os.environ.get('NEBIUS_IMAGE_BURST', '2')),
+        'concurrency': int(os.environ.get('NEBIUS_IMAGE_MAX_CONCURRENCY', '4')),
+    },
+}
+# In-flight slots of a process that died are freed after this long
+NEBIUS_RATE_LIMIT_LEASE_SECONDS = 300
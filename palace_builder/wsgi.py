@@ -15,3 +15,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'palace_builder.settings')
 
 application = get_wsgi_application()
+
+from services import metrics
+
+metrics.start_flusher()
@@ -0,0 +1,243 @@
+"""
+Pluggable providers for the two AI calls the pipeline makes: a chat
+completion (task decomposition) and an image generation (the palace).
+
+    from services.ai_backends import get_backend
+    text = get_backend().chat(messages, max_tokens=512)
+
+settings.AI_BACKEND picks the provider: 'nebius' (the default), 'local', or
+the dotted path of any AIBackend subclass. Nothing is imported or connected
+until the first call, so importing this module is free.
+
+The local backend needs no network or API key: it answers decomposition
+prompts with canned, deterministic plans and draws palaces procedurally,
+so the whole pipeline can run offline (development, load tests).
+"""
+
+import abc
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+class ProviderError(Exception):
+    """The provider failed (after retries); the Celery job retries later."""
+
+
+class ProviderUnavailable(ProviderError):
+    """Raised instead of calling a provider that is known to be down."""
+
+
+class AIBackend(abc.ABC):
+    """Interface every provider implements"""
+
+    name = None
+    # Part of the decomposition cache key, so results of different
+    # providers/models are never mixed up
+    chat_model = None
+    image_model = None
+
+    @abc.abstractmethod
+    def chat(self, messages, max_tokens, temperature=0.1, stream=False):
+        """
+        The assistant's answer to `messages`: a string, or with stream=True an
+        iterator of text fragments as they are produced
+        """
+
+    @abc.abstractmethod
+    def generate_image(self, prompt, width, height):
+        """PNG bytes of an image for `prompt`"""
+
+
+class NebiusBackend(AIBackend):
+    name = 'nebius'
+    chat_model = "Qwen/Qwen3-235B-A22B"
+    image_model = "black-forest-labs/flux-dev"
+
+    def chat(self, messages, max_tokens, temperature=0.1, stream=False):
+        from services import nebius_client
+
+        response = nebius_client.chat_completion(
+            model=self.chat_model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=stream,
+        )
+        if stream:
+            return self._stream_text(response)
+        return response.choices[0].message.content or ""
+
+    def _stream_text(self, stream):
+        try:
+            for chunk in stream:
+                if chunk.choices:
+                    yield chunk.choices[0].delta.content or ""
+        finally:
+            # Gives the rate limiter slot back as soon as the caller stops reading
+            stream.close()
+
+    def generate_image(self, prompt, width, height):
+        import base64
+        from services import nebius_client
+
+        response = nebius_client.generate_image(
+            model=self.image_model,
+            prompt=prompt,
+            response_format="b64_json",
+            extra_body={
+                "response_extension": "png",
+                "width": width,
+                "height": height,
+                "num_inference_steps": 28,
+                "negative_prompt": "fantasy, magical, unrealistic, cartoon, anime, abstract, surreal",
+                "seed": -1
+            }
+        )
+        b64_image = response.data[0].b64_json
+        if not b64_image:
+            raise ProviderError("Image provider returned no image data")
+        return base64.b64decode(b64_image)
+
+
+CATEGORIES = ["creative", "analytical", "physical", "administrative"]
+STEP_TEMPLATES = [
+    "Define what done looks like for {task}",
+    "Gather what is needed for {task}",
+    "Break {task} into a first draft",
+    "Work through the hardest part of {task}",
+    "Review progress on {task}",
+    "Polish and finish {task}",
+]
+# Matches the prompts built in services.openai_service
+SINGLE_TASK_PATTERN = re.compile(r'Analyze this task and return ONLY valid JSON: "(.*)"')
+BATCH_TASK_PATTERN = re.compile(r'^(\d+)\. "(.*)"$', re.M)
+
+
+def _rng(text):
+    return random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+
+
+class LocalBackend(AIBackend):
+    """
+    Deterministic, offline provider: same prompt, same answer. For load tests
+    it can stand in for a slow or flaky provider: LOCAL_AI_CHAT_LATENCY_SECONDS
+    and LOCAL_AI_IMAGE_LATENCY_SECONDS add a delay to every call and
+    LOCAL_AI_FAILURE_RATE makes that share of calls raise ProviderError.
+    """
+
+    name = 'local'
+    chat_model = "local/canned-decomposition"
+    image_model = "local/procedural-palace"
+
+    def _simulate_provider(self, latency):
+        if latency:
+            time.sleep(latency)
+        if random.random() < settings.LOCAL_AI_FAILURE_RATE:
+            raise ProviderError("Simulated provider failure")
+
+    def chat(self, messages, max_tokens, temperature=0.1, stream=False):
+        self._simulate_provider(settings.LOCAL_AI_CHAT_LATENCY_SECONDS)
+        prompt = messages[-1]["content"]
+        batch = BATCH_TASK_PATTERN.findall(prompt)
+        if batch:
+            answer = {"tasks": [dict(self.decompose(task), index=int(index)) for index, task in batch]}
+        else:
+            match = SINGLE_TASK_PATTERN.search(prompt)
+            answer = self.decompose(match.group(1) if match else prompt)
+        text = json.dumps(answer)
+        if stream:
+            return (text[i:i + 16] for i in range(0, len(text), 16))
+        return text
+
+    def decompose(self, task):
+        rng = _rng(task)
+        steps = rng.randint(3, len(STEP_TEMPLATES))
+        category = rng.choice(CATEGORIES)
+        return {
+            "category": category,
+            "complexity": rng.randint(1, 5),
+            "layer_description": f"A wing of the palace for {task}",
+            "sub_tasks": [
+                {
+                    "title": template.format(task=task),
+                    "category": category,
+                    "complexity": rng.randint(1, 5),
+                    "order": order,
+                    "time_estimate": rng.choice([10, 15, 20, 30, 45, 60]),
+                }
+                for order, template in enumerate(STEP_TEMPLATES[:steps], 1)
+            ],
+        }
+
+    def generate_image(self, prompt, width, height):
+        """A palace silhouette (body, towers, spires, windows) over a sky gradient"""
+        from PIL import Image, ImageDraw
+
+        self._simulate_provider(settings.LOCAL_AI_IMAGE_LATENCY_SECONDS)
+        rng = _rng(prompt)
+        top, bottom = [tuple(rng.randint(40, 220) for _ in range(3)) for _ in range(2)]
+        image = Image.new("RGB", (width, height))
+        draw = ImageDraw.Draw(image)
+        for y in range(height):
+            t = y / max(height - 1, 1)
+            draw.line([(0, y), (width, y)], fill=tuple(int(a + (b - a) * t) for a, b in zip(top, bottom)))
+
+        ground = int(height * 0.85)
+        stone = tuple(rng.randint(120, 230) for _ in range(3))
+        roof = tuple(rng.randint(30, 160) for _ in range(3))
+        window = tuple(rng.randint(200, 255) for _ in range(3))
+        draw.rectangle([0, ground, width, height], fill=tuple(c // 2 for c in stone))
+        body_top = int(height * rng.uniform(0.45, 0.6))
+        draw.rectangle([int(width * 0.2), body_top, int(width * 0.8), ground], fill=stone)
+
+        towers = rng.randint(3, 6)
+        tower_width = width // (towers * 2 + 1)
+        for i in range(towers):
+            left = tower_width * (2 * i + 1)
+            tower_top = int(height * rng.uniform(0.2, 0.45))
+            draw.rectangle([left, tower_top, left + tower_width, ground], fill=stone)
+            spire = tower_top - int(height * rng.uniform(0.08, 0.15))
+            draw.polygon([(left, tower_top), (left + tower_width, tower_top), (left + tower_width // 2, spire)], fill=roof)
+            for y in range(tower_top + tower_width // 2, ground - tower_width, tower_width):
+                draw.rectangle([left + tower_width // 3, y, left + 2 * tower_width // 3, y + tower_width // 3], fill=window)
+
+        buf = io.BytesIO()
+        image.save(buf, format="PNG")
+        return buf.getvalue()
+
+
+BACKENDS = {
+    'nebius': 'services.ai_backends.NebiusBackend',
+    'local': 'services.ai_backends.LocalBackend',
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """The configured backend, created on first use"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(BACKENDS.get(settings.AI_BACKEND, settings.AI_BACKEND))()
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_backend(*, setting, **kwargs):
+    """Pick up AI_BACKEND changes made with override_settings (tests, benchmarks)"""
+    global _backend
+    if setting == 'AI_BACKEND':
+        _backend = None
@@ -0,0 +1,83 @@
+"""
+Cache of LLM task decompositions.
+
+Users keep entering the same tasks with small variations in case, spacing and
+punctuation, so results are keyed by the normalized description plus the model
+and prompt version that produced them. Lookups go through a bounded
+in-process LRU first and then the DecompositionCacheEntry table (with a TTL).
+"""
+
+import copy
+import hashlib
+import re
+import unicodedata
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from services import metrics
+from services.lru import LRUCache
+
+
+# key -> (result, expires_at)
+memory_cache = LRUCache(settings.DECOMPOSITION_CACHE_SIZE)
+
+
+def _entry_model():
+    from apps.tasks.models import DecompositionCacheEntry
+    return DecompositionCacheEntry
+
+
+def normalize_description(description):
+    """Fold case, unicode forms, punctuation and whitespace"""
+    text = unicodedata.normalize('NFKC', description).casefold()
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return ' '.join(text.split())
+
+
+def cache_key(normalized, model, prompt_version):
+    return hashlib.sha256(f"{model}\n{prompt_version}\n{normalized}".encode()).hexdigest()
+
+
+def get(description, model, prompt_version):
+    """Return a copy of the cached decomposition, or None"""
+    key = cache_key(normalize_description(description), model, prompt_version)
+    now = timezone.now()
+    cached = memory_cache.get(key)
+    if cached is not None and cached[1] > now:
+        metrics.increment('decomposition_cache_hits_total', layer='memory')
+        return copy.deepcopy(cached[0])
+    Entry = _entry_model()
+    entry = Entry.objects.filter(key=key, expires_at__gt=now).first()
+    if entry is None:
+        metrics.increment('decomposition_cache_misses_total')
+        return None
+    Entry.objects.filter(id=entry.id).update(hits=F('hits') + 1)
+    memory_cache.put(key, (entry.result, entry.expires_at))
+    metrics.increment('decomposition_cache_hits_total', layer='db')
+    return copy.deepcopy(entry.result)
+
+
+def put(description, model, prompt_version, result):
+    normalized = normalize_description(description)
+    key = cache_key(normalized, model, prompt_version)
+    expires_at = timezone.now() + timedelta(seconds=settings.DECOMPOSITION_CACHE_TTL_SECONDS)
+    _entry_model().objects.update_or_create(
+        key=key,
+        defaults={
+            'normalized_description': normalized,
+            'model': model,
+            'prompt_version': prompt_version,
+            'result': result,
+            'expires_at': expires_at,
+        },
+    )
+    memory_cache.put(key, (copy.deepcopy(result), expires_at))
+
+
+def purge_expired():
+    """Delete expired rows; returns how many were removed"""
+    deleted, _ = _entry_model().objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
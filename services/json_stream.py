@@ -0,0 +1,180 @@
+"""
+Incremental, single-pass JSON parsing of streamed LLM output.
+
+The decomposition answer arrives token by token, possibly wrapped in prose and
+<think> blocks. DecompositionStreamParser scans each character exactly once,
+drops <think>...</think> content on the fly (tags may be split across
+chunks), tracks string/escape state and nesting depth, and:
+
+- skips "//" line comments outside strings (the prompt's schema shows one),
+- emits every element of the top-level "sub_tasks" array as soon as its
+  closing brace arrives, and
+- remembers the last complete top-level object as the final result.
+
+    parser = DecompositionStreamParser()
+    for chunk in chunks:
+        for sub_task in parser.feed(chunk):
+            ...
+    result = parser.close()
+"""
+
+import json
+
+
+THINK_OPEN = '<think>'
+THINK_CLOSE = '</think>'
+
+
+class DecompositionStreamParser:
+    def __init__(self, array_key='sub_tasks'):
+        self.array_key = array_key
+        self.result = None
+        self._text = []            # JSON text seen so far (think blocks removed)
+        self._pending = ''         # raw input held back while a tag may be split
+        self._in_think = False
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._in_comment = False   # "// ..." comments, as in the prompt's schema example
+        self._string_start = None
+        self._expect_key = False   # the next string at depth 1 is a key
+        self._last_key = None      # last key at depth 1
+        self._value_key = None     # key whose value is currently being parsed at depth 1
+        self._in_array = False
+        self._root_start = None
+        self._element_start = None
+
+    def feed(self, chunk):
+        """Consume a chunk of model output; returns the sub-tasks completed by it"""
+        completed = []
+        for text in self._strip_think(chunk):
+            for char in text:
+                item = self._scan(char)
+                if item is not None:
+                    completed.append(item)
+        return completed
+
+    def close(self):
+        """Finish the stream; returns the last complete top-level JSON object (or None)"""
+        if not self._in_think and self._pending:
+            pending, self._pending = self._pending, ''
+            for char in pending:
+                self._scan(char)
+        return self.result
+
+    def _strip_think(self, chunk):
+        """Yield the parts of the input that are outside <think> blocks"""
+        data = self._pending + chunk
+        self._pending = ''
+        while data:
+            if self._in_think:
+                end = data.find(THINK_CLOSE)
+                if end == -1:
+                    # Keep just enough to recognize a split closing tag
+                    self._pending = data[-(len(THINK_CLOSE) - 1):]
+                    return
+                data = data[end + len(THINK_CLOSE):]
+                self._in_think = False
+                continue
+            start = data.find(THINK_OPEN)
+            if start != -1:
+                yield data[:start]
+                data = data[start + len(THINK_OPEN):]
+                self._in_think = True
+                continue
+            # Hold back a trailing partial "<think" until the next chunk
+            for size in range(min(len(THINK_OPEN) - 1, len(data)), 0, -1):
+                if THINK_OPEN.startswith(data[-size:]):
+                    self._pending = data[-size:]
+                    data = data[:-size]
+                    break
+            yield data
+            return
+
+    def _scan(self, char):
+        if self._in_comment:
+            self._in_comment = char != '\n'
+            return None
+        depth = len(self._stack)
+        if char == '/' and depth and not self._in_string and self._text and self._text[-1] == '/':
+            self._text.pop()
+            self._in_comment = True
+            return None
+        position = len(self._text)
+        self._text.append(char)
+
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif char == '\\':
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                if depth == 1 and self._expect_key:
+                    self._last_key = self._decode_key(self._string_start, position)
+            return None
+        if depth == 0:
+            # Prose around the JSON: only an opening brace matters
+            if char == '{':
+                self._root_start = position
+                self._stack.append('{')
+                self._expect_key = True
+            return None
+
+        if char == '"':
+            self._in_string = True
+            self._string_start = position
+        elif char == ':' and depth == 1:
+            self._value_key = self._last_key
+            self._expect_key = False
+        elif char == ',' and depth == 1:
+            self._value_key = None
+            self._expect_key = True
+        elif char in '{[':
+            if depth == 1 and char == '[' and self._value_key == self.array_key:
+                self._in_array = True
+            elif depth == 2 and char == '{' and self._in_array:
+                self._element_start = position
+            self._stack.append(char)
+        elif char in '}]':
+            self._stack.pop()
+            depth -= 1
+            if depth == 2 and char == '}' and self._element_start is not None:
+                return self._complete_element(position)
+            if depth == 1 and char == ']':
+                self._in_array = False
+            if depth == 0:
+                self._complete_root(position)
+        return None
+
+    def _decode_key(self, start, end):
+        # Only keys are decoded while streaming; values are left to the
+        # json.loads of their element or of the whole document
+        try:
+            return json.loads(''.join(self._text[start:end + 1]))
+        except ValueError:
+            # Invalid escape or raw control character: no key can match, and
+            # the document won't parse as a whole either
+            return None
+
+    def _complete_element(self, position):
+        text = ''.join(self._text[self._element_start:position + 1])
+        self._element_start = None
+        try:
+            item = json.loads(text)
+        except json.JSONDecodeError:
+            return None
+        return item if isinstance(item, dict) else None
+
+    def _complete_root(self, position):
+        text = ''.join(self._text[self._root_start:position + 1])
+        try:
+            self.result = json.loads(text)
+        except json.JSONDecodeError:
+            pass
+        self._value_key = self._last_key = None
+        self._expect_key = False
+        self._in_array = False
+        # Text before the object is no longer needed
+        self._text = []
+        self._root_start = None
@@ -0,0 +1,44 @@
+import threading
+from collections import OrderedDict
+
+from services import metrics
+
+
+class LRUCache:
+    """
+    Small thread-safe LRU mapping for per-process caches. Lookups in a named
+    cache are counted in cache_requests_total{cache, result}.
+    """
+
+    def __init__(self, max_entries, name=None):
+        self.max_entries = max_entries
+        self.name = name
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+        if self.name:
+            metrics.increment('cache_requests_total', cache=self.name, result='miss' if value is None else 'hit')
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            return self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
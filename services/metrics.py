@@ -0,0 +1,216 @@
+"""
+In-process metrics: counters, summaries, timing spans and scrape-time gauges,
+rendered in the Prometheus text format by the /metrics view.
+
+    from services import metrics
+    metrics.increment('decomposition_cache_hits_total', layer='memory')
+    metrics.observe('nebius_queue_wait_seconds', 0.4, endpoint='chat')
+
+    with metrics.span('png_encode'):
+        image.save(buf, format="PNG")
+
+    @metrics.span('analyze_task')
+    def analyze_task(...): ...
+
+Samples are recorded in every web and Celery worker process, and most of the
+interesting ones (analysis, Nebius calls, rendering) in the workers, which
+serve no HTTP. So each process adds what it recorded to MetricSeries rows in
+the database every METRICS_FLUSH_SECONDS (start_flusher, started by the ASGI/
+WSGI application and for every Celery worker process), and /metrics renders
+those totals: one set of counters for the whole deployment, which only resets
+if the table is cleared. Gauges are callbacks evaluated on every scrape, so
+state shared through the database (render backlog, rate limiter queue) reads
+the same from every process.
+
+snapshot() and counter_value() are this process's own counts (benchmarks).
+"""
+
+import atexit
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+_counters = {}
+_summaries = set()
+_gauges = {}
+_lock = threading.Lock()
+# Not yet written to MetricSeries: {(name, labels): amount}, and the process
+# they were recorded in (a forked child must not write its parent's again)
+_pending = {}
+_pending_pid = os.getpid()
+_flusher_pid = None
+
+
+def _series_model():
+    from apps.tasks.models import MetricSeries
+    return MetricSeries
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def _add(key, amount):
+    _counters[key] = _counters.get(key, 0) + amount
+    _pending[key] = _pending.get(key, 0) + amount
+
+
+def increment(name, amount=1, **labels):
+    with _lock:
+        _add(_key(name, labels), amount)
+
+
+def observe(name, value, **labels):
+    """Record one sample of a summary, as the counters name_count and name_sum"""
+    with _lock:
+        _summaries.add(name)
+        _add(_key(f'{name}_count', labels), 1)
+        _add(_key(f'{name}_sum', labels), value)
+
+
+@contextmanager
+def span(name, **labels):
+    """Time the block (or decorated function) into span_duration_seconds{span=name}"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe('span_duration_seconds', elapsed, span=name, **labels)
+        logger.debug("span", extra={'span': name, 'duration_ms': round(elapsed * 1000, 2), **labels})
+
+
+def register_gauge(name, callback):
+    """
+    Report name{labels} = value for every ((label, value), ...), value pair
+    that callback() returns, on each scrape
+    """
+    _gauges[name] = callback
+
+
+def counter_value(name, **labels):
+    return _counters.get(_key(name, labels), 0)
+
+
+def snapshot():
+    """Return {(name, ((label, value), ...)): count} for all counters"""
+    with _lock:
+        return dict(_counters)
+
+
+def _family(name):
+    """(metric family, kind) of a sample name"""
+    for suffix in ('_count', '_sum'):
+        if name.endswith(suffix) and name[:-len(suffix)] in _summaries:
+            return name[:-len(suffix)], 'summary'
+    return name, 'counter'
+
+
+def flush():
+    """Add this process's samples recorded since the last flush to MetricSeries"""
+    global _pending
+    from django.db import transaction
+    from django.db.models import F
+
+    with _lock:
+        pending, _pending = _pending, {}
+    if not pending:
+        return
+    Series = _series_model()
+    # In key order, so concurrent flushes lock the rows in the same order
+    rows = sorted(
+        (hashlib.sha256(json.dumps([name, labels]).encode()).hexdigest(), name, labels, amount)
+        for (name, labels), amount in pending.items()
+    )
+    try:
+        with transaction.atomic():
+            for key, name, labels, amount in rows:
+                if Series.objects.filter(key=key).update(value=F('value') + amount):
+                    continue
+                family, kind = _family(name)
+                Series.objects.get_or_create(
+                    key=key, defaults={'name': name, 'family': family, 'kind': kind, 'labels': labels},
+                )
+                Series.objects.filter(key=key).update(value=F('value') + amount)
+    except Exception:
+        logger.exception("Metrics flush failed, keeping the samples for the next one")
+        with _lock:
+            for key, amount in pending.items():
+                _pending[key] = _pending.get(key, 0) + amount
+
+
+def _flush_periodically(interval):
+    from django.db import connection
+
+    while True:
+        time.sleep(interval)
+        try:
+            flush()
+        finally:
+            connection.close()
+
+
+def start_flusher():
+    """Flush this process's samples every METRICS_FLUSH_SECONDS (and at exit), once per process"""
+    global _flusher_pid, _pending_pid
+    interval = settings.METRICS_FLUSH_SECONDS
+    if not interval:
+        return
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+        if _pending_pid != _flusher_pid:
+            # Forked: what the parent recorded is the parent's to write
+            _pending.clear()
+            _pending_pid = _flusher_pid
+    threading.Thread(target=_flush_periodically, args=(interval,), name='metrics-flush', daemon=True).start()
+    atexit.register(flush)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (label, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for label, value in labels
+    )
+    return '{' + ','.join(f'{label}="{value}"' for label, value in escaped) + '}'
+
+
+def _format_value(value):
+    return int(value) if float(value).is_integer() else value
+
+
+def render_prometheus():
+    """All metrics of all processes in the Prometheus text exposition format (version 0.0.4)"""
+    flush()
+    families = {}
+    for series in _series_model().objects.all():
+        labels = tuple(tuple(pair) for pair in series.labels)
+        families.setdefault((series.family, series.kind), []).append((series.name, labels, series.value))
+    lines = []
+    for family, kind in sorted(families):
+        lines.append(f'# TYPE {family} {kind}')
+        lines.extend(
+            f'{name}{_format_labels(labels)} {_format_value(value)}'
+            for name, labels, value in sorted(families[family, kind])
+        )
+    for name in sorted(_gauges):
+        try:
+            values = _gauges[name]()
+        except Exception:
+            logger.exception("Gauge failed", extra={'gauge': name})
+            continue
+        lines.append(f'# TYPE {name} gauge')
+        lines.extend(f'{name}{_format_labels(labels)} {value}' for labels, value in sorted(values))
+    return '\n'.join(lines) + '\n'
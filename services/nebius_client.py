@@ -0,0 +1,270 @@
+"""
+The one Nebius (OpenAI-compatible) client shared by the web and Celery
+processes, plus the resilience around every call made with it:
+
+- explicit connect/read timeouts and a bounded, keep-alive connection pool,
+  so a slow provider cannot hold a worker on a socket indefinitely;
+- a per-call deadline with jittered exponential retries for transient
+  failures (connection errors, timeouts, 429s and 5xx answers); a streamed
+  answer must also be read within it;
+- a circuit breaker per endpoint that fails fast with ProviderUnavailable
+  once the provider keeps failing, so callers can fall back to cached or
+  default output instead of queueing up behind it.
+
+Each attempt first waits for a slot in the cross-process rate limiter
+(services.rate_limit). Every call ends up in
+nebius_requests_total{endpoint, outcome} with outcome one of success, retry,
+failure, error, short_circuit or queue_timeout.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from openai import APIConnectionError, InternalServerError, OpenAI, RateLimitError
+
+from services import metrics, rate_limit
+from services.ai_backends import ProviderError, ProviderUnavailable
+from services.rate_limit import RateLimitTimeout
+
+
+logger = logging.getLogger(__name__)
+
+
+# APITimeoutError is a subclass of APIConnectionError
+TRANSIENT_ERRORS = (APIConnectionError, InternalServerError, RateLimitError)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """The process-wide client, built on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _build_client()
+    return _client
+
+
+def _build_client():
+    import httpx
+
+    api_key = os.environ.get("NEBIUS_API_KEY")
+    if not api_key:
+        raise ImproperlyConfigured("NEBIUS_API_KEY environment variable not set")
+    return OpenAI(
+        base_url=settings.NEBIUS_BASE_URL,
+        api_key=api_key,
+        # Retries are done here, under the call deadline and the breaker
+        max_retries=0,
+        timeout=httpx.Timeout(
+            settings.NEBIUS_READ_TIMEOUT_SECONDS,
+            connect=settings.NEBIUS_CONNECT_TIMEOUT_SECONDS,
+        ),
+        http_client=httpx.Client(
+            limits=httpx.Limits(
+                max_connections=settings.NEBIUS_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.NEBIUS_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=30,
+            ),
+        ),
+    )
+
+
+class CircuitBreaker:
+    """
+    closed: calls go through; `threshold` consecutive transient failures open it.
+    open: calls fail fast until `reset_seconds` have passed.
+    half-open: one trial call is let through; success closes it, failure
+    opens it again.
+    """
+
+    def __init__(self, name, threshold, reset_seconds):
+        self.name = name
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.threshold:
+                if self.opened_at is None or self.trial_running:
+                    logger.warning("Nebius circuit opened", extra={'endpoint': self.name, 'failures': self.failures})
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(endpoint):
+    with _breakers_lock:
+        if endpoint not in _breakers:
+            _breakers[endpoint] = CircuitBreaker(
+                endpoint,
+                threshold=settings.NEBIUS_BREAKER_THRESHOLD,
+                reset_seconds=settings.NEBIUS_BREAKER_RESET_SECONDS,
+            )
+        return _breakers[endpoint]
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff for the given (1-based) failed attempt"""
+    cap = min(settings.NEBIUS_RETRY_MAX_DELAY_SECONDS, settings.NEBIUS_RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1))
+    return random.uniform(0, cap)
+
+
+def _attempt_timeout(remaining):
+    """Connect/read timeouts for one attempt, never past the call deadline"""
+    import httpx
+
+    read = max(min(settings.NEBIUS_READ_TIMEOUT_SECONDS, remaining), 1.0)
+    return httpx.Timeout(read, connect=min(settings.NEBIUS_CONNECT_TIMEOUT_SECONDS, read))
+
+
+def call(endpoint, request, deadline, stream=False):
+    """
+    Run request(timeout) with retries, within `deadline` seconds overall.
+    `request` receives the httpx timeout for that attempt and performs one
+    provider call. Raises ProviderUnavailable when the breaker is open,
+    ProviderError once retries or the deadline are used up (RateLimitTimeout
+    if that happened waiting for a rate limiter slot), and
+    non-transient errors (bad request, auth) right away.
+    With stream=True the request opens a stream, returned as an iterator of
+    its chunks that keeps the rate limiter slot until it is exhausted or closed.
+    """
+    breaker = get_breaker(endpoint)
+    if not breaker.allow():
+        metrics.increment('nebius_requests_total', endpoint=endpoint, outcome='short_circuit')
+        raise ProviderUnavailable(f"Nebius {endpoint} circuit is open")
+
+    give_up_at = time.monotonic() + deadline
+    attempt = 1
+    while True:
+        try:
+            # Every attempt waits its turn in the cross-process rate limiter
+            ticket = rate_limit.acquire(endpoint, give_up_at - time.monotonic())
+            try:
+                response = request(_attempt_timeout(give_up_at - time.monotonic()))
+            except BaseException:
+                rate_limit.release(ticket)
+                raise
+            if not stream:
+                rate_limit.release(ticket)
+        except RateLimitTimeout:
+            metrics.increment('nebius_requests_total', endpoint=endpoint, outcome='queue_timeout')
+            raise
+        except TRANSIENT_ERRORS as e:
+            breaker.record_failure()
+            delay = backoff_delay(attempt)
+            out_of_time = time.monotonic() + delay >= give_up_at
+            if attempt >= settings.NEBIUS_MAX_ATTEMPTS or out_of_time or breaker.state != 'closed':
+                metrics.increment('nebius_requests_total', endpoint=endpoint, outcome='failure')
+                raise ProviderError(f"Nebius {endpoint} failed after {attempt} attempts: {e}") from e
+            metrics.increment('nebius_requests_total', endpoint=endpoint, outcome='retry')
+            logger.warning("Nebius attempt failed, retrying", extra={
+                'endpoint': endpoint, 'attempt': attempt, 'error': e.__class__.__name__, 'retry_in_s': round(delay, 2),
+            })
+            time.sleep(delay)
+            attempt += 1
+        except Exception:
+            # Our request was rejected; retrying would not help and the
+            # provider itself is fine
+            metrics.increment('nebius_requests_total', endpoint=endpoint, outcome='error')
+            breaker.record_success()
+            raise
+        else:
+            if stream:
+                # Succeeds or fails once it has been read
+                return _held_stream(endpoint, response, ticket, give_up_at)
+            breaker.record_success()
+            metrics.increment('nebius_requests_total', endpoint=endpoint, outcome='success')
+            return response
+
+
+def _held_stream(endpoint, stream, ticket, give_up_at):
+    """
+    The chunks of an opened stream; its slot is given back once it is done.
+    Breaking off, or still running at the call deadline, counts as a failed
+    call for the breaker. (A stalled read is cut off by the attempt's read
+    timeout, which never reaches past the deadline either.)
+    """
+    import httpx
+
+    breaker = get_breaker(endpoint)
+    outcome = 'failure'
+    try:
+        for chunk in stream:
+            if time.monotonic() >= give_up_at:
+                raise ProviderError(f"Nebius {endpoint} stream still running at its deadline")
+            yield chunk
+        outcome = 'success'
+    except GeneratorExit:
+        # The caller stopped reading; the provider was fine
+        outcome = 'success'
+        raise
+    except (*TRANSIENT_ERRORS, httpx.TransportError) as e:
+        raise ProviderError(f"Nebius {endpoint} stream broke off: {e}") from e
+    finally:
+        stream.close()
+        rate_limit.release(ticket)
+        if outcome == 'success':
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+        metrics.increment('nebius_requests_total', endpoint=endpoint, outcome=outcome)
+
+
+def chat_completion(**kwargs):
+    """client.chat.completions.create(**kwargs) under the chat deadline and breaker"""
+    return call(
+        'chat',
+        lambda timeout: get_client().chat.completions.create(timeout=timeout, **kwargs),
+        settings.NEBIUS_CHAT_DEADLINE_SECONDS,
+        stream=kwargs.get('stream', False),
+    )
+
+
+def generate_image(**kwargs):
+    """client.images.generate(**kwargs) under the image deadline and breaker"""
+    return call(
+        'images',
+        lambda timeout: get_client().images.generate(timeout=timeout, **kwargs),
+        settings.NEBIUS_IMAGE_DEADLINE_SECONDS,
+    )
@@ -0,0 +1,45 @@
+"""
+Browser notifications over Django Channels.
+
+The rendering pipeline calls notify_palace_ready once a new palace image has
+been written, and streamed decomposition calls notify_sub_task_created for
+each sub-task as it is stored; every dashboard the task's owner has open
+receives them over its WebSocket (apps.tasks.consumers.PalaceConsumer).
+"""
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+
+def palace_group_name(user_id):
+    # Sessions without a user are shared by all anonymous visitors
+    return f'palaces_user_{user_id}' if user_id else 'palaces_anonymous'
+
+
+def _send(main_task, event):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(palace_group_name(main_task.session.user_id), event)
+
+
+def notify_palace_ready(main_task, palace_image_url, palace_image_srcset=None):
+    _send(main_task, {
+        'type': 'palace.ready',
+        'task_id': main_task.id,
+        'palace_image_url': palace_image_url,
+        'palace_image_srcset': palace_image_srcset,
+    })
+
+
+def notify_sub_task_created(main_task, sub_task):
+    _send(main_task, {
+        'type': 'sub_task.created',
+        'task_id': main_task.id,
+        'sub_task': {
+            'id': sub_task.id,
+            'title': sub_task.title,
+            'order': sub_task.order,
+            'time_estimate': sub_task.time_estimate,
+        },
+    })
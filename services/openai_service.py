@@ -1,35 +1,31 @@
-import os
 import json
+import logging
 import re
 
-from openai import OpenAI
+from services import decomposition_cache, metrics
+from services.ai_backends import ProviderUnavailable, get_backend
+from services.json_stream import DecompositionStreamParser
 
-api_key = os.environ.get("NEBIUS_API_KEY")
-if not api_key:
-    raise Exception("NEBIUS_API_KEY environment variable not set")
-
-client = OpenAI(
-    base_url="https://api.studio.nebius.ai/v1/",
-    api_key=api_key,
-)
+logger = logging.getLogger(__name__)
 
 def strip_think_block(text: str) -> str:
     return re.sub(r"<think>[\s\S]*?</think>", "", text).strip()
 
 def extract_last_json_block(text: str) -> dict:
-    matches = list(re.finditer(r'\{[\s\S]*?\}', text))
-    for match in reversed(matches):
-        try:
-            return json.loads(match.group(0))
-        except json.JSONDecodeError:
-            continue
-    raise ValueError(f"Could not find valid JSON in:\n{text}")
+    """Last complete top-level JSON object in the text (nested objects included)"""
+    parser = DecompositionStreamParser()
+    parser.feed(text)
+    result = parser.close()
+    if not isinstance(result, dict):
+        raise ValueError(f"Could not find valid JSON in:\n{text}")
+    return result
 
-def analyze_task(task_description: str) -> dict:
-    prompt_schema = """
-You must respond with ONLY a valid JSON object. No thinking, no explanations, no <think> blocks.
+# Part of the decomposition cache key (with the backend's chat model): bump
+# PROMPT_VERSION whenever the prompt below changes so cached results from the
+# old prompt are not reused.
+PROMPT_VERSION = "1"
 
-{
+DECOMPOSITION_SCHEMA = """{
     "category": "creative|analytical|physical|administrative",
     "complexity": 1-5,
     "layer_description": "detailed palace element description",
@@ -48,7 +44,15 @@ Assign order numbers to sub-tasks based on logical completion sequence (1, 2, 3,
 For each sub-task, you MUST estimate the time required to complete it (in minutes) and include it as the "time_estimate" field. Think carefully about how long each step would realistically take for an average person. Do not skip this field. Be as accurate as possible.
 """
 
-    prompt = f"""
+SYSTEM_PROMPT = "You are a JSON-only API. Respond with valid JSON only. No thinking blocks, no explanations, no commentary."
+
+def build_decomposition_prompt(task_description: str) -> str:
+    prompt_schema = f"""
+You must respond with ONLY a valid JSON object. No thinking, no explanations, no <think> blocks.
+
+{DECOMPOSITION_SCHEMA}"""
+
+    return f"""
 Analyze this task and return ONLY valid JSON: "{task_description}"
 
 {prompt_schema}
@@ -56,21 +60,163 @@ Analyze this task and return ONLY valid JSON: "{task_description}"
 Remember: ONLY JSON, no thinking, no explanations.
 """
 
-    response = client.chat.completions.create(
-        model="Qwen/Qwen3-235B-A22B",
-        messages=[
-            {"role": "system", "content": "You are a JSON-only API. Respond with valid JSON only. No thinking blocks, no explanations, no commentary."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.1,
-        max_tokens=512,
-    )
+def decomposition_messages(prompt: str) -> list:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+@metrics.span('analyze_task')
+def analyze_task(task_description: str) -> dict:
+    backend = get_backend()
+    cached = decomposition_cache.get(task_description, backend.chat_model, PROMPT_VERSION)
+    if cached is not None:
+        return cached
 
-    content = response.choices[0].message.content.strip()
+    prompt = build_decomposition_prompt(task_description)
+
+    try:
+        content = backend.chat(decomposition_messages(prompt), max_tokens=512).strip()
+    except ProviderUnavailable:
+        # The provider is degraded: answer now with the basic plan (not cached)
+        logger.warning("Provider unavailable, using the default decomposition", extra={'backend': backend.name, 'description': task_description})
+        return default_decomposition()
     
     # Remove any thinking blocks
     content = strip_think_block(content)
     
+    result = parse_decomposition(content)
+    if not is_valid_decomposition(result):
+        # If all else fails, create a basic response (not cached)
+        logger.warning("Failed to parse LLM response", extra={'content': content})
+        return default_decomposition()
+    decomposition_cache.put(task_description, backend.chat_model, PROMPT_VERSION, result)
+    return result
+
+@metrics.span('analyze_task_stream')
+def analyze_task_stream(task_description: str, on_sub_task=None) -> dict:
+    """
+    Like analyze_task, but streams the completion and calls on_sub_task(sub)
+    for every sub-task as soon as the model has finished writing it.
+    """
+    on_sub_task = on_sub_task or (lambda sub: None)
+    backend = get_backend()
+    cached = decomposition_cache.get(task_description, backend.chat_model, PROMPT_VERSION)
+    if cached is not None:
+        for sub in cached.get('sub_tasks', []):
+            on_sub_task(sub)
+        return cached
+
+    try:
+        stream = backend.chat(
+            decomposition_messages(build_decomposition_prompt(task_description)),
+            max_tokens=512,
+            stream=True,
+        )
+    except ProviderUnavailable:
+        logger.warning("Provider unavailable, using the default decomposition", extra={'backend': backend.name, 'description': task_description})
+        stream = []
+    parser = DecompositionStreamParser()
+    streamed = []
+    for text in stream:
+        for sub in parser.feed(text):
+            streamed.append(sub)
+            on_sub_task(sub)
+    result = parser.close()
+
+    if is_valid_decomposition(result):
+        decomposition_cache.put(task_description, backend.chat_model, PROMPT_VERSION, result)
+        return result
+    # The answer was cut off or malformed: keep whatever sub-tasks made it (not cached)
+    logger.warning("Failed to parse streamed LLM response", extra={'description': task_description})
+    result = default_decomposition()
+    if streamed:
+        result["sub_tasks"] = streamed
+    else:
+        for sub in result["sub_tasks"]:
+            on_sub_task(sub)
+    return result
+
+@metrics.span('analyze_tasks_batch')
+def analyze_tasks_batch(task_descriptions: list, batch_size: int = 5) -> list:
+    """
+    Decompose several tasks with as few LLM calls as possible.
+    Cached tasks are answered from the cache; the rest are packed batch_size
+    per request. Returns one result per description, in order.
+    """
+    model = get_backend().chat_model
+    results = [
+        decomposition_cache.get(description, model, PROMPT_VERSION)
+        for description in task_descriptions
+    ]
+    pending = [i for i, result in enumerate(results) if result is None]
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        batch_results = request_decomposition_batch([task_descriptions[i] for i in batch])
+        for i, result in zip(batch, batch_results):
+            if is_valid_decomposition(result):
+                decomposition_cache.put(task_descriptions[i], model, PROMPT_VERSION, result)
+                results[i] = result
+            else:
+                # The model skipped or mangled this one; ask for it on its own
+                results[i] = analyze_task(task_descriptions[i])
+    return results
+
+def request_decomposition_batch(task_descriptions: list) -> list:
+    """One LLM call for several tasks; returns a result (or None) per description"""
+    numbered = "\n".join(f'{i}. "{description}"' for i, description in enumerate(task_descriptions, 1))
+    prompt = f"""
+Analyze each of these {len(task_descriptions)} tasks and return ONLY valid JSON:
+
+{numbered}
+
+You must respond with ONLY a valid JSON object of the form {{"tasks": [...]}}, with one
+object per task in the same order, each with an extra "index" field holding the task number
+and otherwise following this schema:
+
+{DECOMPOSITION_SCHEMA}
+Remember: ONLY JSON, no thinking, no explanations.
+"""
+
+    results = [None] * len(task_descriptions)
+    try:
+        content = get_backend().chat(decomposition_messages(prompt), max_tokens=512 * len(task_descriptions))
+    except ProviderUnavailable:
+        # Each task then falls back on its own (cache or default)
+        return results
+
+    content = strip_think_block(content.strip())
+    parsed = parse_json_document(content)
+    items = parsed.get("tasks") if isinstance(parsed, dict) else parsed
+    if not isinstance(items, list):
+        logger.warning("Failed to parse batched LLM response", extra={'content': content})
+        return results
+    for position, item in enumerate(items):
+        if not isinstance(item, dict):
+            continue
+        index = item.pop("index", position + 1)
+        if isinstance(index, int) and 1 <= index <= len(results):
+            results[index - 1] = item
+    return results
+
+def parse_json_document(content: str):
+    """Parse a whole JSON document, ignoring any text around the outermost braces/brackets"""
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        pass
+    starts = [i for i in (content.find("{"), content.find("[")) if i != -1]
+    if not starts:
+        return None
+    start = min(starts)
+    end = content.rfind("}" if content[start] == "{" else "]")
+    try:
+        return json.loads(content[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+
+def parse_decomposition(content: str):
+    """Parse the LLM's JSON answer; None if no valid JSON could be found"""
     # Try direct JSON parsing first
     try:
         return json.loads(content)
@@ -79,36 +225,50 @@ Remember: ONLY JSON, no thinking, no explanations.
         try:
             return extract_last_json_block(content)
         except ValueError:
-            # If all else fails, create a basic response
-            print(f"Failed to parse LLM response: {content}")
-            return {
+            return None
+
+def is_valid_decomposition(result) -> bool:
+    """
+    Whether a parsed answer is a usable decomposition: only these are cached,
+    as one malformed reply would otherwise be served for the whole TTL
+    """
+    if not isinstance(result, dict):
+        return False
+    sub_tasks = result.get("sub_tasks")
+    return isinstance(sub_tasks, list) and bool(sub_tasks) and all(
+        isinstance(sub, dict) and isinstance(sub.get("title"), str) and sub["title"].strip()
+        for sub in sub_tasks
+    )
+
+def default_decomposition() -> dict:
+    return {
+        "category": "analytical",
+        "complexity": 3,
+        "layer_description": "Basic task foundation",
+        "sub_tasks": [
+            {
+                "title": "Plan the approach",
                 "category": "analytical",
+                "complexity": 2,
+                "order": 1
+            },
+            {
+                "title": "Execute the task",
+                "category": "analytical", 
                 "complexity": 3,
-                "layer_description": "Basic task foundation",
-                "sub_tasks": [
-                    {
-                        "title": "Plan the approach",
-                        "category": "analytical",
-                        "complexity": 2,
-                        "order": 1
-                    },
-                    {
-                        "title": "Execute the task",
-                        "category": "analytical", 
-                        "complexity": 3,
-                        "order": 2
-                    },
-                    {
-                        "title": "Review and refine",
-                        "category": "analytical",
-                        "complexity": 2,
-                        "order": 3
-                    },
-                    {
-                        "title": "Complete and document",
-                        "category": "administrative",
-                        "complexity": 1,
-                        "order": 4
-                    }
-                ]
+                "order": 2
+            },
+            {
+                "title": "Review and refine",
+                "category": "analytical",
+                "complexity": 2,
+                "order": 3
+            },
+            {
+                "title": "Complete and document",
+                "category": "administrative",
+                "complexity": 1,
+                "order": 4
             }
+        ]
+    }
@@ -0,0 +1,100 @@
+"""
+Layer-mask atlas for client-side palace compositing (PALACE_RENDER_MODE =
+'client').
+
+The browser gets the complete palace, the background plate and one atlas
+per palace, then composes any completion state on a canvas itself. The atlas
+packs the non-empty rows of every sub-task's precomputed band
+(services.palace_layers) one below the other, as a white image whose alpha
+is the band. Its layout says where each layer's rows come from and go to,
+and how much the union of the bands is blurred:
+
+    {"width": 512, "height": 512, "blur": 3.0, "layers": [
+        {"id": 17, "order": 1, "top": 402, "y": 0, "height": 110}, ...]}
+
+The bands are 0 or 255, so adding the completed layers' rows with the
+"lighter" canvas operation gives their union, which the browser blurs like
+the server does.
+"""
+
+import hashlib
+import io
+import json
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from services.lru import LRUCache
+from services.palace_store import RENDER_VERSION, complete_palace_digest, geometry_seed
+
+
+ATLAS_DIR = 'palaces/atlases'
+
+# Parsed layouts keyed by atlas name
+layout_cache = LRUCache(256, name='atlas_layouts')
+
+
+def atlas_name(main_task, total_count):
+    # Per task, like rendered palaces: the layout lists its sub-tasks' ids and waves
+    digest, seed = complete_palace_digest(main_task), geometry_seed(main_task)
+    key = hashlib.sha256(f"{RENDER_VERSION}:{digest}:{seed}:{total_count}".encode()).hexdigest()
+    return f"{ATLAS_DIR}/{key[:2]}/{key}"
+
+
+def build_palace_atlas(main_task, sub_tasks, complete, background):
+    """Pack the layer bands of a palace into an atlas PNG + layout JSON; returns the layout"""
+    import numpy as np
+    from PIL import Image
+    from services.palace_layers import get_layer_masks
+    from services.palace_masks import blur_radius
+
+    masks = get_layer_masks(main_task, sub_tasks, complete, background)
+    width, height = complete.size
+    layers, bands, y = [], [], 0
+    for sub in sorted(sub_tasks, key=lambda sub: (sub.order or 0, sub.id)):
+        rows = np.flatnonzero(masks[sub.id].any(axis=1))
+        if not len(rows):
+            continue
+        top, bottom = int(rows[0]), int(rows[-1]) + 1
+        bands.append(masks[sub.id][top:bottom])
+        layers.append({'id': sub.id, 'order': sub.order, 'top': top, 'y': y, 'height': bottom - top})
+        y += bottom - top
+    alpha = np.concatenate(bands) if bands else np.zeros((1, width), dtype=np.uint8)
+    atlas = Image.merge("LA", (Image.new("L", (width, len(alpha)), 255), Image.fromarray(alpha, mode="L")))
+    buf = io.BytesIO()
+    atlas.save(buf, format="PNG", optimize=True)
+
+    name = atlas_name(main_task, len(sub_tasks))
+    layout = {'width': width, 'height': height, 'blur': blur_radius(height), 'layers': layers}
+    if not default_storage.exists(f"{name}.png"):
+        default_storage.save(f"{name}.png", ContentFile(buf.getvalue()))
+    if not default_storage.exists(f"{name}.json"):
+        default_storage.save(f"{name}.json", ContentFile(json.dumps(layout).encode()))
+    layout_cache.put(name, layout)
+    return layout
+
+
+def get_palace_atlas(main_task, sub_tasks):
+    """
+    Everything the browser needs to compose the palace: image URLs, the atlas
+    layout and the ids of the completed sub-tasks
+    """
+    name = atlas_name(main_task, len(sub_tasks))
+    layout = layout_cache.get(name)
+    if layout is None and default_storage.exists(f"{name}.json"):
+        with default_storage.open(f"{name}.json", 'rb') as f:
+            layout = json.load(f)
+        layout_cache.put(name, layout)
+    if layout is None or not main_task.palace_background_image:
+        from services.palace_plates import get_palace_plates
+        complete, background = get_palace_plates(main_task)
+        if layout is None:
+            layout = build_palace_atlas(main_task, sub_tasks, complete, background)
+    return {
+        'task_id': main_task.id,
+        'complete_url': main_task.complete_palace_image.url,
+        'background_url': main_task.palace_background_image.url,
+        'atlas_url': default_storage.url(f"{name}.png"),
+        **layout,
+        'completed': [sub.id for sub in sub_tasks if sub.is_completed],
+    }
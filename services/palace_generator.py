@@ -1,42 +1,45 @@
-import threading
+from django.conf import settings
 from django.core.files.base import ContentFile
-from services.openai_service import client
-import base64
+from services import metrics
+from services.ai_backends import get_backend
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import uuid
-from PIL import Image, ImageDraw
 import io
-import numpy as np
-from PIL import ImageFilter 
+import logging
 from django.db import models
-import os
-import math
-import random
+# numpy/PIL (palace_masks, palace_plates) are imported where an image is
+# actually built, so importing this module stays cheap for web/worker boot
+from services.palace_renditions import create_renditions, has_renditions
+from services.palace_store import (
+    complete_palace_digest,
+    completion_bitmask,
+    find_rendered_palace,
+    geometry_seed,
+    rendered_palace_name,
+    store_rendered_palace,
+)
 
+logger = logging.getLogger(__name__)
+
+class PalaceGenerationError(Exception):
+    """Raised when the image provider did not return a palace; the job is retried."""
+
+
+@metrics.span('call_nebius_api')
 def call_nebius_api(prompt, size="512x512"):
-    print(f"Making API call with prompt: {prompt[:100]}...")
+    """
+    Generate one image with the configured AI backend and return its PNG
+    bytes. Provider failures (after the client's own retries) and an open
+    circuit raise PalaceGenerationError, so the Celery job retries later
+    instead of hanging on the provider.
+    """
+    logger.debug("Generating image", extra={'prompt': prompt[:100], 'size': size})
+    width, height = (int(side) for side in size.split("x"))
     try:
-        response = client.images.generate(
-            model="black-forest-labs/flux-dev",
-            prompt=prompt,
-            response_format="b64_json",
-            extra_body={
-                "response_extension": "png",
-                "width": int(size.split("x")[0]),
-                "height": int(size.split("x")[1]),
-                "num_inference_steps": 28,
-                "negative_prompt": "fantasy, magical, unrealistic, cartoon, anime, abstract, surreal",
-                "seed": -1
-            }
-        )
-        print(f"API response received: {response}")
-        b64_image = response.data[0].b64_json
-        decoded_image = base64.b64decode(b64_image)
-        return decoded_image
+        return get_backend().generate_image(prompt, width, height)
     except Exception as e:
-        print(f"Error in API call: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
+        raise PalaceGenerationError(f"Image generation failed: {e}") from e
 
 def build_complete_palace_prompt(main_task):
     """Build prompt for the complete palace with all layers"""
@@ -76,142 +79,203 @@ Make the viewer feel the satisfaction and pride of having completed: \"{main_tas
 
 def generate_complete_palace_once(main_task):
     """Generate the complete palace image ONLY ONCE and save it"""
-    print(f"Generating complete palace for task: {main_task.title}")
+    logger.info("Generating complete palace", extra={'task_id': main_task.id})
     
     # Check if we already have a complete palace image
     if hasattr(main_task, 'complete_palace_image') and main_task.complete_palace_image:
-        print("Complete palace already exists, skipping generation")
+        logger.info("Complete palace already exists, skipping generation", extra={'task_id': main_task.id})
         return main_task.complete_palace_image
     
     complete_prompt = build_complete_palace_prompt(main_task)
-    print(f"Complete palace prompt: {complete_prompt}")
+    logger.debug("Complete palace prompt", extra={'task_id': main_task.id, 'prompt': complete_prompt})
     
     complete_image_bytes = call_nebius_api(complete_prompt)
     
     if complete_image_bytes:
         # Save complete palace to a separate field
         filename = f'complete_palace_{uuid.uuid4().hex[:8]}.png' # Name is chosen based on the task id
-        main_task.complete_palace_image.save(filename, ContentFile(complete_image_bytes))
-        main_task.save()
-        print(f"Complete palace saved to: {main_task.complete_palace_image.url}")
-        print(f"Saved complete palace image to: {main_task.complete_palace_image.path}")
-        print(f"File exists: {os.path.exists(main_task.complete_palace_image.path)}")
+        main_task.complete_palace_digest = hashlib.sha256(complete_image_bytes).hexdigest()
+        with metrics.span('media_write', kind='complete'):
+            main_task.complete_palace_image.save(filename, ContentFile(complete_image_bytes), save=False)
+        # Only these columns: progress counters may be changing meanwhile
+        main_task.save(update_fields=['complete_palace_image', 'complete_palace_digest'])
+        # Blur/darken the background plate once, instead of on every toggle
+        from services.palace_plates import save_background_plate
+        complete, background = save_background_plate(main_task)
+        # Compressed, resized copies for the page previews only need the
+        # complete palace, so they are encoded while the layers are built
+        # (Pillow releases the GIL while resizing and encoding)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            renditions = pool.submit(create_renditions, main_task.complete_palace_image.name, complete)
+            # Every layer's mask and reveal once, so toggles only sum masks
+            from services.palace_layers import precompute_layer_reveals
+            sub_tasks = list(main_task.sub_tasks.all())
+            precompute_layer_reveals(main_task, sub_tasks, complete, background)
+            if settings.PALACE_RENDER_MODE == 'client':
+                # Browsers compose the palace themselves from the layer atlas
+                from services.palace_atlas import build_palace_atlas
+                build_palace_atlas(main_task, sub_tasks, complete, background)
+            renditions.result()
+        logger.info("Complete palace saved", extra={'task_id': main_task.id, 'image': main_task.complete_palace_image.name})
         return main_task.complete_palace_image
     return None
 
+def ensure_reveal_geometry(sub_tasks):
+    """Give sub-tasks without a stored reveal wave their (seeded) wave, once"""
+    from services.palace_masks import wave_geometry
+
+    missing = [sub for sub in sub_tasks if sub.wave_amplitude is None]
+    for sub in missing:
+        sub.wave_amplitude, sub.wave_frequency, sub.wave_phase = wave_geometry(sub.id)
+    if missing:
+        type(missing[0]).objects.bulk_update(missing, ['wave_amplitude', 'wave_frequency', 'wave_phase'])
+    return sub_tasks
+
 def create_layer_specific_mask(completed_subtasks, total_count, size=(512, 512)):
     """
     Create a mask that reveals only the specific layers for completed sub-tasks
     - Each completed task reveals only its own layer, not previous ones
-    - completed_subtasks: queryset of completed sub-tasks
+    - completed_subtasks: completed sub-tasks
     - total_count: total number of sub-tasks
-    - Mask shape: wavy top/bottom for each layer
+    - size: (width, height) of the palace image the mask is applied to
+    - Mask shape: wavy top/bottom for each layer, stored per sub-task so the
+      same completion state always renders the same image
     """
-    w, h = size
-    mask_arr = np.zeros((h, w), dtype=np.uint8)
-    if not completed_subtasks.exists():
-        return Image.fromarray(mask_arr, mode="L")
-    layer_height = h // total_count
-    for subtask in completed_subtasks:
-        order = subtask.order
-        if order > 0 and order <= total_count:
-            layer_start = h - (order * layer_height)
-            layer_end = h - ((order - 1) * layer_height)
-            layer_start = max(0, layer_start)
-            layer_end = min(h, layer_end)
-            # Wavy mask: create a polygon for the layer with a wavy top
-            amplitude = random.randint(10, 25)
-            frequency = random.uniform(1.5, 2.5)
-            phase = random.uniform(0, 2 * math.pi)
-            top_wave = [
-                (x, layer_start + amplitude * math.sin(frequency * x / w * 2 * math.pi + phase))
-                for x in range(w)
-            ]
-            bottom_wave = [
-                (x, layer_end + amplitude * math.sin(frequency * x / w * 2 * math.pi + phase + math.pi))
-                for x in reversed(range(w))
-            ]
-            polygon = top_wave + bottom_wave
-            img = Image.fromarray(mask_arr, mode="L")
-            draw = ImageDraw.Draw(img)
-            draw.polygon(polygon, fill=255)
-            mask_arr = np.maximum(mask_arr, np.array(img))
-            print(f"Revealing wavy layer {order}: rows {layer_start}-{layer_end}")
-    mask_img = Image.fromarray(mask_arr, mode="L")
-    mask_img = mask_img.filter(ImageFilter.GaussianBlur(3))
-    return mask_img
+    from services.palace_masks import build_layer_mask
+
+    layers = [
+        (subtask.order, subtask.wave_amplitude, subtask.wave_frequency, subtask.wave_phase)
+        for subtask in ensure_reveal_geometry(list(completed_subtasks))
+    ]
+    return build_layer_mask(layers, total_count, size)
+
+def composite_plates(complete, background, mask_img):
+    """Reveal the complete palace over its background plate where the mask is white"""
+    from PIL import Image
 
-def apply_mask_to_image(complete_bytes, mask_img, grey_color=(128, 128, 128)):
-    """Apply mask to reveal palace parts over blurred/darkened palace background"""
     try:
-        complete = Image.open(io.BytesIO(complete_bytes)).convert("RGB")
-        # Create blurred and darkened background
-        blurred_bg = complete.filter(ImageFilter.GaussianBlur(16))
-        dark_overlay = Image.new("RGB", complete.size, (30, 30, 30))
-        blurred_bg = Image.blend(blurred_bg, dark_overlay, alpha=0.5)
         # Resize mask to match image size
-        mask_img = mask_img.resize(complete.size)
+        if mask_img.size != complete.size:
+            mask_img = mask_img.resize(complete.size)
         # Composite: white in mask = palace, black = blurred bg
-        final = Image.composite(complete, blurred_bg, mask_img)
+        with metrics.span('composite'):
+            final = Image.composite(complete, background, mask_img)
         buf = io.BytesIO()
-        final.save(buf, format="PNG")
+        with metrics.span('png_encode'):
+            final.save(buf, format="PNG")
         return buf.getvalue()
-    except Exception as e:
-        print(f"Error applying mask: {e}")
+    except Exception:
+        logger.exception("Error applying mask")
+        return None
+
+def apply_mask_to_image(complete_bytes, mask_img, grey_color=(128, 128, 128)):
+    """Apply mask to reveal palace parts over blurred/darkened palace background"""
+    from PIL import Image
+    from services.palace_plates import build_background_plate
+
+    try:
+        complete = Image.open(io.BytesIO(complete_bytes)).convert("RGB")
+    except Exception:
+        logger.exception("Error decoding the complete palace")
         return None
+    return composite_plates(complete, build_background_plate(complete), mask_img)
+
+def set_palace_image(main_task, name):
+    """Point palace_image at an already stored file, without touching other fields"""
+    main_task.palace_image.name = name
+    main_task.save(update_fields=['palace_image'])
+
+@metrics.span('render_palace_state')
+def render_palace_state(main_task):
+    """
+    Render the palace for the current completion state and return the stored
+    image name (None if there is nothing to render)
+    """
+    complete_palace_image = main_task.complete_palace_image
+    if not complete_palace_image:
+        logger.warning("No complete palace to composite", extra={'task_id': main_task.id})
+        return None
+    # Common case: this state was rendered before, found from the task's own
+    # completion counters without loading its sub-tasks
+    if main_task.sub_tasks_total:
+        if main_task.sub_tasks_completed == main_task.sub_tasks_total:
+            return complete_palace_image.name
+        name = rendered_palace_name(
+            complete_palace_digest(main_task), geometry_seed(main_task), main_task.sub_tasks_total, main_task.completion_mask,
+        )
+        if find_rendered_palace(name) and has_renditions(name):
+            return name
+    # 1. Calculate completion progress based on order
+    sub_tasks = list(main_task.sub_tasks.all())
+    completed_subtasks = [sub for sub in sub_tasks if sub.is_completed]
+    total_count = len(sub_tasks)
+    # If all sub-tasks are complete, show the complete palace itself (no copy)
+    if len(completed_subtasks) == total_count and total_count > 0:
+        return complete_palace_image.name
+    # Reuse the render if this completion state was rendered before
+    bitmask = completion_bitmask(sub.order for sub in completed_subtasks)
+    name = rendered_palace_name(complete_palace_digest(main_task), geometry_seed(main_task), total_count, bitmask)
+    if find_rendered_palace(name):
+        logger.info("Reusing rendered palace", extra={'task_id': main_task.id, 'image': name})
+        if not has_renditions(name):
+            # Single-layer states are stored at palace creation without them
+            create_renditions(name)
+        return name
+    # Decoded once per palace, not per toggle
+    from services.palace_plates import get_palace_plates
+    complete, background = get_palace_plates(main_task)
+    # 2. Union of the completed layers' precomputed masks (each completed
+    #    task reveals only its layer) at the resolution of the complete palace
+    from services.palace_layers import layer_union_mask
+    mask_image = layer_union_mask(main_task, sub_tasks, completed_subtasks, complete, background)
+    # 3. Apply mask to reveal specific layers
+    final_image_bytes = composite_plates(complete, background, mask_image)
+    if not final_image_bytes:
+        logger.error("Failed to create layer-specific palace image", extra={'task_id': main_task.id})
+        return None
+    name = store_rendered_palace(name, final_image_bytes)
+    from PIL import Image
+    create_renditions(name, Image.open(io.BytesIO(final_image_bytes)))
+    logger.info("Rendered palace saved", extra={
+        'task_id': main_task.id, 'image': name, 'completed': len(completed_subtasks), 'layers': total_count,
+    })
+    return name
+
+def composite_palace_layers(main_task):
+    """Reveal the completed sub-task layers of an existing complete palace"""
+    name = render_palace_state(main_task)
+    if name:
+        set_palace_image(main_task, name)
 
 def generate_palace_image(main_task):
-    print(f"Generating palace image for task: {main_task.title}")
-    # 1. Generate complete palace ONLY ONCE
+    # Generate complete palace ONLY ONCE, then reveal the completed layers
     complete_palace_image = generate_complete_palace_once(main_task)
     if not complete_palace_image:
-        print("Failed to generate complete palace")
-        return
-    # 2. Calculate completion progress based on order
-    completed_subtasks = main_task.sub_tasks.filter(is_completed=True)
-    total_count = main_task.sub_tasks.count()
-    print(f"Completed sub-tasks: {completed_subtasks.count()}/{total_count}")
-    # If all sub-tasks are complete, just copy the complete palace image
-    if completed_subtasks.count() == total_count and total_count > 0:
-        # Copy the complete palace image to palace_image
-        with open(complete_palace_image.path, 'rb') as f:
-            complete_bytes = f.read()
-        filename = f'palace_{uuid.uuid4().hex[:8]}.png'
-        main_task.palace_image.save(filename, ContentFile(complete_bytes))
-        main_task.save()
-        print(f"Final palace image (unmasked) saved to: {main_task.palace_image.url}")
+        logger.error("Failed to generate complete palace", extra={'task_id': main_task.id})
         return
-    # 3. Create layer-specific mask (each completed task reveals only its layer)
-    mask_image = create_layer_specific_mask(completed_subtasks, total_count)
-    # 4. Apply mask to reveal specific layers
-    with open(complete_palace_image.path, 'rb') as f:
-        complete_palace_bytes = f.read()
-    final_image_bytes = apply_mask_to_image(complete_palace_bytes, mask_image)
-    if final_image_bytes:
-        filename = f'palace_{uuid.uuid4().hex[:8]}.png'
-        main_task.palace_image.save(filename, ContentFile(final_image_bytes))
-        main_task.save()
-        print(f"Layer-specific palace saved to: {main_task.palace_image.url}")
-        print(f"Saved palace image to: {main_task.palace_image.path}")
-        print(f"File exists: {os.path.exists(main_task.palace_image.path)}")
-    else:
-        print("Failed to create layer-specific palace image")
+    composite_palace_layers(main_task)
 
 def trigger_palace_generation_async(main_task):
-    threading.Thread(target=generate_palace_image, args=(main_task,)).start()
+    """Queue palace generation + compositing on the Celery workers"""
+    from celery import chain
+    from apps.tasks.tasks import generate_complete_palace, composite_palace
+
+    chain(
+        generate_complete_palace.si(main_task.id),
+        composite_palace.si(main_task.id),
+    ).delay()
 
 def test_image_generation():
     """Test function to verify image generation is working"""
-    print("Testing image generation...")
     try:
         test_prompt = "A simple test image of a building foundation."
         image_bytes = call_nebius_api(test_prompt)
         if image_bytes:
-            print(f"Test successful! Generated {len(image_bytes)} bytes")
+            logger.info("Test image generated", extra={'bytes': len(image_bytes)})
             return True
         else:
-            print("Test failed: No image bytes returned")
+            logger.error("Test failed: no image bytes returned")
             return False
-    except Exception as e:
-        print(f"Test failed with error: {e}")
+    except Exception:
+        logger.exception("Test image generation failed")
         return False 
\ No newline at end of file
@@ -0,0 +1,123 @@
+"""
+Per-layer reveals, precomputed once per palace.
+
+Right after the complete palace is generated, every sub-task gets:
+
+- layer_image: its own band of the reveal mask, before the blur ("L" PNG,
+  255 = revealed);
+- layer_revealed_image: the palace with only that layer revealed, stored in
+  the rendered-palace store, so single-layer states are plain lookups.
+
+The wave edges of adjacent bands overlap, so blurred single-layer masks can't
+simply be added up. Rendering any other completion state is the union
+(np.maximum) of the completed layers' bands, one blur and one composite,
+exactly what services.palace_masks.build_layer_mask gives for those layers,
+without rasterizing the waves again. The bands are kept decoded in an LRU.
+"""
+
+import io
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from services import metrics
+from services.lru import LRUCache
+from services.palace_store import (
+    complete_palace_digest,
+    completion_bitmask,
+    find_rendered_palace,
+    geometry_seed,
+    rendered_palace_name,
+    store_rendered_palace,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# {sub-task id: uint8 mask array} keyed by (complete image name, layer count)
+layer_cache = LRUCache(getattr(settings, 'PALACE_PLATE_CACHE_SIZE', 32), name='layer_masks')
+
+
+def layer_mask_stem(sub_task, total_count):
+    # A band depends on the layer count (band height), so it is part of the
+    # name. Masks stored blurred, before bands, were named layer_<id>_of_<n>.
+    return f'band_{sub_task.id}_of_{total_count}'
+
+
+def has_layer_mask(sub_task, total_count):
+    name = sub_task.layer_image.name if sub_task.layer_image else ''
+    return os.path.basename(name).startswith(layer_mask_stem(sub_task, total_count) + '.')
+
+
+@metrics.span('precompute_layers')
+def precompute_layer_reveals(main_task, sub_tasks, complete, background):
+    """
+    Store the band and single-layer reveal of every sub-task of a palace and
+    return {sub-task id: band array}
+    """
+    import numpy as np
+    from services.palace_generator import composite_plates, ensure_reveal_geometry
+    from services.palace_masks import blur_mask, build_layer_mask
+
+    total_count = len(sub_tasks)
+    digest = complete_palace_digest(main_task)
+    masks = {}
+    for sub in ensure_reveal_geometry(sub_tasks):
+        band = build_layer_mask(
+            [(sub.order, sub.wave_amplitude, sub.wave_frequency, sub.wave_phase)], total_count, complete.size, blur=False,
+        )
+        buf = io.BytesIO()
+        band.save(buf, format="PNG")
+        sub.layer_image.save(f'{layer_mask_stem(sub, total_count)}.png', ContentFile(buf.getvalue()), save=False)
+        name = rendered_palace_name(digest, geometry_seed(main_task), total_count, completion_bitmask([sub.order]))
+        if not find_rendered_palace(name):
+            name = store_rendered_palace(name, composite_plates(complete, background, blur_mask(band)))
+        sub.layer_revealed_image.name = name
+        masks[sub.id] = np.asarray(band)
+    if sub_tasks:
+        type(sub_tasks[0]).objects.bulk_update(sub_tasks, ['layer_image', 'layer_revealed_image'])
+    layer_cache.put((main_task.complete_palace_image.name, total_count), masks)
+    logger.info("Precomputed layer reveals", extra={'task_id': main_task.id, 'layers': len(masks)})
+    return masks
+
+
+def get_layer_masks(main_task, sub_tasks, complete, background):
+    """{sub-task id: band array} for all sub-tasks, precomputing them if needed"""
+    import numpy as np
+    from PIL import Image
+
+    total_count = len(sub_tasks)
+    key = (main_task.complete_palace_image.name, total_count)
+    masks = layer_cache.get(key)
+    if masks is not None and all(sub.id in masks for sub in sub_tasks):
+        return masks
+    if not all(has_layer_mask(sub, total_count) for sub in sub_tasks):
+        # Palaces generated before layers were precomputed, or whose layer
+        # count changed since
+        return precompute_layer_reveals(main_task, sub_tasks, complete, background)
+    masks = {}
+    for sub in sub_tasks:
+        with sub.layer_image.open('rb') as f:
+            masks[sub.id] = np.asarray(Image.open(f).convert("L"))
+    layer_cache.put(key, masks)
+    return masks
+
+
+def union_layer_masks(bands, size):
+    """Blurred union of single-layer bands (arrays) as an "L" image of `size`"""
+    import numpy as np
+    from PIL import Image
+    from services.palace_masks import blur_mask
+
+    union = np.zeros(size[::-1], dtype=np.uint8)
+    for band in bands:
+        np.maximum(union, band, out=union)
+    return blur_mask(Image.fromarray(union, mode="L"))
+
+
+def layer_union_mask(main_task, sub_tasks, completed_subtasks, complete, background):
+    """Reveal mask of the completed layers, from their precomputed bands"""
+    masks = get_layer_masks(main_task, sub_tasks, complete, background)
+    return union_layer_masks([masks[sub.id] for sub in completed_subtasks], complete.size)
@@ -0,0 +1,97 @@
+"""
+Vectorized reveal masks for palace layers.
+
+Each sub-task owns a horizontal band of the palace (order 1 at the bottom)
+whose top and bottom edges are sine waves. The wave edges of every
+(layer, column) pair are computed in one broadcast, then each band is
+rasterized by comparing the row index against its per-column top/bottom arrays
+over just the rows it can touch. The blur is applied once to the final mask.
+"""
+
+import math
+import random
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from services import metrics
+
+
+# Wave amplitudes and blur radii are tuned for a 512px palace and scaled
+# proportionally for other resolutions.
+REFERENCE_HEIGHT = 512
+MASK_BLUR_RADIUS = 3
+
+
+def wave_geometry(seed):
+    """
+    Return the (amplitude, frequency, phase) of a layer's reveal wave. Seeded so
+    that a sub-task always gets the same wave.
+    """
+    rng = random.Random(seed)
+    amplitude = rng.randint(10, 25)
+    frequency = rng.uniform(1.5, 2.5)
+    phase = rng.uniform(0, 2 * math.pi)
+    return amplitude, frequency, phase
+
+
+def wave_edges(orders, amplitudes, frequencies, phases, total_count, size):
+    """
+    Return (top, bottom) float arrays of shape (layers, width) with the wavy
+    edges of each layer band in pixel rows.
+    """
+    w, h = size
+    layer_height = h // total_count
+    orders = np.asarray(orders, dtype=np.float64)[:, None]
+    amplitudes = np.asarray(amplitudes, dtype=np.float64)[:, None] * (h / REFERENCE_HEIGHT)
+    frequencies = np.asarray(frequencies, dtype=np.float64)[:, None]
+    phases = np.asarray(phases, dtype=np.float64)[:, None]
+    x = np.arange(w, dtype=np.float64)[None, :]
+    wave = amplitudes * np.sin(frequencies * x / w * 2 * math.pi + phases)
+    layer_start = np.maximum(0, h - orders * layer_height)
+    layer_end = np.minimum(h, h - (orders - 1) * layer_height)
+    # The bottom edge is the same wave shifted by half a period (sin(a + pi) == -sin(a))
+    return layer_start + wave, layer_end - wave
+
+
+@metrics.span('mask_build')
+def build_layer_mask(layers, total_count, size=(512, 512), blur=True):
+    """
+    Build the reveal mask for the given layers in one vectorized pass.
+    - layers: iterable of (order, amplitude, frequency, phase) tuples
+    - total_count: total number of sub-tasks (layers) in the palace
+    - size: (width, height) of the target image
+    Returns an "L" mode image: 255 = revealed, 0 = hidden.
+    """
+    w, h = size
+    layers = [layer for layer in layers if total_count and layer[0] is not None and 0 < layer[0] <= total_count]
+    if not layers:
+        return Image.new("L", size, 0)
+    orders, amplitudes, frequencies, phases = zip(*layers)
+    top, bottom = wave_edges(orders, amplitudes, frequencies, phases, total_count, size)
+    # Rows [first, stop) of every column are inside the band. Thin bands with
+    # large waves can cross over; like a polygon fill, the crossed part still counts.
+    first = np.clip(np.ceil(np.minimum(top, bottom)), 0, h).astype(np.intp)
+    stop = np.clip(np.floor(np.maximum(top, bottom)) + 1, 0, h).astype(np.intp)
+    # Compare the row index against each band's per-column edges, only over
+    # the rows the band can touch; the union of all bands is the reveal.
+    revealed = np.zeros((h, w), dtype=bool)
+    rows = np.arange(h)[:, None]
+    for band_first, band_stop in zip(first, stop):
+        lo, hi = band_first.min(), band_stop.max()
+        slab = rows[lo:hi]
+        revealed[lo:hi] |= (slab >= band_first) & (slab < band_stop)
+    mask_img = Image.fromarray(revealed.view(np.uint8) * 255, mode="L")
+    if blur:
+        mask_img = blur_mask(mask_img)
+    return mask_img
+
+
+def blur_radius(height):
+    return MASK_BLUR_RADIUS * height / REFERENCE_HEIGHT
+
+
+def blur_mask(mask_img):
+    """Soften the edges of an unblurred (0/255) reveal mask"""
+    return mask_img.filter(ImageFilter.GaussianBlur(blur_radius(mask_img.size[1])))
+
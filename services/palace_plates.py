@@ -0,0 +1,69 @@
+"""
+Decoded palace plates, computed once per palace.
+
+Compositing a palace needs the full-color complete palace and the blurred,
+darkened "background plate" shown behind layers that are not revealed yet.
+Neither changes once the complete palace exists, so the plate is persisted in
+Task.palace_background_image and both images are kept decoded in a bounded
+in-process LRU; a toggle then only pays for the mask composite.
+"""
+
+import io
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageFilter
+
+from services import metrics
+from services.lru import LRUCache
+
+
+BACKGROUND_BLUR_RADIUS = 16
+BACKGROUND_DARKEN_COLOR = (30, 30, 30)
+
+
+def build_background_plate(complete):
+    """Blur and darken the complete palace (an RGB image)"""
+    blurred_bg = complete.filter(ImageFilter.GaussianBlur(BACKGROUND_BLUR_RADIUS))
+    dark_overlay = Image.new("RGB", complete.size, BACKGROUND_DARKEN_COLOR)
+    return Image.blend(blurred_bg, dark_overlay, alpha=0.5)
+
+
+# (complete, background) image pairs keyed by the complete image name
+plate_cache = LRUCache(getattr(settings, 'PALACE_PLATE_CACHE_SIZE', 32), name='palace_plates')
+
+
+def _open_rgb(image_field):
+    with image_field.open('rb') as f:
+        return Image.open(f).convert("RGB")
+
+
+def save_background_plate(main_task, complete=None):
+    """Compute the background plate for the task's complete palace and persist it"""
+    if complete is None:
+        complete = _open_rgb(main_task.complete_palace_image)
+    background = build_background_plate(complete)
+    buf = io.BytesIO()
+    background.save(buf, format="PNG")
+    filename = f'background_{main_task.id}.png'
+    with metrics.span('media_write', kind='background'):
+        main_task.palace_background_image.save(filename, ContentFile(buf.getvalue()), save=False)
+    main_task.save(update_fields=['palace_background_image'])
+    plate_cache.put(main_task.complete_palace_image.name, (complete, background))
+    return complete, background
+
+
+def get_palace_plates(main_task):
+    """Return the decoded (complete, background) RGB images for a palace"""
+    key = main_task.complete_palace_image.name
+    plates = plate_cache.get(key)
+    if plates is not None:
+        return plates
+    complete = _open_rgb(main_task.complete_palace_image)
+    if not main_task.palace_background_image:
+        # Palaces generated before plates were persisted
+        return save_background_plate(main_task, complete)
+    background = _open_rgb(main_task.palace_background_image)
+    plates = (complete, background)
+    plate_cache.put(key, plates)
+    return plates
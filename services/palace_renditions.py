@@ -0,0 +1,102 @@
+"""
+Compressed, resized renditions of palace images for responsive <picture>s.
+
+Whenever a palace (rendered or complete) is stored, WebP and JPEG copies are
+written next to it at each of PALACE_RENDITION_WIDTHS, under a name derived
+from the original:
+
+    palaces/rendered/ab/cd/abcd....png
+    renditions/palaces/rendered/ab/cd/abcd....w256.webp
+
+Stored palace names never change content, so neither do their renditions.
+The widest WebP is written last and marks a complete set; pages check for it
+(once per process per image) and fall back to the original PNG without it.
+"""
+
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from services import metrics
+from services.lru import LRUCache
+
+
+RENDITION_DIR = 'renditions'
+# format: (PIL format, MIME type, encoder options), in <source> order
+RENDITION_FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# Original names whose renditions are known to exist
+_complete_sets = LRUCache(1024, name='renditions')
+
+
+def rendition_widths():
+    return sorted(settings.PALACE_RENDITION_WIDTHS)
+
+
+def rendition_name(name, width, fmt):
+    stem, _ = os.path.splitext(name)
+    return f"{RENDITION_DIR}/{stem}.w{width}.{fmt}"
+
+
+@metrics.span('renditions')
+def create_renditions(name, image=None):
+    """
+    Write the renditions of the stored image `name` (decoded from storage
+    unless the PIL `image` is given). Existing renditions are kept.
+    """
+    from PIL import Image
+
+    if image is None:
+        with default_storage.open(name, 'rb') as f:
+            image = Image.open(f)
+            image.load()
+    image = image.convert("RGB")
+    widths = rendition_widths()
+    marker = (widths[-1], 'webp')
+    if default_storage.exists(rendition_name(name, *marker)):
+        return
+    renditions = [(width, fmt) for width in widths for fmt in RENDITION_FORMATS if (width, fmt) != marker]
+    resized = {}
+    for width, fmt in renditions + [marker]:
+        target = rendition_name(name, width, fmt)
+        if default_storage.exists(target):
+            continue
+        if width not in resized:
+            resized[width] = image if width >= image.width else image.resize(
+                (width, round(image.height * width / image.width)), Image.LANCZOS
+            )
+        pil_format, _, options = RENDITION_FORMATS[fmt]
+        buf = io.BytesIO()
+        resized[width].save(buf, format=pil_format, **options)
+        default_storage.save(target, ContentFile(buf.getvalue()))
+    _complete_sets.put(name, True)
+
+
+def has_renditions(name):
+    if not name:
+        return False
+    if _complete_sets.get(name):
+        return True
+    if default_storage.exists(rendition_name(name, rendition_widths()[-1], 'webp')):
+        _complete_sets.put(name, True)
+        return True
+    return False
+
+
+def srcsets(name):
+    """{MIME type: srcset} for the stored image `name`, or None without renditions"""
+    if not has_renditions(name):
+        return None
+    return {
+        mime: ", ".join(
+            f"{default_storage.url(rendition_name(name, width, fmt))} {width}w"
+            for width in rendition_widths()
+        )
+        for fmt, (_, mime, _) in RENDITION_FORMATS.items()
+    }
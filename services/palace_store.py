@@ -0,0 +1,73 @@
+"""
+Content-addressed store for rendered palaces.
+
+A rendered palace is a pure function of the complete palace image, the shape
+of its layers and which layers are completed, so it is stored under a hash of
+(complete image digest, geometry seed, layer count, completion bitmask) in a
+sharded directory:
+
+    palaces/rendered/ab/cd/abcd....png
+
+A state that was rendered before (e.g. a sub-task toggled off and on again)
+reuses the existing file instead of writing a new one.
+"""
+
+import hashlib
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from services import metrics
+
+
+# Bump when the mask/composite output changes so old renders are not reused
+RENDER_VERSION = 2
+RENDERED_PALACE_DIR = 'palaces/rendered'
+
+
+def completion_bitmask(orders):
+    """Bit (order - 1) is set for every completed layer order"""
+    bitmask = 0
+    for order in orders:
+        if order is not None and order > 0:
+            bitmask |= 1 << (order - 1)
+    return bitmask
+
+
+def complete_palace_digest(main_task):
+    """SHA-256 of the complete palace image, computed once and stored on the task"""
+    if not main_task.complete_palace_digest:
+        digest = hashlib.sha256()
+        with main_task.complete_palace_image.open('rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                digest.update(chunk)
+        main_task.complete_palace_digest = digest.hexdigest()
+        main_task.save(update_fields=['complete_palace_digest'])
+    return main_task.complete_palace_digest
+
+
+def geometry_seed(main_task):
+    """
+    Identifies the reveal waves of a palace's layers. They are seeded by, and
+    stored on, the sub-tasks of one main task and never change, so two tasks
+    with identical complete images (e.g. AI_BACKEND=local) don't share renders.
+    """
+    return main_task.id
+
+
+def rendered_palace_name(digest, seed, total_count, bitmask):
+    key = hashlib.sha256(f"{RENDER_VERSION}:{digest}:{seed}:{total_count}:{bitmask:x}".encode()).hexdigest()
+    return f"{RENDERED_PALACE_DIR}/{key[:2]}/{key[2:4]}/{key}.png"
+
+
+def find_rendered_palace(name):
+    return name if default_storage.exists(name) else None
+
+
+def store_rendered_palace(name, image_bytes):
+    """Write a rendered palace; returns the name it was actually stored under"""
+    if default_storage.exists(name):
+        # Rendered concurrently by another worker; the content is identical
+        return name
+    with metrics.span('media_write', kind='rendered'):
+        return default_storage.save(name, ContentFile(image_bytes))
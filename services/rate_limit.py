@@ -0,0 +1,185 @@
+"""
+Rate limiting and priority scheduling of Nebius calls across all processes.
+
+Every web and Celery process talks to Nebius, so the limits live in the
+database. Per endpoint (NEBIUS_RATE_LIMITS):
+
+- a token bucket (ProviderRateBucket) admits `rate` calls per second, with
+  bursts of up to `burst`;
+- at most `concurrency` calls are in flight (active ProviderTickets).
+
+A call takes a ticket and polls until it is admitted. Waiting tickets are
+served by priority, then oldest first, so interactive work (a user creating a
+task) goes ahead of bulk imports:
+
+    with rate_limit.priority('bulk'):
+        decompose_tasks_batch(main_tasks)
+
+Tickets expire if their process dies: waiting ones after a few missed polls,
+active ones after NEBIUS_RATE_LIMIT_LEASE_SECONDS. Streamed completions
+keep their slot until the stream is exhausted or closed.
+
+Queue waits are recorded in nebius_queue_wait_seconds{endpoint, priority},
+waiting calls are reported by the nebius_queue_depth gauge.
+"""
+
+import contextvars
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.utils import timezone
+
+from services import metrics
+from services.ai_backends import ProviderError
+
+
+PRIORITIES = {'interactive': 0, 'bulk': 1}
+# Waiting tickets not renewed for this long belong to a dead caller
+WAITING_TICKET_SECONDS = 15
+POLL_SECONDS = 0.2
+
+_priority = contextvars.ContextVar('nebius_priority', default='interactive')
+
+
+class RateLimitTimeout(ProviderError):
+    """No slot was free before the call's deadline; the job is retried later."""
+
+
+def _models():
+    from apps.tasks.models import ProviderRateBucket, ProviderTicket
+    return ProviderRateBucket, ProviderTicket
+
+
+@contextmanager
+def priority(name):
+    """Run the Nebius calls made inside the block with priority `name`"""
+    if name not in PRIORITIES:
+        raise ValueError(f"Unknown priority {name!r}, expected one of {', '.join(PRIORITIES)}")
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+def _try_admit(ticket, limits):
+    """
+    One scheduling round for `ticket`: admit it if it is first in line and a
+    token and a slot are free. Returns (admitted, seconds to wait before the
+    next round).
+    """
+    Bucket, Ticket = _models()
+    now = timezone.now()
+    with transaction.atomic():
+        bucket = Bucket.objects.select_for_update().get(endpoint=ticket.endpoint)
+        Ticket.objects.filter(endpoint=ticket.endpoint, expires_at__lt=now).delete()
+        elapsed = max((now - bucket.refilled_at).total_seconds(), 0)
+        bucket.tokens = min(limits['burst'], bucket.tokens + elapsed * limits['rate'])
+        bucket.refilled_at = now
+        head = Ticket.objects.filter(endpoint=ticket.endpoint, active=False).order_by('priority', 'id').first()
+        in_flight = Ticket.objects.filter(endpoint=ticket.endpoint, active=True).count()
+        admitted = (
+            head is not None and head.id == ticket.id
+            and bucket.tokens >= 1 and in_flight < limits['concurrency']
+        )
+        if admitted:
+            renewed = Ticket.objects.filter(id=ticket.id).update(
+                active=True, expires_at=now + timedelta(seconds=settings.NEBIUS_RATE_LIMIT_LEASE_SECONDS),
+            )
+            # A ticket that expired meanwhile isn't admitted and spends nothing
+            admitted = bool(renewed)
+            if admitted:
+                bucket.tokens -= 1
+        else:
+            renewed = Ticket.objects.filter(id=ticket.id).update(
+                expires_at=now + timedelta(seconds=WAITING_TICKET_SECONDS),
+            )
+        bucket.save(update_fields=['tokens', 'refilled_at'])
+    if not renewed:
+        # Expired while we were away (e.g. a long pause); queue up again
+        ticket.pk = None
+        ticket.expires_at = now + timedelta(seconds=WAITING_TICKET_SECONDS)
+        ticket.save()
+        return False, 0
+    if admitted:
+        return True, 0
+    if bucket.tokens < 1:
+        return False, (1 - bucket.tokens) / limits['rate']
+    return False, POLL_SECONDS
+
+
+def acquire(endpoint, timeout):
+    """
+    Wait up to `timeout` seconds for a slot of `endpoint`; returns the active
+    ticket to release(), or None when the endpoint is not limited. Raises
+    RateLimitTimeout when no slot came free in time.
+    """
+    limits = settings.NEBIUS_RATE_LIMITS.get(endpoint)
+    if not settings.NEBIUS_RATE_LIMIT_ENABLED or not limits:
+        return None
+    Bucket, Ticket = _models()
+    name = current_priority()
+    Bucket.objects.get_or_create(endpoint=endpoint, defaults={'tokens': limits['burst'], 'refilled_at': timezone.now()})
+    ticket = Ticket.objects.create(
+        endpoint=endpoint,
+        priority=PRIORITIES[name],
+        expires_at=timezone.now() + timedelta(seconds=WAITING_TICKET_SECONDS),
+    )
+    started = time.monotonic()
+    try:
+        while True:
+            try:
+                admitted, wait = _try_admit(ticket, limits)
+            except OperationalError:
+                # Lock contention on databases without row locks (SQLite)
+                admitted, wait = False, POLL_SECONDS
+            waited = time.monotonic() - started
+            if admitted:
+                metrics.observe('nebius_queue_wait_seconds', waited, endpoint=endpoint, priority=name)
+                return ticket
+            if waited >= timeout:
+                metrics.increment('nebius_queue_timeouts_total', endpoint=endpoint, priority=name)
+                raise RateLimitTimeout(f"No Nebius {endpoint} slot free after {waited:.1f}s ({name})")
+            # Jittered, so waiting processes don't poll in lockstep
+            time.sleep(min(max(wait, POLL_SECONDS), timeout - waited) * random.uniform(0.8, 1.2))
+    except BaseException:
+        Ticket.objects.filter(id=ticket.id).delete()
+        raise
+
+
+def release(ticket):
+    if ticket is not None:
+        _models()[1].objects.filter(id=ticket.id).delete()
+
+
+@contextmanager
+def slot(endpoint, timeout):
+    """Hold a slot of `endpoint` for the duration of the block"""
+    ticket = acquire(endpoint, timeout)
+    try:
+        yield
+    finally:
+        release(ticket)
+
+
+def _queue_depth_gauge():
+    from django.db.models import Count
+
+    Ticket = _models()[1]
+    names = {rank: name for name, rank in PRIORITIES.items()}
+    rows = Ticket.objects.filter(active=False, expires_at__gte=timezone.now()).values('endpoint', 'priority').annotate(waiting=Count('id'))
+    return [
+        ((('endpoint', row['endpoint']), ('priority', names.get(row['priority'], row['priority']))), row['waiting'])
+        for row in rows
+    ]
+
+
+metrics.register_gauge('nebius_queue_depth', _queue_depth_gauge)
@@ -0,0 +1,103 @@
+"""
+Single-flight, latest-wins coordination of palace re-renders.
+
+Every toggle bumps the parent task's render_requested version and schedules a
+render of that version after a short debounce window. When the render job
+runs it is dropped if a newer version was requested meanwhile (the newer job
+will render the latest state), at most one render per palace is in flight
+(render_lock_until), and the result is only written if no newer render has
+been written already (render_completed), so images never go backwards.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from services import metrics
+from services.notifications import notify_palace_ready
+from services.palace_generator import render_palace_state
+from services.palace_renditions import srcsets
+
+
+def _task_model():
+    from apps.tasks.models import Task
+    return Task
+
+
+def bump_render_version(main_task):
+    """Record that the palace needs a new render and return its version"""
+    Task = _task_model()
+    Task.objects.filter(id=main_task.id).update(render_requested=F('render_requested') + 1)
+    return Task.objects.values_list('render_requested', flat=True).get(id=main_task.id)
+
+
+def request_palace_render(main_task):
+    """Schedule a render of the latest state; bursts of calls collapse into one render"""
+    from apps.tasks.tasks import render_palace
+
+    version = bump_render_version(main_task)
+    render_palace.apply_async((main_task.id, version), countdown=settings.PALACE_RENDER_DEBOUNCE_SECONDS)
+    return version
+
+
+def _acquire_render_lock(task_id):
+    now = timezone.now()
+    return _task_model().objects.filter(
+        Q(render_lock_until__isnull=True) | Q(render_lock_until__lt=now),
+        id=task_id,
+    ).update(render_lock_until=now + timedelta(seconds=settings.PALACE_RENDER_LOCK_SECONDS)) == 1
+
+
+def _release_render_lock(task_id):
+    _task_model().objects.filter(id=task_id).update(render_lock_until=None)
+
+
+def render_version(task_id, version):
+    """
+    Render the palace for `version` unless it was superseded.
+    Returns 'superseded', 'not_ready' (the complete palace is not generated
+    yet), 'busy' (another render is in flight), 'failed' (nothing could be
+    rendered) or 'rendered'.
+    """
+    Task = _task_model()
+    main_task = Task.objects.filter(id=task_id).first()
+    if main_task is None or version < main_task.render_requested or version <= main_task.render_completed:
+        return 'superseded'
+    if not main_task.complete_palace_image:
+        return 'not_ready'
+    if not _acquire_render_lock(task_id):
+        return 'busy'
+    try:
+        name = render_palace_state(main_task)
+        if not name:
+            return 'failed'
+        # Latest wins: never overwrite a render of a newer version
+        if Task.objects.filter(id=task_id, render_completed__lt=version).update(
+            palace_image=name, render_completed=version,
+        ):
+            main_task.palace_image.name = name
+            notify_palace_ready(main_task, main_task.palace_image.url, srcsets(name))
+    finally:
+        _release_render_lock(task_id)
+    return 'rendered'
+
+
+def render_backlog():
+    """(main tasks still processing, palaces with a render not yet completed)"""
+    Task = _task_model()
+    main_tasks = Task.objects.filter(parent__isnull=True)
+    processing = main_tasks.filter(
+        status__in=[Task.Status.PENDING, Task.Status.DECOMPOSING, Task.Status.RENDERING]
+    ).count()
+    behind = main_tasks.filter(render_requested__gt=F('render_completed')).count()
+    return processing, behind
+
+
+def _render_backlog_gauge():
+    processing, behind = render_backlog()
+    return [((('state', 'processing'),), processing), ((('state', 'render_pending'),), behind)]
+
+
+metrics.register_gauge('palace_render_backlog', _render_backlog_gauge)
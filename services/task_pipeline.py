@@ -0,0 +1,160 @@
+import json
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from services.notifications import notify_sub_task_created
+from services.openai_service import analyze_task, analyze_task_stream, analyze_tasks_batch
+
+logger = logging.getLogger(__name__)
+
+
+def _task_model():
+    from apps.tasks.models import Task
+    return Task
+
+
+def _sub_task_row(main_task, sub, order):
+    return _task_model()(
+        session_id=main_task.session_id,
+        parent=main_task,
+        title=sub.get('title', ''),
+        category=sub.get('category', ''),
+        complexity=sub.get('complexity', 1),
+        is_completed=False,
+        order=order,
+        time_estimate=sub.get('time_estimate'),
+    )
+
+
+def _llm_order(sub):
+    try:
+        return int(sub.get('order'))
+    except (TypeError, ValueError):
+        return float('inf')
+
+
+def _sub_task_rows(main_task, subs):
+    """
+    Rows for the sub-tasks of one decomposition, numbered 1..N in the order
+    of completion the LLM gave (ties and missing orders by position). Orders
+    must be unique: each one is a palace layer and a bit of completion_mask.
+    """
+    ranked = sorted(enumerate(subs), key=lambda item: (_llm_order(item[1]), item[0]))
+    return [_sub_task_row(main_task, sub, order) for order, (_, sub) in enumerate(ranked, 1)]
+
+
+def decompose_task(main_task):
+    """
+    Ask the LLM to break the main task down and store its sub-tasks, all in
+    one insert, together with the main task's category, complexity and
+    sub-task count. With DECOMPOSITION_STREAMING each sub-task row is instead
+    created and counted (and pushed to the dashboard) as soon as the model has
+    written it, and only the category and complexity are set at the end.
+
+    The stage can be retried (the stream may break off after some sub-tasks
+    were stored), so it starts by removing any sub-tasks of an earlier attempt.
+    """
+    Task = _task_model()
+    with transaction.atomic():
+        main_task.sub_tasks.all().delete()
+        Task.objects.filter(id=main_task.id).update(sub_tasks_total=0, sub_tasks_completed=0, completion_mask=0)
+    streamed = []
+
+    def create_streamed_sub_task(sub):
+        # Later sub-tasks aren't known yet, so streamed ones are numbered in
+        # the order they are written (the prompt lists them in completion order)
+        sub_task = _sub_task_row(main_task, sub, len(streamed) + 1)
+        # Counted with the row, so a stream that breaks off leaves no drift
+        with transaction.atomic():
+            sub_task.save()
+            Task.objects.filter(id=main_task.id).update(sub_tasks_total=F('sub_tasks_total') + 1)
+        streamed.append(sub_task)
+        notify_sub_task_created(main_task, sub_task)
+
+    if settings.DECOMPOSITION_STREAMING:
+        ai_result = analyze_task_stream(main_task.title, on_sub_task=create_streamed_sub_task)
+    else:
+        ai_result = analyze_task(main_task.title)
+    logger.debug("Decomposition", extra={'task_id': main_task.id, 'result': ai_result})
+    main_task.category = ai_result.get('category', '')
+    main_task.complexity = ai_result.get('complexity', 1)
+    if settings.DECOMPOSITION_STREAMING:
+        # Streamed rows were counted as they were stored
+        sub_tasks = streamed
+        Task.objects.filter(id=main_task.id).update(category=main_task.category, complexity=main_task.complexity)
+    else:
+        with transaction.atomic():
+            sub_tasks = Task.objects.bulk_create(_sub_task_rows(main_task, ai_result.get('sub_tasks', [])))
+            Task.objects.filter(id=main_task.id).update(
+                category=main_task.category,
+                complexity=main_task.complexity,
+                sub_tasks_total=F('sub_tasks_total') + len(sub_tasks),
+            )
+        for sub_task in sub_tasks:
+            notify_sub_task_created(main_task, sub_task)
+    logger.info("Decomposed main task", extra={
+        'task_id': main_task.id, 'category': main_task.category,
+        'complexity': main_task.complexity, 'sub_tasks': len(sub_tasks),
+    })
+    return main_task
+
+
+def parse_task_lines(text):
+    """
+    Task descriptions from an upload: one task per line, either plain text
+    (like texts/example_tasks.txt) or JSONL with a "task_description",
+    "title" or "description" field per line.
+    """
+    descriptions = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] in '{"':
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                item = line
+            if isinstance(item, dict):
+                item = item.get('task_description') or item.get('title') or item.get('description') or ''
+            line = str(item).strip()
+        if line:
+            descriptions.append(line[:255])
+    return descriptions
+
+
+def create_pending_tasks(session, descriptions):
+    """Insert pending main tasks for all descriptions in one query"""
+    Task = _task_model()
+    return Task.objects.bulk_create([
+        Task(
+            session=session,
+            title=description,
+            category='',
+            complexity=1,
+            is_completed=False,
+            status=Task.Status.PENDING,
+        )
+        for description in descriptions
+    ])
+
+
+def decompose_tasks_batch(main_tasks):
+    """Decompose several main tasks with batched LLM calls and store all their sub-tasks at once"""
+    Task = _task_model()
+    results = analyze_tasks_batch([task.title for task in main_tasks], settings.DECOMPOSITION_BATCH_SIZE)
+    sub_tasks = []
+    for main_task, ai_result in zip(main_tasks, results):
+        main_task.category = ai_result.get('category', '')
+        main_task.complexity = ai_result.get('complexity', 1)
+        # New main tasks: the batch's sub-tasks are all they have
+        main_task.sub_tasks_total = len(ai_result.get('sub_tasks', []))
+        sub_tasks.extend(_sub_task_rows(main_task, ai_result.get('sub_tasks', [])))
+    with transaction.atomic():
+        Task.objects.bulk_update(main_tasks, ['category', 'complexity', 'sub_tasks_total'])
+        Task.objects.bulk_create(sub_tasks)
+    logger.info("Decomposed main tasks", extra={'tasks': len(main_tasks), 'sub_tasks': len(sub_tasks)})
+    return main_tasks
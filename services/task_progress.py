@@ -0,0 +1,76 @@
+"""
+Completion counters kept on main tasks.
+
+Every main task stores sub_tasks_total, sub_tasks_completed and
+completion_mask (bit order - 1 set for every completed sub-task, as in
+services.palace_store.completion_bitmask), so progress and the rendered
+palace key are read from its own row instead of aggregated over its
+sub-tasks. The counters are only ever changed incrementally with F()
+expressions, in the same transaction as the sub-task change they follow.
+That relies on sub-task orders being unique, one bit per sub-task:
+services.task_pipeline numbers them 1..N when they are stored.
+"""
+
+from django.db import transaction
+from django.db.models import F
+
+
+# completion_mask is a signed 64-bit column
+MAX_MASK_ORDER = 63
+
+
+def _task_model():
+    from apps.tasks.models import Task
+    return Task
+
+
+def layer_bit(order):
+    return 1 << (order - 1) if order is not None and 0 < order <= MAX_MASK_ORDER else 0
+
+
+def _completion_change(order, completed):
+    """Counter updates for one sub-task becoming completed (or not)"""
+    bit = layer_bit(order)
+    if completed:
+        return {
+            'sub_tasks_completed': F('sub_tasks_completed') + 1,
+            'completion_mask': F('completion_mask').bitor(bit),
+        }
+    return {
+        'sub_tasks_completed': F('sub_tasks_completed') - 1,
+        'completion_mask': F('completion_mask').bitand(~bit),
+    }
+
+
+def toggle_completed(task):
+    """
+    Flip task.is_completed without losing concurrent toggles: the UPDATE only
+    applies if the row still has the state it was read with, otherwise the
+    state is re-read and flipped again. Returns the parent task (None for a
+    main task) with its counters as updated.
+    """
+    Task = _task_model()
+    with transaction.atomic():
+        while not Task.objects.filter(id=task.id, is_completed=task.is_completed).update(
+            is_completed=not task.is_completed,
+        ):
+            task.refresh_from_db(fields=['is_completed'])
+        task.is_completed = not task.is_completed
+        if not task.parent_id:
+            return None
+        Task.objects.filter(id=task.parent_id).update(**_completion_change(task.order, task.is_completed))
+        return Task.objects.get(id=task.parent_id)
+
+
+def sub_task_deleted(sub_task):
+    """Take a deleted sub-task out of its parent's counters"""
+    changes = {'sub_tasks_total': F('sub_tasks_total') - 1}
+    if sub_task.is_completed:
+        changes.update(_completion_change(sub_task.order, False))
+    _task_model().objects.filter(id=sub_task.parent_id).update(**changes)
+
+
+def progress_percentage(main_task):
+    if not main_task.sub_tasks_total:
+        return 0
+    return main_task.sub_tasks_completed / main_task.sub_tasks_total * 100
@@ -0,0 +1,107 @@
+// Client-side palace compositing (PALACE_RENDER_MODE = 'client').
+//
+// Palace images carrying data-palace-atlas-url are replaced by a canvas. The
+// complete palace, the background plate and the layer-mask atlas are loaded
+// once per palace; any completion state is then drawn locally:
+//
+//   1. the completed layers' bands are copied out of the atlas and added up
+//      ('lighter'), giving their union in the alpha channel, which is then
+//      blurred like the server's mask (browsers without canvas filters
+//      show hard edges);
+//   2. the complete palace is kept only where the mask is ('source-in');
+//   3. the result is drawn over the background plate.
+//
+// Palaces whose atlas can't be loaded keep their server-rendered image.
+const PalaceCanvas = (function() {
+    const palaces = {};  // atlas URL -> Promise of {layout, complete, background, atlas}
+
+    function loadImage(url) {
+        return new Promise(function(resolve, reject) {
+            const img = new Image();
+            img.onload = () => resolve(img);
+            img.onerror = () => reject(new Error(`Could not load ${url}`));
+            img.src = url;
+        });
+    }
+
+    function load(url) {
+        if (!palaces[url]) {
+            palaces[url] = fetch(url, {headers: {'X-Requested-With': 'XMLHttpRequest'}})
+                .then(response => {
+                    if (!response.ok) throw new Error(`Palace atlas unavailable (${response.status})`);
+                    return response.json();
+                })
+                .then(layout => Promise.all([
+                    loadImage(layout.complete_url),
+                    loadImage(layout.background_url),
+                    loadImage(layout.atlas_url),
+                ]).then(([complete, background, atlas]) => ({layout, complete, background, atlas})));
+            // Try again next time rather than caching the failure
+            palaces[url].catch(() => delete palaces[url]);
+        }
+        return palaces[url];
+    }
+
+    function compose(palace, completedIds, canvas) {
+        const {layout, complete, background, atlas} = palace;
+        const {width, height} = layout;
+        const completed = new Set(completedIds.map(Number));
+
+        const bands = document.createElement('canvas');
+        bands.width = width;
+        bands.height = height;
+        const bandsCtx = bands.getContext('2d');
+        bandsCtx.globalCompositeOperation = 'lighter';
+        layout.layers.forEach(layer => {
+            if (completed.has(layer.id)) {
+                bandsCtx.drawImage(atlas, 0, layer.y, width, layer.height, 0, layer.top, width, layer.height);
+            }
+        });
+
+        const revealed = document.createElement('canvas');
+        revealed.width = width;
+        revealed.height = height;
+        const revealedCtx = revealed.getContext('2d');
+        revealedCtx.filter = `blur(${layout.blur}px)`;
+        revealedCtx.drawImage(bands, 0, 0);
+        revealedCtx.filter = 'none';
+        revealedCtx.globalCompositeOperation = 'source-in';
+        revealedCtx.drawImage(complete, 0, 0, width, height);
+
+        canvas.width = width;
+        canvas.height = height;
+        const ctx = canvas.getContext('2d');
+        ctx.drawImage(background, 0, 0, width, height);
+        ctx.drawImage(revealed, 0, 0);
+    }
+
+    function canvasFor(img) {
+        // The canvas takes the place (and look) of the palace <picture>
+        const picture = img.closest('picture') || img;
+        let canvas = picture.nextElementSibling;
+        if (!canvas || !canvas.classList.contains('palace-canvas')) {
+            canvas = document.createElement('canvas');
+            canvas.className = `${img.className} palace-canvas`;
+            canvas.style.cssText = img.style.cssText;
+            canvas.setAttribute('role', 'img');
+            canvas.setAttribute('aria-label', img.alt);
+            picture.after(canvas);
+        }
+        picture.style.display = 'none';
+        return canvas;
+    }
+
+    function render(img, completedIds) {
+        // Draw the palace of `img` with the given sub-tasks completed (by
+        // default, as they were when the atlas was fetched)
+        return load(img.getAttribute('data-palace-atlas-url'))
+            .then(palace => compose(palace, completedIds || palace.layout.completed, canvasFor(img)))
+            .catch(error => console.warn(error.message));
+    }
+
+    document.addEventListener('DOMContentLoaded', function() {
+        document.querySelectorAll('img[data-palace-atlas-url]').forEach(img => render(img));
+    });
+
+    return {render: render};
+})();